@@ -31,5 +31,6 @@ setup(name='datreant.core',
       scripts=[],
       license='BSD',
       long_description=open('README.rst').read(),
-      install_requires=['asciitree', 'pathlib', 'scandir', 'six', 'fuzzywuzzy']
+      install_requires=['asciitree', 'pathlib', 'scandir', 'six', 'fuzzywuzzy'],
+      extras_require={'msgpack': ['msgpack']}
       )
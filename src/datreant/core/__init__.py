@@ -19,6 +19,8 @@ _LIMBS = dict()
 _AGGTREELIMBS = dict()
 _AGGLIMBS = dict()
 
+_FORMATS = dict()
+
 # Bring some often used objects into the current namespace
 from .manipulators import discover
 from .treants import Treant, Group
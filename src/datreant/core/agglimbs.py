@@ -12,7 +12,9 @@ from fuzzywuzzy import process
 
 from . import filesystem
 from . import _AGGTREELIMBS, _AGGLIMBS
+from .backends import syncgroup, prefetch
 from .collections import Bundle
+from .indexes import TagIndex, RangeIndex
 from .limbs import Tags
 
 
@@ -51,6 +53,13 @@ class AggLimb(with_metaclass(_AggLimbmeta, object)):
     def __init__(self, collection):
         self._collection = collection
 
+    @property
+    def _read(self):
+        """Context for reading from all members in bulk where possible.
+
+        """
+        return prefetch(member._backend for member in self._collection)
+
 
 @functools.total_ordering
 class AggTags(AggLimb):
@@ -99,7 +108,21 @@ class AggTags(AggLimb):
         return len(self.all)
 
     def __getitem__(self, value):
-        return [member.tags[value] for member in self._collection]
+        return self.index()[value]
+
+    def index(self):
+        """Build an inverted index of the tags of each Treant in collection.
+
+        Each member's tags are read once; tag expressions are then evaluated
+        on the index for all members at once.
+
+        :Returns:
+            *index*
+                :class:`~datreant.core.indexes.TagIndex` of the members'
+                tags as they are now
+
+        """
+        return TagIndex(self._collection)
 
     def __eq__(self, other):
         if isinstance(other, (AggTags, Tags, set, list)):
@@ -192,7 +215,8 @@ class AggTags(AggLimb):
         """Set of tags present among at least one Treant in collection.
 
         """
-        tags = [set(member.tags) for member in self._collection]
+        with self._read:
+            tags = [set(member.tags) for member in self._collection]
         out = set.union(*tags)
 
         return out
@@ -202,7 +226,8 @@ class AggTags(AggLimb):
         """Set of tags present among all Treants in collection.
 
         """
-        tags = [set(member.tags) for member in self._collection]
+        with self._read:
+            tags = [set(member.tags) for member in self._collection]
         out = set.intersection(*tags)
 
         return out
@@ -215,8 +240,9 @@ class AggTags(AggLimb):
               Tags to add. Must be strings or lists of strings.
 
         """
-        for member in self._collection:
-            member.tags.add(*tags)
+        with syncgroup():
+            for member in self._collection:
+                member.tags.add(*tags)
 
     def remove(self, *tags):
         """Remove tags from each Treant in collection.
@@ -228,15 +254,17 @@ class AggTags(AggLimb):
             *tags*
                 Tags to delete.
         """
-        for member in self._collection:
-            member.tags.remove(*tags)
+        with syncgroup():
+            for member in self._collection:
+                member.tags.remove(*tags)
 
     def clear(self):
         """Remove all tags from each Treant in collection.
 
         """
-        for member in self._collection:
-            member.tags.clear()
+        with syncgroup():
+            for member in self._collection:
+                member.tags.clear()
 
     def fuzzy(self, tag, threshold=80, scope='all'):
         """Get a tuple of existing tags that fuzzily match a given one.
@@ -346,26 +374,76 @@ class AggCategories(AggLimb):
         list, list of lists, dict of lists
             Values for the (single) specified category when `keys` is str.
 
+        """
+        self._check(keys)
+        with self._read:
+            categories = [m.categories._dict() for m in self._collection]
+
+        return self._select(keys, categories)
+
+    def index(self, key):
+        """Build a sorted index of the values of a numeric category among
+        the Treants in collection.
+
+        Each member's categories are read once; range, equality, and top-k
+        queries are then answered on the index by bisection. It is kept up
+        to date with changes to the members' categories made in this
+        process.
+
+        Parameters
+        ----------
+        key : str
+            Category to index the values of.
+
+        Returns
+        -------
+        index : :class:`~datreant.core.indexes.RangeIndex`
+            Index of the values of the category.
+
+        """
+        return RangeIndex(self._collection, key)
+
+    def aget(self, keys):
+        """Get values for a given key, list of keys, or set of keys,
+        asynchronously.
+
+        Asynchronous counterpart of getting items, to be awaited. The
+        categories of all members are read concurrently on
+        :mod:`~datreant.core.aio`'s executor.
+
+        Parameters
+        ----------
+        keys : str, list, set
+            Valid key(s) of Categories in this collection.
+
+        """
+        from . import aio
+
+        self._check(keys)
+        return aio.gather(self._collection,
+                          lambda member: member.categories._dict(),
+                          functools.partial(self._select, keys))
+
+    @staticmethod
+    def _check(keys):
+        if not isinstance(keys, (int, float, string_types, bool, list, set,
+                                 type(None))):
+            raise TypeError("Key must be a string, list of strings, or set"
+                            " of strings.")
+
+    @staticmethod
+    def _select(keys, categories):
+        """Pick values for `keys` out of the categories of each member.
+
         """
         if keys is None:
             return None
-
-        members = self._collection
-        if isinstance(keys, (int, float, string_types, bool)):
-            k = keys
-            return [m.categories[k] if k in m.categories else None
-                    for m in members]
         elif isinstance(keys, list):
-            return [[m.categories[k] if k in m.categories else None
-                    for m in members]
-                    for k in keys]
+            return [[c.get(k) for c in categories] for k in keys]
         elif isinstance(keys, set):
-            return {k: [m.categories[k] if k in m.categories else None
-                    for m in members]
-                    for k in keys}
+            return {k: [c.get(k) for c in categories] for k in keys}
         else:
-            raise TypeError("Key must be a string, list of strings, or set"
-                            " of strings.")
+            return [c.get(keys) for c in categories]
 
     def __setitem__(self, key, values):
         """Set the value of categories for each Treant in the collection.
@@ -392,21 +470,24 @@ class AggCategories(AggLimb):
 
         members = self._collection
         if isinstance(values, (int, float, string_types, bool)):
-            for m in members:
-                m.categories.add({key: values})
+            with syncgroup():
+                for m in members:
+                    m.categories.add({key: values})
         elif isinstance(values, (list, tuple)):
             if len(values) != len(members):
                 raise ValueError("Values must be a list of the same length as"
                                  " the number of members in the collection.")
-            for m, v in zip(members, values):
-                m.categories[key] = v
+            with syncgroup():
+                for m, v in zip(members, values):
+                    m.categories[key] = v
 
     def __delitem__(self, category):
         """Remove *category* from each Treant in collection.
 
         """
-        for member in self._collection:
-            member.categories.remove(category)
+        with syncgroup():
+            for member in self._collection:
+                member.categories.remove(category)
 
     def __iter__(self):
         """Iterator over Categories common to all Treants in collection.
@@ -429,12 +510,14 @@ class AggCategories(AggLimb):
         dict
             All unique Categories among members.
         """
-        keys = [set(member.categories.keys()) for member in self._collection]
-        keys = set.union(*keys)
+        with self._read:
+            keys = [set(member.categories.keys())
+                    for member in self._collection]
+            keys = set.union(*keys)
 
-        return {k: [m.categories[k] if k in m.categories else None
-                for m in self._collection]
-                for k in keys}
+            return {k: [m.categories[k] if k in m.categories else None
+                    for m in self._collection]
+                    for k in keys}
 
     @property
     def all(self):
@@ -445,12 +528,14 @@ class AggCategories(AggLimb):
         dict
             Categories common to all members.
         """
-        keys = [set(member.categories.keys()) for member in self._collection]
-        keys = set.intersection(*keys)
+        with self._read:
+            keys = [set(member.categories.keys())
+                    for member in self._collection]
+            keys = set.intersection(*keys)
 
-        return {k: [m.categories[k] if k in m.categories else None
-                for m in self._collection]
-                for k in keys}
+            return {k: [m.categories[k] if k in m.categories else None
+                    for m in self._collection]
+                    for k in keys}
 
     def add(self, categorydict=None, **categories):
         """Add any number of categories to each Treant in collection.
@@ -475,8 +560,9 @@ class AggCategories(AggLimb):
             Categories to add. Keyword used as key, value used as value.
 
         """
-        for member in self._collection:
-            member.categories.add(categorydict, **categories)
+        with syncgroup():
+            for member in self._collection:
+                member.categories.add(categorydict, **categories)
 
     def remove(self, *categories):
         """Remove categories from Treant.
@@ -489,15 +575,17 @@ class AggCategories(AggLimb):
         categories : str
             Categories to delete.
         """
-        for member in self._collection:
-            member.categories.remove(*categories)
+        with syncgroup():
+            for member in self._collection:
+                member.categories.remove(*categories)
 
     def clear(self):
         """Remove all categories from all Treants in collection.
 
         """
-        for member in self._collection:
-            member.categories.clear()
+        with syncgroup():
+            for member in self._collection:
+                member.categories.clear()
 
     def keys(self, scope='all'):
         """Get the keys present among Treants in collection.
@@ -515,7 +603,9 @@ class AggCategories(AggLimb):
             Present keys.
 
         """
-        keys = [set(member.categories.keys()) for member in self._collection]
+        with self._read:
+            keys = [set(member.categories.keys())
+                    for member in self._collection]
 
         if scope == 'all':
             out = set.intersection(*keys)
@@ -544,8 +634,9 @@ class AggCategories(AggLimb):
             the same order as the keys from ``AggCategories.keys``.
 
         """
-        keys = self.keys(scope=scope)
-        return self[keys]
+        with self._read:
+            keys = self.keys(scope=scope)
+            return self[keys]
 
     def groupby(self, keys):
         """Return groupings of Treants based on values of Categories.
@@ -576,6 +667,13 @@ class AggCategories(AggLimb):
         if keys is None:
             return None
 
+        with self._read:
+            return self._groupby(keys)
+
+    def _groupby(self, keys):
+        """Group members by `keys`; see :meth:`groupby`.
+
+        """
         members = self._collection
         if isinstance(keys, (string_types)):
             catvals = members.categories[keys]
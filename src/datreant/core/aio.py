@@ -0,0 +1,226 @@
+"""
+Asynchronous counterparts of blocking treant operations, for :mod:`asyncio`.
+
+Reads of state and waits on locks are run on a bounded pool of threads, so
+they don't block the event loop; operations on many treants run
+concurrently, up to the size of the pool. Operations on a single treant are
+run one at a time, in the order they were awaited.
+
+Requires Python 3.6 or later.
+
+"""
+import time
+import random
+import asyncio
+import weakref
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends.core import LockTimeoutError
+
+# number of threads running treant operations; read when the pool is made
+maxworkers = 16
+
+_executor = None
+
+# guards serializing operations on each backend
+_guards = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    """Get the executor treant operations are run on.
+
+    A :class:`~concurrent.futures.ThreadPoolExecutor` with `maxworkers`
+    threads is made on first use, unless one was given with
+    :func:`set_executor`.
+
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=maxworkers)
+
+    return _executor
+
+
+def set_executor(executor):
+    """Set the executor treant operations are run on.
+
+    :Arguments:
+        *executor*
+            a :class:`concurrent.futures.Executor` running its calls in
+            threads of this process; ``None`` to make a new one with
+            `maxworkers` threads on next use
+
+    """
+    global _executor
+    _executor = executor
+
+
+def _current_task():
+    try:
+        return asyncio.current_task()
+    except AttributeError:
+        return asyncio.Task.current_task()
+
+
+class _Guard(object):
+    """Lock serializing operations on a backend, reentrant within a task.
+
+    Backends are not safe for use by several threads at once, and a session
+    leaves a backend's lock held for operations done within it; this keeps
+    other tasks out in both cases.
+
+    """
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner = None
+        self._depth = 0
+
+    async def acquire(self):
+        task = _current_task()
+        if task is None or self._owner is not task:
+            await self._lock.acquire()
+            self._owner = task
+
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            self._owner = None
+            self._lock.release()
+
+
+def _guard(treant):
+    # guards only work within the event loop they were first used in
+    loop = asyncio.get_event_loop()
+    try:
+        guardloop, guard = _guards[treant._backend]
+    except KeyError:
+        guardloop = None
+
+    if guardloop is not loop:
+        guard = _Guard()
+        _guards[treant._backend] = (loop, guard)
+
+    return guard
+
+
+async def run(function, *args, **kwargs):
+    """Run a blocking function on the executor, and get its result.
+
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(function, *args, **kwargs))
+
+
+async def call(treant, function, *args, **kwargs):
+    """Run a blocking function working on `treant` on the executor.
+
+    Waits for any other operation on `treant` from another task to finish
+    first. Within a session, the function is run in place instead, under
+    the session's lock.
+
+    """
+    guard = _guard(treant)
+    await guard.acquire()
+    try:
+        if treant._backend.fdlock:
+            # locks are held by a thread; the executor's would wait on ours
+            return function(*args, **kwargs)
+        return await run(function, *args, **kwargs)
+    finally:
+        guard.release()
+
+
+async def gather(treants, function, combine=list):
+    """Call `function` on each of `treants` concurrently.
+
+    :Arguments:
+        *treants*
+            iterable of treants
+        *function*
+            function to call with each treant
+
+    :Keywords:
+        *combine*
+            function called with the list of results
+
+    :Returns:
+        *results*
+            output of `combine`; the list of results, in the order of
+            `treants`, by default
+
+    """
+    return combine(await asyncio.gather(*[call(treant, function, treant)
+                                          for treant in treants]))
+
+
+class Session(object):
+    """Asynchronous context manager for :meth:`Treant.session`.
+
+    Locks are held by a thread, and the session's lock by the event loop's,
+    so that blocking operations done within the session from the task that
+    opened it are done under it. The lock is polled for without blocking
+    the loop. Other tasks wait for the session to end before operating on
+    the treant.
+
+    """
+    def __init__(self, treant, mode='w', timeout=None):
+        self._treant = treant
+        self._mode = mode
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        self._guard = _guard(self._treant)
+        await self._guard.acquire()
+        try:
+            await self._enter()
+        except BaseException:
+            self._guard.release()
+            raise
+
+        return self._treant
+
+    async def _enter(self):
+        backend = self._treant._backend
+        timeout = self._timeout
+        if timeout is None:
+            timeout = backend.locktimeout
+
+        start = time.time()
+        delay = backend.lockbackoff
+        while True:
+            context = self._treant.session(self._mode, timeout=0)
+            timeouts = backend.lockstats['timeouts']
+            try:
+                context.__enter__()
+            except LockTimeoutError:
+                # a failed poll is no timeout
+                backend.lockstats['timeouts'] = timeouts
+                if timeout is not None and time.time() - start >= timeout:
+                    backend.lockstats['timeouts'] += 1
+                    raise LockTimeoutError(
+                        "Could not lock '{}' within {} seconds".format(
+                            backend.filename, timeout))
+            else:
+                self._context = context
+                return
+
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(2 * delay, backend.lockbackoffmax)
+
+    async def __aexit__(self, *exc):
+        try:
+            return self._context.__exit__(*exc)
+        finally:
+            self._guard.release()
+
+
+async def members(bundle):
+    """Iterate asynchronously over the members of `bundle`.
+
+    """
+    for member in await run(bundle._list):
+        yield member
@@ -8,6 +8,15 @@ datreant.backends --- low-level file backends
 =============================================
 
 """
-from .core import File, FileSerial
+from .core import (File, FileSerial, JSONFile, GzipJSONFile, XzJSONFile,
+                   MsgpackFile, MarshalFile, LockTimeoutError, DescriptorPool,
+                   syncgroup)
+from .journal import JournalFile
+from .sqlite import RootStore, SQLiteFile, prefetch
+from .sharded import ShardedFile
+from .members import MemberTable, MemberTableFile
 
-__all__ = ['File', 'FileSerial']
+__all__ = ['File', 'FileSerial', 'JSONFile', 'GzipJSONFile', 'XzJSONFile',
+           'MsgpackFile', 'MarshalFile', 'JournalFile', 'RootStore',
+           'SQLiteFile', 'ShardedFile', 'MemberTable', 'MemberTableFile',
+           'LockTimeoutError', 'DescriptorPool', 'syncgroup', 'prefetch']
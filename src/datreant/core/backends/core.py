@@ -4,12 +4,766 @@
 
 import os
 import sys
+import time
+import uuid
+import errno
 import fcntl
+import random
+import shutil
+import socket
 import warnings
+import threading
+import collections
 import json
+import io
+import gzip
+import marshal
 from functools import wraps
 from contextlib import contextmanager
 
+from six import with_metaclass
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from .. import _FORMATS
+
+
+class _FileSerialmeta(type):
+    def __init__(cls, name, bases, classdict):
+        type.__init__(type, name, bases, classdict)
+
+        # only classes defining a format get registered
+        try:
+            ext = classdict['_ext']
+        except KeyError:
+            pass
+        else:
+            _FORMATS[ext] = cls
+
+
+class LockTimeoutError(IOError):
+    """Raised when a lock on a file could not be obtained in time.
+
+    """
+
+
+class DescriptorPool(object):
+    """Bounded pool of descriptors kept open between locks.
+
+    Descriptors are kept by path, one for each, and reused by any
+    :class:`File` using the pool. Once more than `maxsize` descriptors are
+    open, the least recently used ones are closed; a descriptor in use,
+    such as one holding a lock, is never closed. Since closing any
+    descriptor of a file drops the process's :func:`fcntl.lockf` locks on
+    it, a path never has more than one.
+
+    :Arguments:
+        *maxsize*
+            number of descriptors to keep open
+
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+
+        # least recently used first
+        self._fds = collections.OrderedDict()
+        self._inuse = dict()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fds)
+
+    def acquire(self, path, opener):
+        """Get the descriptor for `path`, opening it with `opener` if needed.
+
+        The descriptor is in use until given back with :meth:`release`.
+
+        """
+        with self._lock:
+            self._check_pid()
+            try:
+                fd = self._fds.pop(path)
+            except KeyError:
+                fd = opener()
+
+            self._fds[path] = fd
+            self._inuse[path] = self._inuse.get(path, 0) + 1
+            return fd
+
+    def release(self, path):
+        """Give back the descriptor for `path`.
+
+        """
+        with self._lock:
+            self._check_pid()
+            if self._inuse.get(path, 0) > 1:
+                self._inuse[path] -= 1
+            else:
+                self._inuse.pop(path, None)
+            self._trim(self.maxsize)
+
+    def discard(self, path):
+        """Close the descriptor for `path` if not in use.
+
+        """
+        with self._lock:
+            self._check_pid()
+            if path in self._fds and path not in self._inuse:
+                os.close(self._fds.pop(path))
+
+    def clear(self):
+        """Close all descriptors not in use.
+
+        """
+        with self._lock:
+            self._check_pid()
+            self._trim(0)
+
+    def _trim(self, maxsize):
+        excess = len(self._fds) - maxsize
+        for path in list(self._fds):
+            if excess <= 0:
+                break
+            if path not in self._inuse:
+                os.close(self._fds.pop(path))
+                excess -= 1
+
+    def _check_pid(self):
+        # a forked child must not share the parent's open file descriptions,
+        # or it would share its flock locks too
+        if self._pid != os.getpid():
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+            self._inuse.clear()
+            self._pid = os.getpid()
+
+
+class _ProcessLock(object):
+    """Reader/writer lock on a path shared by all Files in this process.
+
+    Threads in this process wait on each other here, and the lock is only
+    taken from other processes by the first thread to get it, and given
+    back by the last to let go. Any number of threads may share it, and the
+    thread holding it exclusively may take it again either way.
+
+    This class locks only within the process; subclasses lock against other
+    processes too, through a single descriptor for the path. That
+    descriptor is needed since :func:`fcntl.lockf` locks belong to the
+    process and are all dropped when any descriptor for the file is closed,
+    while :func:`fcntl.flock` locks on two descriptors for one file would
+    block each other.
+
+    Locks are obtained with :meth:`get`, and dropped with :meth:`put` once
+    no longer needed.
+
+    """
+    # locks by class and path, for the process that made them
+    _locks = dict()
+    _pid = None
+
+    # reentrant, since Files dropping their reference on garbage collection
+    # can do so within it
+    _guard = threading.RLock()
+
+    # if True, the descriptor stays open between locks unless pooled
+    _keepopen = True
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.refs = 0
+
+        self.fd = None
+        self.mode = None
+
+        # pool the descriptor was taken from, if any
+        self._pool = None
+
+        # number of locks held by each thread, and of shared locks held
+        # only within the process
+        self._holders = collections.Counter()
+        self._local = collections.Counter()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def get(cls, path):
+        """Get the lock for `path`, adding a reference to it.
+
+        """
+        with cls._guard:
+            # a forked child must not share the parent's open file
+            # descriptions, or it would share its flock locks too
+            if _ProcessLock._pid != os.getpid():
+                _ProcessLock._locks = dict()
+                _ProcessLock._pid = os.getpid()
+
+            try:
+                lock = _ProcessLock._locks[(cls, path)]
+            except KeyError:
+                lock = _ProcessLock._locks[(cls, path)] = cls(path)
+
+            lock.refs += 1
+            return lock
+
+    def put(self):
+        """Remove a reference to the lock; the last closes its descriptor.
+
+        """
+        with self._guard:
+            # a descriptor inherited from a parent process isn't ours to close
+            if self.pid != os.getpid():
+                return
+
+            self.refs -= 1
+            if self.refs > 0 or self.mode is not None:
+                return
+
+            key = (type(self), self.path)
+            if self._locks.get(key) is self:
+                del self._locks[key]
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    def lock(self, operation, blocking=True, pool=None, local=False):
+        """Lock the path for the calling thread.
+
+        :Arguments:
+            *operation*
+                :data:`fcntl.LOCK_SH` or :data:`fcntl.LOCK_EX`
+
+        :Keywords:
+            *blocking*
+                if False, don't wait if the lock can't be obtained immediately
+            *pool*
+                :class:`DescriptorPool` to take the descriptor from while the
+                lock is held
+            *local*
+                if True, take a shared lock only against other threads of
+                this process
+
+        :Returns:
+            *success*
+                True if lock successfully obtained
+
+        """
+        me = threading.current_thread().ident
+        with self._cond:
+            while True:
+                if self.mode == fcntl.LOCK_EX and me in self._holders:
+                    break
+                elif operation == fcntl.LOCK_EX and (
+                        me in self._local or
+                        self.mode == fcntl.LOCK_SH and me in self._holders):
+                    # we would wait on ourselves
+                    raise IOError("Cannot lock '{}' exclusively while "
+                                  "holding a shared lock on "
+                                  "it".format(self.path))
+                elif operation == fcntl.LOCK_SH and (
+                        local and self.mode != fcntl.LOCK_EX or
+                        self.mode == fcntl.LOCK_SH):
+                    break
+                elif self.mode is None and (operation == fcntl.LOCK_SH or
+                                            not self._local):
+                    # no one in this process has the lock; get it from the
+                    # others
+                    if not self._lockpath(operation, blocking, pool):
+                        return False
+                    self.mode = operation
+                    break
+
+                if not blocking:
+                    return False
+                self._cond.wait()
+
+            if local:
+                self._local[me] += 1
+            else:
+                self._holders[me] += 1
+
+            return True
+
+    def unlock(self, local=False):
+        """Release one lock held by the calling thread.
+
+        :Keywords:
+            *local*
+                if True, release a lock taken with `local`
+
+        """
+        me = threading.current_thread().ident
+        with self._cond:
+            holders = self._local if local else self._holders
+            holders[me] -= 1
+            if holders[me] <= 0:
+                del holders[me]
+
+            if not self._holders and self.mode is not None:
+                self._unlockpath()
+                self.mode = None
+                self._release_fd()
+
+            self._cond.notify_all()
+
+    def _lockpath(self, operation, blocking, pool):
+        """Lock the path against other processes.
+
+        """
+        return True
+
+    def _unlockpath(self):
+        """Unlock the path for other processes.
+
+        """
+
+    def _release_fd(self):
+        """Let go of the descriptor once the lock is free.
+
+        """
+
+    def _open(self):
+        """Open the descriptor locks are applied to.
+
+        """
+        raise NotImplementedError
+
+    def _lockfd(self, operation):
+        """Apply lock `operation` to the descriptor.
+
+        """
+        raise NotImplementedError
+
+
+class _FcntlLock(_ProcessLock):
+    """Lock on a path shared by all Files in this process, applied to other
+    processes with a single descriptor for it.
+
+    """
+    def _lockpath(self, operation, blocking, pool):
+        if self.fd is None:
+            if pool is None:
+                self.fd = self._open()
+            else:
+                self.fd = pool.acquire(self.path, self._open)
+                self._pool = pool
+
+        try:
+            self._lockfd(operation if blocking
+                         else operation | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            self._release_fd()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+        return True
+
+    def _unlockpath(self):
+        self._lockfd(fcntl.LOCK_UN)
+
+    def _release_fd(self):
+        # a pooled descriptor goes back to the pool while the lock is free
+        if self._pool is not None:
+            self._pool.release(self.path)
+            self._pool = None
+            self.fd = None
+        elif not self._keepopen and self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _DirLock(_FcntlLock):
+    """Lock on a directory with :func:`fcntl.flock`, shared by all Files in
+    this process.
+
+    """
+    def _open(self):
+        return os.open(self.path, os.O_RDONLY)
+
+    def _lockfd(self, operation):
+        fcntl.flock(self.fd, operation)
+
+
+class _ProxyLock(_FcntlLock):
+    """Lock on a proxy file with :func:`fcntl.lockf`, shared by all Files in
+    this process.
+
+    The descriptor is opened for each lock unless pooled, as for plain
+    files. It is opened for writing where the proxy file allows it, since
+    exclusive locks need that.
+
+    """
+    _keepopen = False
+
+    def _open(self):
+        try:
+            return os.open(self.path, os.O_RDWR)
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EROFS):
+                raise
+            return os.open(self.path, os.O_RDONLY)
+
+    def _lockfd(self, operation):
+        fcntl.lockf(self.fd, operation)
+
+
+class _LeaseLock(_ProcessLock):
+    """Lock on a path shared by all Files in this process, applied to other
+    processes, on this host or any other, with lease files.
+
+    An exclusive lease is a directory made at the path with
+    :func:`os.mkdir`, and a shared lease a file made with ``O_EXCL`` in a
+    directory of shared leases next to it. Both are atomic on filesystems
+    where fcntl locks are slow or unavailable, such as Lustre or GPFS. A
+    writer takes its lease before waiting for the shared leases to go, so
+    readers coming after it wait for it.
+
+    Each lease records the host, process, and a token of its owner, and is
+    renewed by touching it from a heartbeat thread every third of
+    `leasetime` seconds. A lease not renewed for `leasetime` seconds, or
+    held by a process of this host that no longer exists, is stale, and is
+    broken by the next process wanting the lock. Clocks of all hosts must
+    agree to well within `leasetime`.
+
+    """
+    leasetime = 30.0
+
+    # seconds between attempts while blocking
+    _poll = 0.01
+
+    def __init__(self, path):
+        super(_LeaseLock, self).__init__(path)
+        self.shared = path + 's'
+
+        # token of our exclusive lease, and our shared lease file
+        self._token = None
+        self._lease = None
+
+    def _lockpath(self, operation, blocking, pool):
+        while True:
+            if operation == fcntl.LOCK_EX:
+                held = self._exclusive(blocking)
+            else:
+                held = self._shared()
+
+            if held or not blocking:
+                return held
+            time.sleep(random.uniform(self._poll / 2, self._poll))
+
+    def _unlockpath(self):
+        if self._lease is not None:
+            _heartbeat.drop(self._lease)
+            _remove(self._lease)
+            self._lease = None
+        elif self._token is not None:
+            owner = os.path.join(self.path, 'owner')
+            _heartbeat.drop(owner)
+
+            # a lease broken as stale may have been taken by someone else
+            if _owner(owner).get('token') == self._token:
+                shutil.rmtree(self.path, ignore_errors=True)
+            else:
+                warnings.warn("Lease on '{}' was broken while "
+                              "held".format(self.path))
+            self._token = None
+
+    def _exclusive(self, blocking):
+        """Take the exclusive lease, then wait for shared leases to go.
+
+        """
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                os.mkdir(self.path)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            # a stale lease is out of the way once broken
+            if not self._break(self.path):
+                return False
+
+        owner = os.path.join(self.path, 'owner')
+        try:
+            _writeowner(owner, token)
+        except BaseException:
+            shutil.rmtree(self.path, ignore_errors=True)
+            raise
+
+        self._token = token
+        _heartbeat.add(owner, self.leasetime)
+
+        while self._readers():
+            if not blocking:
+                self._unlockpath()
+                return False
+            time.sleep(random.uniform(self._poll / 2, self._poll))
+
+        return True
+
+    def _shared(self):
+        """Take a shared lease, unless there is an exclusive one.
+
+        """
+        if self._writer():
+            return False
+
+        try:
+            os.mkdir(self.shared)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        token = uuid.uuid4().hex
+        lease = os.path.join(self.shared, '{}.{}.{}'.format(
+            _HOSTNAME, os.getpid(), token))
+        _writeowner(lease, token)
+
+        # a writer may have come in meanwhile, without seeing our lease
+        if self._writer():
+            _remove(lease)
+            return False
+
+        self._lease = lease
+        _heartbeat.add(lease, self.leasetime)
+        return True
+
+    def _writer(self):
+        """Check for a live exclusive lease, breaking a stale one.
+
+        """
+        return os.path.exists(self.path) and not self._break(self.path)
+
+    def _readers(self):
+        """Check for live shared leases, breaking stale ones.
+
+        """
+        try:
+            names = os.listdir(self.shared)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        live = False
+        for name in names:
+            lease = os.path.join(self.shared, name)
+            if self._stale(lease, _owner(lease)):
+                _remove(lease)
+            else:
+                live = True
+
+        return live
+
+    def _stale(self, path, owner):
+        """Check if the lease at `path`, with `owner`, is stale.
+
+        """
+        if owner.get('host') == _HOSTNAME and 'pid' in owner:
+            try:
+                os.kill(owner['pid'], 0)
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    return True
+
+        try:
+            renewed = os.stat(path).st_mtime
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return True
+
+        return time.time() - renewed > self.leasetime
+
+    def _break(self, path):
+        """Break the exclusive lease at `path` if it is stale.
+
+        :Returns:
+            *broken*
+                True if there is no live lease at `path` anymore
+
+        """
+        ownerfile = os.path.join(path, 'owner')
+        owner = _owner(ownerfile)
+
+        # its owner may not have written itself in yet
+        if not self._stale(ownerfile if owner else path, owner):
+            return False
+
+        # only one of any processes breaking it at once gets it out of the
+        # way; if it was taken anew since we looked, it goes back
+        broken = '{}.broken.{}'.format(path, uuid.uuid4().hex)
+        try:
+            os.rename(path, broken)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return True
+
+        if _owner(os.path.join(broken, 'owner')).get('token') != \
+                owner.get('token'):
+            try:
+                os.rename(broken, path)
+            except OSError:
+                pass
+            else:
+                return False
+
+        shutil.rmtree(broken, ignore_errors=True)
+        return True
+
+
+_HOSTNAME = socket.gethostname()
+
+
+def _owner(path):
+    """Get the owner recorded in the lease file at `path`; empty if none.
+
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return dict()
+
+
+def _writeowner(path, token):
+    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'host': _HOSTNAME, 'pid': os.getpid(), 'token': token}, f)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class _Heartbeat(object):
+    """Thread renewing the leases held by this process.
+
+    """
+    def __init__(self):
+        self._leases = dict()
+        self._guard = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def add(self, path, leasetime):
+        with self._guard:
+            self._check_pid()
+            self._leases[path] = leasetime
+        self._wake.set()
+
+    def drop(self, path):
+        with self._guard:
+            self._leases.pop(path, None)
+
+    def _check_pid(self):
+        # a forked child holds none of its parent's leases, nor its thread
+        if self._pid != os.getpid():
+            self._leases.clear()
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run,
+                                      name='datreant-lease-heartbeat')
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            with self._guard:
+                leases = list(self._leases.items())
+
+            for path, leasetime in leases:
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    pass
+
+            self._wake.clear()
+            self._wake.wait(min([leasetime for _, leasetime in leases] or
+                                [3.0]) / 3)
+
+
+_heartbeat = _Heartbeat()
+
+
+class _PerThread(object):
+    """Attribute of a File with a value of its own in each thread.
+
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return getattr(obj._threadlocal, self.name, None)
+
+    def __set__(self, obj, value):
+        setattr(obj._threadlocal, self.name, value)
+
+
+# files and directories awaiting fsync in this thread's open sync group
+_syncgroups = threading.local()
+
+
+@contextmanager
+def syncgroup():
+    """Context in which fsyncs for writes with 'group' durability are batched.
+
+    Writes made within the context by files with `durability` 'group' are
+    not synced as they happen; instead, every file and directory written
+    is synced once when the outermost context exits. Nested contexts join
+    the outermost one.
+
+    """
+    if getattr(_syncgroups, 'pending', None) is not None:
+        yield
+        return
+
+    files, dirs = _syncgroups.pending = (set(), set())
+    try:
+        yield
+    finally:
+        _syncgroups.pending = None
+        for path in files:
+            _fsync(path)
+        for path in dirs:
+            _fsync(path)
+
+
+def _fsync(path):
+    """Flush a file or directory to disk by path.
+
+    Files that no longer exist are skipped.
+
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 
 class File(object):
     """Generic File object base class. Implements file locking and reloading
@@ -22,23 +776,160 @@ class File(object):
     respectively. It handles any other low-level tasks for maintaining file
     integrity.
 
+    How locks are applied is given by `locking`:
+
+    'proxy'
+        locks are applied with :func:`fcntl.lockf` to a hidden proxy file
+        next to the file, opened anew for each lock
+    'flock'
+        locks are applied with :func:`fcntl.flock` to the directory
+        containing the file, through a descriptor shared by all Files for
+        that directory in the process and kept open between locks; no
+        proxy file is created. All files in a directory share a lock. Not
+        all network filesystems support this.
+    'lease'
+        locks are lease files next to the file, made atomically without
+        fcntl locks, for parallel filesystems such as Lustre or GPFS where
+        those are slow or disabled. Leases are renewed by a thread of the
+        process holding them every third of `leasetime` seconds; a lease
+        not renewed for `leasetime` seconds, or held by a dead process on
+        the same host, is broken by the next process wanting the lock. Set
+        `locking` on this class to use it for all files in a process.
+
+    Either way, threads of one process wait on each other for a lock as
+    other processes do: all Files for the same lock path in a
+    process share a reader/writer lock, and only the first thread to get it
+    locks against other processes. Each thread has its own lock state on a
+    File, so threads may use the same File at once. A thread holding a lock
+    exclusively may read or write through any File sharing it.
+
+    Waiting for a lock is unbounded by default. If `locktimeout` is set,
+    attempts to get a lock are retried with jittered exponential backoff,
+    starting from `lockbackoff` seconds and up to `lockbackoffmax` seconds
+    between attempts, until `locktimeout` seconds have passed; a
+    :exc:`LockTimeoutError` is then raised. A timeout of 0 gives a single
+    attempt. Time spent waiting for locks is recorded in `lockstats`.
+
+    :meth:`read` and :meth:`write` are context managers holding a shared or
+    exclusive lock for their duration, waiting at most `timeout` seconds
+    for it. They may be given the name of the `limb` that will use the
+    state within them; backends keeping the items of the state apart can
+    then lock and read only that limb's item.
+
+    The descriptor locks are applied to is opened anew for each lock unless
+    `fdpool` is set to a :class:`DescriptorPool`, in which case it is kept
+    open in the pool and reused.
+
+    How writes are made durable is given by `durability`:
+
+    'fast'
+        nothing is synced; a system crash can lose recent writes
+    'safe'
+        the written file is synced before it replaces the old one, and
+        its directory after, so completed writes survive a system crash
+    'group'
+        like 'safe', but within a :func:`syncgroup` the syncs of
+        directories are deferred to the end of the group; a crash before
+        then can lose any of the group's writes, but never leaves a
+        partially-written file in place of the old one
+
     :Arguments:
         *filename*
             name of file on disk object corresponds to
 
+    :Keywords:
+        *locking*
+            how locks are applied; the class attribute of the same name
+            gives the default
+        *locktimeout*
+            maximum time in seconds to wait for a lock; ``None`` waits
+            indefinitely; the class attribute of the same name gives the
+            default
+        *durability*
+            how writes are made durable; the class attribute of the same
+            name gives the default
+        *fdpool*
+            :class:`DescriptorPool` to keep lock descriptors in; the class
+            attribute of the same name gives the default
+        *leasetime*
+            seconds after which a lease not renewed is stale, for 'lease'
+            locking; the class attribute of the same name gives the default
+        *readonly*
+            if True, the file is never locked exclusively, written, or moved;
+            attempts to do so raise an :exc:`IOError`
+
     """
+    locking = 'proxy'
+    _lockings = ('proxy', 'flock', 'lease')
+
+    leasetime = 30.0
+
+    durability = 'fast'
+
+    fdpool = None
+
+    readonly = False
+
+    locktimeout = None
+    lockbackoff = 0.001
+    lockbackoffmax = 0.1
+
+    # lock shared within this process, on the file's directory for 'flock'
+    # locking, its proxy file for 'proxy' locking, or its lease for 'lease'
+    # locking
+    _proclock = None
+    _proclocking = None
+
+    # each thread has its own lock on the file, and handle for it
+    fd = _PerThread('fd')
+    fdlock = _PerThread('fdlock')
+    handle = _PerThread('handle')
 
     def __init__(self, filename, **kwargs):
         self.filename = os.path.abspath(filename)
-        self.handle = None
-        self.fd = None
-        self.fdlock = None
+        self._threadlocal = threading.local()
+
+        if 'locking' in kwargs:
+            self.locking = kwargs['locking']
+
+        if 'locktimeout' in kwargs:
+            self.locktimeout = kwargs['locktimeout']
+
+        # number of locks obtained, total and longest time spent waiting for
+        # them, and number of times we gave up waiting
+        self.lockstats = {'locks': 0, 'waited': 0.0, 'maxwait': 0.0,
+                          'timeouts': 0}
+
+        if 'durability' in kwargs:
+            self.durability = kwargs['durability']
+
+        if 'fdpool' in kwargs:
+            self.fdpool = kwargs['fdpool']
+
+        if 'leasetime' in kwargs:
+            self.leasetime = kwargs['leasetime']
+
+        if 'readonly' in kwargs:
+            self.readonly = kwargs['readonly']
+
+        if self.locking not in self._lockings:
+            raise ValueError("Unknown locking '{}'".format(self.locking))
+
+        if self.durability not in ('fast', 'safe', 'group'):
+            raise ValueError(
+                "Unknown durability '{}'".format(self.durability))
 
         # we apply locks to a proxy file to avoid creating an HDF5 file
         # without an exclusive lock on something; important for multiprocessing
         proxy = "." + os.path.basename(self.filename) + ".proxy"
         self.proxy = os.path.join(os.path.dirname(self.filename), proxy)
 
+        lease = "." + os.path.basename(self.filename) + ".lease"
+        self.lease = os.path.join(os.path.dirname(self.filename), lease)
+
+        if self.locking != 'proxy':
+            return
+
         # we create the file if it doesn't exist; if it does, an exception is
         # raised and we catch it; this is necessary to ensure the file exists
         # so we can use it for locks
@@ -52,6 +943,17 @@ class File(object):
             else:
                 raise
 
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Close any descriptors kept open between locks.
+
+        """
+        if self._proclock is not None:
+            self._proclock.put()
+        self._proclock = None
+
     def get_location(self):
         """Get File basedir.
 
@@ -62,7 +964,58 @@ class File(object):
         """
         return os.path.dirname(self.filename)
 
-    def _shlock(self, fd):
+    def check_location(self, location):
+        """Check that the file can be moved to directory `location`.
+
+        :Raises:
+            *ValueError*
+                if the file can't be moved there
+            *IOError*
+                if the file is read-only
+
+        """
+        self._check_writable()
+
+    def _check_writable(self):
+        """Raise an :exc:`IOError` if the file was opened read-only.
+
+        """
+        if self.readonly:
+            raise IOError(errno.EROFS, "Cannot write to '{}' opened "
+                          "read-only".format(self.filename))
+
+    def _sync(self):
+        """Get when data written now should be synced to disk.
+
+        :Returns:
+            *when*
+                ``None`` if not at all, 'now', or 'later' if it should be
+                left to the current sync group
+
+        """
+        if self.durability == 'fast':
+            return None
+        elif (self.durability == 'group' and
+                getattr(_syncgroups, 'pending', None) is not None):
+            return 'later'
+        else:
+            return 'now'
+
+    def _sync_later(self, path, dironly=False):
+        """Leave syncing `path` and its directory to the current sync group.
+
+        :Keywords:
+            *dironly*
+                if True, `path` itself is already synced, and only its
+                directory is left
+
+        """
+        files, dirs = _syncgroups.pending
+        if not dironly:
+            files.add(path)
+        dirs.add(os.path.dirname(path))
+
+    def _shlock(self, fd, blocking=True):
         """Get shared lock on file.
 
         Using fcntl.lockf, a shared lock on the file is obtained. If an
@@ -71,17 +1024,19 @@ class File(object):
 
         :Arguments:
             *fd*
-                file descriptor
+                lock shared within the process, from :meth:`_get_proclock`
+
+        :Keywords:
+            *blocking*
+                if False, don't wait if the lock can't be obtained immediately
 
         :Returns:
             *success*
                 True if shared lock successfully obtained
         """
-        fcntl.lockf(fd, fcntl.LOCK_SH)
+        return self._lockop(fd, fcntl.LOCK_SH, blocking)
 
-        return True
-
-    def _exlock(self, fd):
+    def _exlock(self, fd, blocking=True):
         """Get exclusive lock on file.
 
         Using fcntl.lockf, an exclusive lock on the file is obtained. If a
@@ -90,15 +1045,28 @@ class File(object):
 
         :Arguments:
             *fd*
-                file descriptor
+                lock shared within the process, from :meth:`_get_proclock`
+
+        :Keywords:
+            *blocking*
+                if False, don't wait if the lock can't be obtained immediately
 
         :Returns:
             *success*
                 True if exclusive lock successfully obtained
         """
-        fcntl.lockf(fd, fcntl.LOCK_EX)
+        return self._lockop(fd, fcntl.LOCK_EX, blocking)
 
-        return True
+    def _lockop(self, fd, operation, blocking=True):
+        """Apply a lock operation to file descriptor `fd`.
+
+        :Returns:
+            *success*
+                True if lock successfully obtained; False if not blocking and
+                the lock is held elsewhere
+
+        """
+        return fd.lock(operation, blocking, self.fdpool)
 
     def _unlock(self, fd):
         """Remove exclusive or shared lock on file.
@@ -110,14 +1078,13 @@ class File(object):
 
         :Arguments:
             *fd*
-                file descriptor
+                lock shared within the process, from :meth:`_get_proclock`
 
         :Returns:
             *success*
                 True if lock removed
         """
-        fcntl.lockf(fd, fcntl.LOCK_UN)
-
+        fd.unlock()
         return True
 
     def _open_fd_r(self):
@@ -130,38 +1097,107 @@ class File(object):
         to it.
 
         """
-        self.fd = os.open(self.proxy, os.O_RDONLY)
+        self.fd = self._get_proclock()
 
     def _open_fd_rw(self):
         """Open read-write file descriptor for application of advisory locks.
 
         """
-        self.fd = os.open(self.proxy, os.O_RDWR)
+        self.fd = self._get_proclock()
+
+    def _get_proclock(self):
+        """Get the lock on the file shared within this process.
+
+        """
+        if (self._proclock is None or self._proclock.pid != os.getpid() or
+                self._proclocking != self.locking):
+            if (self._proclock is not None and
+                    self._proclock.pid == os.getpid()):
+                self._proclock.put()
+
+            self._proclocking = self.locking
+            if self.locking == 'flock':
+                self._proclock = _DirLock.get(self.get_location())
+            elif self.locking == 'proxy':
+                self._proclock = _ProxyLock.get(self.proxy)
+            elif self.locking == 'lease':
+                self._proclock = _LeaseLock.get(self.lease)
+                self._proclock.leasetime = self.leasetime
+            else:
+                # the backend locks against other processes itself
+                self._proclock = _ProcessLock.get(self.filename)
+
+        return self._proclock
 
     def _close_fd(self):
         """Close file descriptor used for application of advisory locks.
 
         """
-        # close file descriptor for locks
-        os.close(self.fd)
+        # the lock shared within the process looks after its descriptor
         self.fd = None
 
-    def _apply_shared_lock(self):
+    def _apply_shared_lock(self, timeout=None):
         """Apply shared lock.
 
+        :Keywords:
+            *timeout*
+                maximum time in seconds to wait for the lock; if ``None``,
+                `locktimeout` is used
+
         """
         self._open_fd_r()
-        self._shlock(self.fd)
+        self._acquire(self._shlock, timeout)
         self.fdlock = 'shared'
 
-    def _apply_exclusive_lock(self):
+    def _apply_exclusive_lock(self, timeout=None):
         """Apply exclusive lock.
 
+        :Keywords:
+            *timeout*
+                maximum time in seconds to wait for the lock; if ``None``,
+                `locktimeout` is used
+
         """
+        # all writes and deletions go through here
+        self._check_writable()
+
         self._open_fd_rw()
-        self._exlock(self.fd)
+        self._acquire(self._exlock, timeout)
         self.fdlock = 'exclusive'
 
+    def _acquire(self, lock, timeout=None):
+        """Obtain a lock on ``self.fd`` with `lock`, waiting at most
+        `timeout` seconds.
+
+        The descriptor is closed if the lock can't be obtained in time.
+
+        """
+        if timeout is None:
+            timeout = self.locktimeout
+
+        start = time.time()
+        if timeout is None:
+            lock(self.fd)
+        else:
+            delay = self.lockbackoff
+            while not lock(self.fd, blocking=False):
+                remaining = start + timeout - time.time()
+                if remaining <= 0:
+                    self._close_fd()
+                    self.lockstats['timeouts'] += 1
+                    raise LockTimeoutError(
+                        "Could not lock '{}' within {} seconds".format(
+                            self.filename, timeout))
+
+                # jitter keeps contending processes from retrying in step
+                time.sleep(min(random.uniform(delay / 2, delay), remaining))
+                delay = min(2 * delay, self.lockbackoffmax)
+
+        waited = time.time() - start
+        self.lockstats['locks'] += 1
+        self.lockstats['waited'] += waited
+        self.lockstats['maxwait'] = max(self.lockstats['maxwait'], waited)
+
     def _release_lock(self):
         """Apply exclusive lock.
 
@@ -171,12 +1207,12 @@ class File(object):
         self.fdlock = None
 
     @contextmanager
-    def read(self):
+    def read(self, timeout=None, limb=None):
         # if we already have any lock, proceed
         if self.fdlock:
             yield self.handle
         else:
-            self._apply_shared_lock()
+            self._apply_shared_lock(timeout)
             try:
                 # open the file using the actual reader
                 self.handle = self._open_file_r()
@@ -186,12 +1222,12 @@ class File(object):
                 self._release_lock()
 
     @contextmanager
-    def write(self):
+    def write(self, timeout=None, limb=None):
         # if we already have an exclusive lock, proceed
         if self.fdlock == 'exclusive':
             yield self.handle
         else:
-            self._apply_exclusive_lock()
+            self._apply_exclusive_lock(timeout)
 
             # open the file using the actual writer
             self.handle = self._open_file_w()
@@ -242,23 +1278,75 @@ class File(object):
         """
         with self.write():
             os.remove(self.filename)
-            os.remove(self.proxy)
+            if self.locking == 'proxy':
+                os.remove(self.proxy)
+            elif self.locking == 'lease':
+                shutil.rmtree(self.lease + 's', ignore_errors=True)
+
+        if self.fdpool is not None:
+            self.fdpool.discard(self.proxy)
 
 
-class FileSerial(File):
+class FileSerial(with_metaclass(_FileSerialmeta, File)):
     """File object base class for serialization formats, such as JSON.
 
+    The deserialized state is kept between reads, along with the identity of
+    the file it came from; a read only re-parses the file if it has changed
+    since it was last loaded.
+
+    Subclasses implementing a concrete format set ``_ext`` to the file
+    extension they handle; they are then registered and used for any state
+    file with that extension.
+
+    Since new state is written to a buffer that is then renamed over the
+    file, a reader can never see a partially-written file. Reads can
+    therefore be done without taking a shared lock by setting `lockfree`;
+    this only removes the locking overhead of reads, and writes remain
+    exclusive with respect to each other. Lock-free reads still wait on
+    writes from other threads of this process, which change the state in
+    place.
+
+    Threads reading at once share the state; it is loaded by one at a time.
+
+    :Arguments:
+        *filename*
+            name of file on disk object corresponds to
+
+    :Keywords:
+        *lockfree*
+            if True, read without applying a shared lock; the class attribute
+            of the same name gives the default
+
     """
+    # True if format is read and written as bytes instead of text
+    _binary = False
+
+    lockfree = False
+
+    def __init__(self, filename, **kwargs):
+        super(FileSerial, self).__init__(filename, **kwargs)
+
+        if 'lockfree' in kwargs:
+            self.lockfree = kwargs['lockfree']
+
+        # (inode, size, mtime) of the file ``self._state`` was loaded from
+        self._stamp = None
+
+        # held while loading the state
+        self._pulling = threading.Lock()
+
     @property
     def _writebuffer(self):
         wbuffer = ".{}.buffer".format(os.path.basename(self.filename))
         return os.path.join(os.path.dirname(self.filename), wbuffer)
 
     def _open_file_r(self):
-        return open(self.filename, 'r')
+        return open(self.filename, 'rb' if self._binary else 'r')
 
-    def _open_file_w(self):
-        return open(self._writebuffer, 'w')
+    def _open_file_w(self, path=None):
+        if path is None:
+            path = self._writebuffer
+        return open(path, 'wb' if self._binary else 'w')
 
     def read_file(self):
         """Return deserialized representation of file.
@@ -275,39 +1363,180 @@ class FileSerial(File):
         return out
 
     @contextmanager
-    def read(self):
+    def read(self, timeout=None, limb=None):
         # if we already have any lock, proceed
         if self.fdlock:
             yield self._state
+        elif self.lockfree:
+            # whichever version of the file we open is complete, and stays
+            # readable through the open handle even if it is replaced
+            lock = self._get_proclock()
+            lock.lock(fcntl.LOCK_SH, local=True)
+            try:
+                with self._pulling:
+                    self._pull_state()
+                yield self._state
+            finally:
+                lock.unlock(local=True)
         else:
-            self._apply_shared_lock()
+            self._apply_shared_lock(timeout)
             try:
-                self._pull_state()
+                with self._pulling:
+                    self._pull_state()
                 yield self._state
             finally:
                 self._release_lock()
 
     @contextmanager
-    def write(self):
+    def write(self, timeout=None, limb=None):
         # if we already have an exclusive lock, proceed
         if self.fdlock == 'exclusive':
             yield self._state
+        elif self.fdlock == 'shared':
+            # upgrading would let others change the file from under our read
+            raise IOError("Cannot write to '{}' while holding a shared "
+                          "lock on it".format(self.filename))
         else:
-            self._apply_exclusive_lock()
+            self._apply_exclusive_lock(timeout)
             try:
-                self._pull_state()
+                with self._pulling:
+                    self._pull_state()
             except IOError:
                 self._init_state()
+
+            # state will be modified in place; if we fail before pushing it,
+            # it no longer matches what is on disk
+            self._stamp = None
             try:
                 yield self._state
                 self._push_state()
             finally:
                 self._release_lock()
 
+    def create(self, state):
+        """Create the file, holding `state`, with a single write.
+
+        The state is serialized to a buffer of its own, which is then linked
+        into place; like opening with ``O_EXCL``, this fails if the file
+        already exists, and readers see either no file or all of it. No
+        lock is taken, since no other process can be writing a file that
+        doesn't exist yet. Where hard links aren't supported, the name is
+        reserved with ``O_EXCL`` and the buffer renamed over it.
+
+        :Arguments:
+            *state*
+                full initial state; kept as this file's state afterwards
+
+        :Raises:
+            *OSError*
+                with errno ``EEXIST`` if the file already exists
+
+        """
+        self._check_writable()
+        sync = self._sync()
+
+        buffer = "{}.{}".format(self._writebuffer, uuid.uuid4().hex)
+        handle = self._open_file_w(buffer)
+        try:
+            self._serialize(state, handle)
+        finally:
+            handle.close()
+
+        try:
+            if sync is not None:
+                _fsync(buffer)
+
+            try:
+                os.link(buffer, self.filename)
+            except OSError as e:
+                if e.errno not in (errno.EPERM, errno.EOPNOTSUPP,
+                                   errno.ENOSYS):
+                    raise
+                fd = os.open(self.filename,
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+                os.close(fd)
+                os.rename(buffer, self.filename)
+        finally:
+            if os.path.exists(buffer):
+                os.remove(buffer)
+
+        if sync == 'now':
+            _fsync(self.get_location())
+        elif sync == 'later':
+            self._sync_later(self.filename, dironly=True)
+
+        self._state = state
+        self._stamp = self._get_stamp()
+
+    def _snapshot(self):
+        """Get the state as last loaded, with the identity of the file it
+        was loaded from.
+
+        A snapshot given to :meth:`_restore` of a file object for the same
+        file, such as in another process, spares it parsing the file again
+        if it hasn't changed since.
+
+        :Returns:
+            *snapshot*
+                ``(state, stamp)``; ``None`` if there is no loaded state
+                matching a file on disk
+
+        """
+        if self._stamp is None:
+            return None
+
+        return (self._state, self._stamp)
+
+    def _restore(self, snapshot):
+        """Take the state from a snapshot from :meth:`_snapshot`.
+
+        """
+        state, stamp = snapshot
+        self._state = state
+        self._stamp = tuple(stamp)
+
+    def _get_stamp(self, fd=None):
+        """Get identity of the file on disk as (inode, size, mtime).
+
+        :Keywords:
+            *fd*
+                if given, get identity of the file open with this descriptor
+                instead of that currently at ``self.filename``
+
+        :Returns:
+            *stamp*
+                tuple identifying the current file contents; ``None`` if the
+                file does not exist
+
+        """
+        try:
+            if fd is None:
+                st = os.stat(self.filename)
+            else:
+                st = os.fstat(fd)
+        except OSError:
+            return None
+
+        return (st.st_ino, st.st_size,
+                getattr(st, 'st_mtime_ns', st.st_mtime))
+
     def _pull_state(self):
+        # if the file matches what we last loaded there's no need to parse it
+        # again
+        stamp = self._get_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+
+        # without a lock the file may be replaced after the check above, so
+        # we identify it by the handle we actually read from
         self.handle = self._open_file_r()
-        self._state = self._deserialize(self.handle)
-        self.handle.close()
+        try:
+            stamp = self._get_stamp(self.handle.fileno())
+            self._state = self._deserialize(self.handle)
+        finally:
+            self.handle.close()
+
+        self._stamp = stamp
 
     def _deserialize(self, handle):
         """Deserialize full state from open file handle.
@@ -317,11 +1546,26 @@ class FileSerial(File):
         raise NotImplementedError
 
     def _push_state(self):
+        sync = self._sync()
+
         self.handle = self._open_file_w()
         self._serialize(self._state, self.handle)
         self.handle.close()
+
+        # buffer must be on disk before it replaces the file, else a crash
+        # could leave an empty file behind; this can't wait for the group
+        if sync is not None:
+            _fsync(self._writebuffer)
+
         os.rename(self._writebuffer, self.filename)
 
+        if sync == 'now':
+            _fsync(self.get_location())
+        elif sync == 'later':
+            self._sync_later(self.filename, dironly=True)
+
+        self._stamp = self._get_stamp()
+
     def _serialize(self, state, handle):
         """Serialize full state to open file handle.
 
@@ -331,8 +1575,113 @@ class FileSerial(File):
 
 
 class JSONFile(FileSerial):
+    """File object for state stored as JSON.
+
+    """
+    _ext = 'json'
+
     def _deserialize(self, handle):
         return json.load(handle)
 
     def _serialize(self, state, handle):
         json.dump(state, handle)
+
+
+class GzipJSONFile(JSONFile):
+    """File object for state stored as gzip-compressed JSON.
+
+    Large state files, such as those of Groups with many members, shrink
+    several times over; this pays off where reading them is bound by I/O
+    rather than CPU. The whole file is decompressed in memory before it is
+    parsed, so the parse itself costs as much as for plain JSON.
+
+    """
+    _ext = 'json.gz'
+
+    compresslevel = 6
+
+    def _open_file_r(self):
+        return io.TextIOWrapper(gzip.GzipFile(self.filename, 'rb'),
+                                encoding='utf-8')
+
+    def _open_file_w(self, path=None):
+        if path is None:
+            path = self._writebuffer
+        return io.TextIOWrapper(
+            gzip.GzipFile(path, 'wb', self.compresslevel),
+            encoding='utf-8')
+
+
+class XzJSONFile(JSONFile):
+    """File object for state stored as xz-compressed JSON.
+
+    Compresses better than :class:`GzipJSONFile` at a greater CPU cost.
+    Requires the :mod:`lzma` module.
+
+    """
+    _ext = 'json.xz'
+
+    compresspreset = 6
+
+    def __init__(self, filename, **kwargs):
+        if lzma is None:
+            raise ImportError("lzma is required for '{}' state "
+                              "files".format(self._ext))
+
+        super(XzJSONFile, self).__init__(filename, **kwargs)
+
+    def _open_file_r(self):
+        return io.TextIOWrapper(lzma.LZMAFile(self.filename, 'rb'),
+                                encoding='utf-8')
+
+    def _open_file_w(self, path=None):
+        if path is None:
+            path = self._writebuffer
+        return io.TextIOWrapper(
+            lzma.LZMAFile(path, 'wb',
+                          preset=self.compresspreset),
+            encoding='utf-8')
+
+
+class MsgpackFile(FileSerial):
+    """File object for state stored as MessagePack.
+
+    Requires the ``msgpack`` package.
+
+    """
+    _ext = 'msgpack'
+    _binary = True
+
+    def __init__(self, filename, **kwargs):
+        if msgpack is None:
+            raise ImportError("msgpack is required for '{}' state "
+                              "files".format(self._ext))
+
+        super(MsgpackFile, self).__init__(filename, **kwargs)
+
+    def _deserialize(self, handle):
+        return msgpack.unpack(handle, raw=False)
+
+    def _serialize(self, state, handle):
+        msgpack.pack(state, handle, use_bin_type=True)
+
+
+class MarshalFile(FileSerial):
+    """File object for state stored in Python's :mod:`marshal` format.
+
+    Compact and fast to read and write with only the standard library, but
+    the format is specific to Python; state files should only be shared
+    between Python versions using the same marshal version.
+
+    """
+    _ext = 'marshal'
+    _binary = True
+
+    # fixed so files don't change format with the interpreter's default
+    _version = 2
+
+    def _deserialize(self, handle):
+        return marshal.load(handle)
+
+    def _serialize(self, state, handle):
+        marshal.dump(state, handle, self._version)
@@ -0,0 +1,729 @@
+"""Local metadata daemon, serving treant states to many processes at once.
+
+A :class:`Server` listens on a Unix domain socket and does all reading and
+writing of the state files it is asked about. It keeps their parsed states
+in memory, serializes writers of each treant, and writes a treant's state
+back to disk once writes to it pause for `flushdelay` seconds, holding the
+state file's exclusive lock until then so that processes not using the
+daemon never see stale state. Start one with::
+
+    python -m datreant.core.backends.daemon /path/to/socket
+
+Processes find it through `socketpath`, taken from the environment variable
+``DATREANT_SOCKET`` by default; state files are then opened with
+:func:`~datreant.core.backends.statefiles.treantfile` as clients of the
+daemon if it can be reached, and directly otherwise.
+
+Running a daemon requires Python 3.4 or later.
+
+"""
+import os
+import sys
+import time
+import json
+import errno
+import signal
+import socket
+import struct
+import warnings
+import threading
+import collections
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+from contextlib import contextmanager
+
+from .core import FileSerial, LockTimeoutError
+from .journal import JournalFile
+from .sqlite import SQLiteFile
+from .sharded import ShardedFile
+
+# path of the socket of the daemon to use; ``None`` for none
+socketpath = os.environ.get('DATREANT_SOCKET') or None
+
+# messages are JSON, each preceded by its length
+_length = struct.Struct('>I')
+
+# connections to the daemon, for this thread and process
+_connections = threading.local()
+
+
+def _pack(message):
+    data = json.dumps(message).encode('utf-8')
+    return _length.pack(len(data)) + data
+
+
+def _recvall(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise IOError(errno.ECONNRESET, "Connection to datreant daemon "
+                          "closed")
+        data.extend(chunk)
+
+    return bytes(data)
+
+
+def _connect(path):
+    """Get this thread's connection to the daemon at `path`.
+
+    :Returns:
+        *sock*
+            connected socket; ``None`` if the daemon can't be reached
+
+    """
+    if getattr(_connections, 'pid', None) != os.getpid():
+        _connections.socks = dict()
+        _connections.pid = os.getpid()
+
+    try:
+        return _connections.socks[path]
+    except KeyError:
+        pass
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+
+    _connections.socks[path] = sock
+    return sock
+
+
+def _call(path, request):
+    """Send `request` to the daemon at `path`, and get its reply.
+
+    """
+    sock = _connect(path)
+    if sock is None:
+        raise IOError(errno.ECONNREFUSED, "No datreant daemon at "
+                      "'{}'".format(path))
+
+    try:
+        sock.sendall(_pack(request))
+        size, = _length.unpack(_recvall(sock, _length.size))
+        reply = json.loads(_recvall(sock, size).decode('utf-8'))
+    except BaseException:
+        # a reply left unread would be taken for that of the next request
+        del _connections.socks[path]
+        sock.close()
+        raise
+
+    if 'error' not in reply:
+        return reply
+    elif reply['error'] == 'timeout':
+        raise LockTimeoutError(reply['message'])
+    else:
+        raise IOError(reply.get('errno'), reply['message'])
+
+
+def serves(fileclass):
+    """Check if the daemon can serve state files of `fileclass`.
+
+    Formats keeping their state apart or in a store of their own, or
+    tracking changes made to it, are always used directly.
+
+    """
+    return (issubclass(fileclass, FileSerial) and
+            not issubclass(fileclass, (JournalFile, SQLiteFile,
+                                       ShardedFile)))
+
+
+def reachable(path=None):
+    """Check if a daemon is listening on the socket at `path`.
+
+    :Keywords:
+        *path*
+            path of the daemon's socket; `socketpath` if ``None``
+
+    """
+    if path is None:
+        path = socketpath
+
+    return path is not None and _connect(path) is not None
+
+
+class _Client(object):
+    """File object whose state is read and written through the daemon.
+
+    Reads get the daemon's copy of the state, and writes hold the daemon's
+    lock on it for their duration and give it back the new state; no file
+    is read, written, or locked by this process. Reads only wait on writers
+    not using the daemon; those using it leave the daemon's copy as it was
+    until they are done. States are passed as JSON.
+
+    """
+    def __init__(self, filename, **kwargs):
+        super(_Client, self).__init__(filename, **kwargs)
+        self.socket = socketpath
+
+    def _call(self, op, **request):
+        request['op'] = op
+        request['path'] = self.filename
+        return _call(self.socket, request)
+
+    def _lockcall(self, op, timeout=None):
+        """Wait for the daemon's lock on the state, recording the wait.
+
+        """
+        if timeout is None:
+            timeout = self.locktimeout
+
+        start = time.time()
+        try:
+            reply = self._call(op, timeout=timeout)
+        except LockTimeoutError:
+            self.lockstats['timeouts'] += 1
+            raise
+
+        waited = time.time() - start
+        self.lockstats['locks'] += 1
+        self.lockstats['waited'] += waited
+        self.lockstats['maxwait'] = max(self.lockstats['maxwait'], waited)
+        return reply
+
+    @contextmanager
+    def read(self, timeout=None, limb=None):
+        # if we already have any lock, proceed
+        if self.fdlock:
+            yield self._state
+            return
+
+        if timeout is None:
+            timeout = self.locktimeout
+
+        self._state = self._call('read', timeout=timeout)['state']
+        self.fdlock = 'shared'
+        try:
+            yield self._state
+        finally:
+            self.fdlock = None
+
+    @contextmanager
+    def write(self, timeout=None, limb=None):
+        # if we already have an exclusive lock, proceed
+        if self.fdlock == 'exclusive':
+            yield self._state
+            return
+        elif self.fdlock == 'shared':
+            raise IOError("Cannot write to '{}' while holding a shared "
+                          "lock on it".format(self.filename))
+
+        self._check_writable()
+        state = self._lockcall('lock', timeout)['state']
+        if state is None:
+            self._init_state()
+        else:
+            self._state = state
+
+        self.fdlock = 'exclusive'
+        try:
+            try:
+                yield self._state
+            except BaseException:
+                self._call('unlock')
+                raise
+            self._call('write', state=self._state)
+        finally:
+            self.fdlock = None
+
+    def create(self, state):
+        """Create the file holding `state`, through the daemon.
+
+        The daemon writes a new file out as soon as it has its state.
+
+        """
+        if os.path.exists(self.filename):
+            raise OSError(errno.EEXIST, "File exists: '{}'".format(
+                self.filename))
+
+        with self.write():
+            self._state.update(state)
+
+    def check_location(self, location):
+        super(_Client, self).check_location(location)
+
+        # the daemon writes out and lets go of the file before it moves
+        self._lockcall('forget')
+
+    def delete(self):
+        """Delete this file and its proxy file, through the daemon.
+
+        This file instance will be unusable after this operation.
+
+        """
+        self._check_writable()
+        self._lockcall('lock')
+        try:
+            self._call('delete')
+        except BaseException:
+            self._call('unlock')
+            raise
+
+
+# client classes for each file class; built as needed
+_CLIENTS = dict()
+
+
+def client(fileclass):
+    """Get the class of clients of the daemon for `fileclass`.
+
+    """
+    try:
+        return _CLIENTS[fileclass]
+    except KeyError:
+        cls = type(fileclass)('Served' + fileclass.__name__,
+                              (_Client, fileclass), {})
+        return _CLIENTS.setdefault(fileclass, cls)
+
+
+class _Entry(object):
+    """A state file served by the daemon.
+
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+        # connection holding the lock and how many times it took it, and
+        # those waiting on the file, with their requests and deadlines
+        self.owner = None
+        self.depth = 0
+        self.waiting = collections.deque()
+
+        # whether we hold the file's exclusive lock, and when the state was
+        # first changed since it was last written out
+        self.locked = False
+        self.dirty = None
+
+
+class _Connection(object):
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+        # entries this connection holds or waits on
+        self.entries = set()
+
+
+class Server(object):
+    """Daemon serving treant states to other processes over a Unix socket.
+
+    The server is a single thread, handling requests of all its clients as
+    they come; it never waits on a lock held by another process, but
+    retries every `pollinterval` seconds instead. Changed states are
+    written out once no client has held their lock for `flushdelay`
+    seconds, and at the latest when the server shuts down. At most
+    `maxentries` states that are neither locked nor waited on are kept.
+
+    :Arguments:
+        *path*
+            path of the socket to listen on; a stale socket left there is
+            replaced
+
+    :Keywords:
+        *flushdelay*
+            seconds to wait for more writes before writing a state out
+        *maxentries*
+            number of states to keep in memory
+
+    """
+    pollinterval = 0.01
+
+    def __init__(self, path, flushdelay=0.05, maxentries=4096):
+        if selectors is None:
+            raise RuntimeError("Running a datreant daemon requires Python "
+                               "3.4 or later")
+
+        self.path = os.path.abspath(path)
+        self.flushdelay = flushdelay
+        self.maxentries = maxentries
+
+        if os.path.exists(self.path):
+            if reachable(self.path):
+                raise IOError(errno.EADDRINUSE, "A datreant daemon is "
+                              "already listening at '{}'".format(self.path))
+            os.remove(self.path)
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+        # least recently used first
+        self._entries = collections.OrderedDict()
+        self._running = False
+
+    def serve_forever(self):
+        """Handle requests until :meth:`stop` is called.
+
+        All changed states are written out before returning.
+
+        """
+        self._running = True
+        try:
+            while self._running:
+                for key, mask in self._selector.select(self._wait()):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif mask & selectors.EVENT_READ:
+                        self._receive(key.data)
+                    else:
+                        self._send(key.data)
+
+                self._tick()
+        finally:
+            self.close()
+
+    def stop(self):
+        """Stop serving; safe to call from a signal handler.
+
+        """
+        self._running = False
+
+    def close(self):
+        """Write out all changed states, and stop listening.
+
+        """
+        for entry in self._entries.values():
+            self._forget(entry)
+
+        for key in list(self._selector.get_map().values()):
+            self._selector.unregister(key.fileobj)
+            key.fileobj.close()
+        self._selector.close()
+
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _wait(self):
+        """Get how long to wait for requests before the next tick.
+
+        """
+        waits = [1.0]
+        now = time.time()
+        for entry in self._entries.values():
+            if entry.dirty is not None:
+                waits.append(entry.dirty + self.flushdelay - now)
+            if entry.waiting:
+                # waits on other processes are polled
+                waits.append(self.pollinterval)
+
+        return max(0, min(waits))
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except (IOError, OSError):
+            return
+
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ,
+                                _Connection(sock))
+
+    def _receive(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = b''
+
+        if not data:
+            self._drop(conn)
+            return
+
+        conn.inbuf.extend(data)
+        while len(conn.inbuf) >= _length.size:
+            size, = _length.unpack_from(conn.inbuf)
+            if len(conn.inbuf) < _length.size + size:
+                break
+
+            message = conn.inbuf[_length.size:_length.size + size]
+            del conn.inbuf[:_length.size + size]
+            self._handle(conn, json.loads(message.decode('utf-8')))
+
+    def _send(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            self._drop(conn)
+            return
+
+        del conn.outbuf[:sent]
+        if not conn.outbuf:
+            self._selector.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def _reply(self, conn, **reply):
+        pending = bool(conn.outbuf)
+        conn.outbuf.extend(_pack(reply))
+        if not pending:
+            self._send(conn)
+            if conn.outbuf:
+                self._selector.modify(
+                    conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE,
+                    conn)
+
+    def _error(self, conn, e):
+        if isinstance(e, LockTimeoutError):
+            self._reply(conn, error='timeout', message=str(e))
+        else:
+            self._reply(conn, error='io', errno=getattr(e, 'errno', None),
+                        message=getattr(e, 'strerror', None) or str(e))
+
+    def _drop(self, conn):
+        """Forget a closed connection, giving up its lock and waits.
+
+        """
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+        for entry in list(conn.entries):
+            entry.waiting = collections.deque(
+                item for item in entry.waiting if item[0] is not conn)
+            if entry.owner is conn:
+                # its changes were never given to us
+                entry.owner = None
+                entry.depth = 0
+            self._advance(entry)
+
+    def _entry(self, path):
+        try:
+            entry = self._entries.pop(path)
+        except KeyError:
+            from .statefiles import fileclass
+            filename, cls = fileclass(path)
+            entry = _Entry(cls(filename))
+
+        self._entries[path] = entry
+        return entry
+
+    def _handle(self, conn, request):
+        op = request.get('op')
+        if op == 'ping':
+            self._reply(conn)
+            return
+
+        try:
+            entry = self._entry(request['path'])
+        except (IOError, OSError, ValueError) as e:
+            self._error(conn, e)
+            return
+
+        if op == 'lock' and entry.owner is conn:
+            # Files of one thread share its connection, and its lock
+            entry.depth += 1
+            self._reply(conn, state=entry.backend._state)
+        elif op in ('read', 'lock', 'forget'):
+            timeout = request.get('timeout')
+            deadline = None if timeout is None else time.time() + timeout
+            entry.waiting.append((conn, request, deadline))
+            conn.entries.add(entry)
+            self._advance(entry)
+        elif entry.owner is not conn:
+            self._error(conn, IOError(errno.EPERM, "Lock on '{}' not "
+                                      "held".format(request['path'])))
+        elif op == 'write':
+            entry.backend._state = request['state']
+            entry.backend._stamp = None
+            if entry.dirty is None:
+                entry.dirty = time.time()
+
+            # a new treant is found by its state file, so that can't wait
+            if not os.path.exists(entry.backend.filename):
+                self._flush(entry)
+            self._release(entry, conn)
+        elif op == 'unlock':
+            self._release(entry, conn)
+        elif op == 'delete':
+            try:
+                entry.backend.delete()
+            except (IOError, OSError) as e:
+                self._error(conn, e)
+                return
+
+            entry.dirty = None
+            self._release(entry, conn)
+        else:
+            self._error(conn, IOError("Unknown request '{}'".format(op)))
+
+    def _release(self, entry, conn):
+        entry.depth -= 1
+        if not entry.depth:
+            entry.owner = None
+            conn.entries.discard(entry)
+        self._reply(conn)
+        self._advance(entry)
+
+    def _advance(self, entry):
+        """Serve those waiting on `entry` in turn, for as long as we can.
+
+        """
+        while entry.waiting:
+            conn, request, deadline = entry.waiting[0]
+            op = request['op']
+            try:
+                if op == 'read':
+                    done = self._read(entry, conn)
+                elif entry.owner is not None:
+                    break
+                else:
+                    done = self._lock(entry)
+                    if done and op == 'lock':
+                        self._grant(entry, conn)
+                    elif done:
+                        self._forget(entry)
+                        self._reply(conn)
+            except (IOError, OSError) as e:
+                self._error(conn, e)
+                done = True
+
+            if not done:
+                break
+
+            entry.waiting.popleft()
+            if entry.owner is not conn:
+                conn.entries.discard(entry)
+
+        if (entry.owner is None and not entry.waiting and
+                entry.dirty is None):
+            self._unlock(entry)
+
+    def _read(self, entry, conn):
+        """Reply with the state, if no other process is writing it.
+
+        """
+        backend = entry.backend
+        if not entry.locked:
+            try:
+                backend._apply_shared_lock(0)
+            except LockTimeoutError:
+                return False
+
+            try:
+                backend._pull_state()
+            finally:
+                backend._release_lock()
+
+        self._reply(conn, state=backend._state)
+        return True
+
+    def _lock(self, entry):
+        """Get the file's exclusive lock, if no other process holds it.
+
+        """
+        if entry.locked:
+            return True
+
+        try:
+            entry.backend._apply_exclusive_lock(0)
+        except LockTimeoutError:
+            return False
+
+        entry.locked = True
+        try:
+            entry.backend._pull_state()
+        except IOError:
+            entry.backend._init_state()
+
+        return True
+
+    def _grant(self, entry, conn):
+        entry.owner = conn
+        entry.depth = 1
+        self._reply(conn, state=entry.backend._state)
+
+    def _unlock(self, entry):
+        if entry.locked:
+            entry.backend._release_lock()
+            entry.locked = False
+
+    def _flush(self, entry):
+        entry.dirty = None
+        try:
+            entry.backend._push_state()
+        except (IOError, OSError) as e:
+            # the file is gone or can't be written; we can do no better
+            entry.backend._stamp = None
+            warnings.warn("Could not write out '{}': {}".format(
+                entry.backend.filename, e))
+
+    def _forget(self, entry):
+        """Write out the state and let go of the file, keeping no copy.
+
+        """
+        if entry.dirty is not None:
+            self._flush(entry)
+        self._unlock(entry)
+        entry.backend._stamp = None
+
+    def _tick(self):
+        now = time.time()
+        for entry in list(self._entries.values()):
+            if not entry.waiting and entry.dirty is None:
+                continue
+
+            # give up on waits that took too long
+            waiting = collections.deque()
+            for conn, request, deadline in entry.waiting:
+                if deadline is not None and now >= deadline:
+                    conn.entries.discard(entry)
+                    self._error(conn, LockTimeoutError(
+                        "Could not lock '{}' within {} seconds".format(
+                            request['path'], request['timeout'])))
+                else:
+                    waiting.append((conn, request, deadline))
+            entry.waiting = waiting
+
+            if (entry.dirty is not None and entry.owner is None and
+                    now - entry.dirty >= self.flushdelay):
+                self._flush(entry)
+
+            self._advance(entry)
+
+        # keep only the most recently used of the states no one needs
+        excess = len(self._entries) - self.maxentries
+        for entry in list(self._entries.values()):
+            if excess <= 0:
+                break
+            if not (entry.locked or entry.waiting or entry.owner):
+                del self._entries[entry.backend.filename]
+                entry.backend.close()
+                excess -= 1
+
+
+def serve(path, **kwargs):
+    """Run a daemon listening on the socket at `path` until terminated.
+
+    Keyword arguments are given to :class:`Server`.
+
+    """
+    server = Server(path, **kwargs)
+
+    def stop(signum, frame):
+        server.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m datreant.core.backends.daemon SOCKET")
+
+    serve(sys.argv[1])
@@ -0,0 +1,353 @@
+"""Journaled state files: a snapshot plus an append-only log of changes.
+
+"""
+
+import os
+import copy
+import json
+import errno
+
+from .core import JSONFile, _fsync
+
+
+class JournalFile(JSONFile):
+    """File object storing state as a JSON snapshot plus a journal of changes.
+
+    Instead of rewriting the whole state file on every write, the changes
+    made within a write are appended as small records to a journal kept
+    next to the snapshot. Reads replay any journal records not yet applied
+    on top of the snapshot. Once the journal grows past `journalsize` bytes
+    or `journalrecords` records, it is compacted: the full state is written
+    as a new snapshot and the journal is started over.
+
+    This makes the cost of a write proportional to the size of the change
+    rather than the size of the state, which is useful for state that is
+    updated often, such as counters stored in categories. Only the items of
+    the state a write touches, such as its tags, are copied and compared to
+    find what it changed.
+
+    Records are idempotent, so replaying a journal that has already been
+    folded into the snapshot (e.g. after a crash during compaction) gives
+    the same state.
+
+    :Arguments:
+        *filename*
+            name of file on disk object corresponds to
+
+    """
+    _ext = 'journal'
+
+    # thresholds at which the journal is compacted into the snapshot
+    journalsize = 1 << 20
+    journalrecords = 10000
+
+    def __init__(self, filename, **kwargs):
+        super(JournalFile, self).__init__(filename, **kwargs)
+
+        # inode of the journal and how far into it ``self._state`` reflects
+        self._journalid = None
+        self._journalpos = 0
+        self._journalcount = 0
+
+        # originals of the items touched by a write; used to find changes
+        self._base = None
+
+    @property
+    def _journal(self):
+        journal = ".{}.log".format(os.path.basename(self.filename))
+        return os.path.join(os.path.dirname(self.filename), journal)
+
+    @property
+    def _journalbuffer(self):
+        return self._journal + '.buffer'
+
+    def compact(self):
+        """Fold the journal into the snapshot.
+
+        """
+        with self.write():
+            # without a base to compare to, the next push compacts
+            self._base = None
+
+    def delete(self):
+        """Delete this file, its journal, and its proxy file.
+
+        This file instance will be unusable after this operation.
+
+        """
+        with self.write():
+            try:
+                os.remove(self._journal)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        super(JournalFile, self).delete()
+
+    def _pull_state(self):
+        stamp = self._stamp
+        super(JournalFile, self)._pull_state()
+        if self._stamp != stamp:
+            # new snapshot; journal applies from its start
+            self._journalid = None
+
+        if not self._replay():
+            # journal was replaced since we last read it, so snapshot was
+            # too; start over from both
+            self._stamp = None
+            self._journalid = None
+            super(JournalFile, self)._pull_state()
+            self._replay()
+
+        # keep what we started from so we can find what a write changed
+        if self.fdlock == 'exclusive':
+            self._state = _Touched(self._state)
+            self._base = self._state.base
+
+    def _init_state(self):
+        super(JournalFile, self)._init_state()
+        self._base = None
+
+    def _replay(self):
+        """Apply journal records not yet applied to the state.
+
+        :Returns:
+            *success*
+                False if the journal is not the one previously read from,
+                so the state can't be brought up to date from it
+
+        """
+        try:
+            handle = open(self._journal, 'rb')
+        except IOError:
+            # no journal is the same as an empty one
+            return self._journalid is None or self._journalpos == 0
+
+        with handle:
+            st = os.fstat(handle.fileno())
+            if self._journalid is None:
+                self._journalid = st.st_ino
+                self._journalpos = 0
+                self._journalcount = 0
+            elif (st.st_ino != self._journalid or
+                    st.st_size < self._journalpos):
+                return False
+
+            handle.seek(self._journalpos)
+            data = handle.read()
+
+        # a record still being appended has no newline yet; leave it
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            _apply(self._state, json.loads(line.decode('utf-8')))
+            self._journalcount += 1
+
+        self._journalpos += end
+        return True
+
+    def _push_state(self):
+        if (self._base is None or
+                self._journalpos > self.journalsize or
+                self._journalcount > self.journalrecords):
+            self._compact()
+        else:
+            self._append(_diff(self._base, self._state))
+            self._stamp = self._get_stamp()
+
+        # reads shouldn't pay for tracking
+        self._state = dict(self._state)
+        self._base = None
+
+    def _append(self, records):
+        """Append records to the journal.
+
+        """
+        if not records:
+            return
+
+        data = ''.join(json.dumps(record) + '\n' for record in records)
+        data = data.encode('utf-8')
+
+        fd = os.open(self._journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o666)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            st = os.fstat(fd)
+
+            sync = self._sync()
+            if sync == 'now':
+                os.fsync(fd)
+            elif sync == 'later':
+                self._sync_later(self._journal)
+        finally:
+            os.close(fd)
+
+        # we hold the exclusive lock, so only we have written to it
+        self._journalid = st.st_ino
+        self._journalpos = st.st_size
+        self._journalcount += len(records)
+
+    def _compact(self):
+        """Write full state as a new snapshot, and start a new journal.
+
+        """
+        super(JournalFile, self)._push_state()
+
+        # new journal is a new file, so readers can tell it was replaced
+        open(self._journalbuffer, 'wb').close()
+        os.rename(self._journalbuffer, self._journal)
+
+        # the snapshot is already synced; the journal's rename isn't yet
+        sync = self._sync()
+        if sync == 'now':
+            _fsync(self.get_location())
+        elif sync == 'later':
+            self._sync_later(self._journal)
+
+        self._journalid = os.stat(self._journal).st_ino
+        self._journalpos = 0
+        self._journalcount = 0
+
+
+# stand-in for an item absent from the state
+_MISSING = object()
+
+
+class _Touched(dict):
+    """State whose top-level items keep their originals once touched.
+
+    The first time an item is got, set, or removed, a copy of its value is
+    kept in `base` (or :data:`_MISSING` if it wasn't present), so a write
+    only pays for copying and diffing the items it could have changed.
+
+    """
+    def __init__(self, state):
+        super(_Touched, self).__init__(state)
+        self.base = dict()
+
+    def _touch(self, key):
+        if key not in self.base:
+            value = dict.get(self, key, _MISSING)
+            self.base[key] = (value if value is _MISSING
+                              else copy.deepcopy(value))
+
+    def __getitem__(self, key):
+        self._touch(key)
+        return super(_Touched, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._touch(key)
+        super(_Touched, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._touch(key)
+        super(_Touched, self).__delitem__(key)
+
+    def get(self, key, default=None):
+        self._touch(key)
+        return super(_Touched, self).get(key, default)
+
+    def pop(self, key, *default):
+        self._touch(key)
+        return super(_Touched, self).pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        self._touch(key)
+        return super(_Touched, self).setdefault(key, default)
+
+
+def _key(item):
+    """Hashable stand-in for a JSON-compatible value.
+
+    """
+    return json.dumps(item, sort_keys=True)
+
+
+def _diff(base, new):
+    """Get journal records that turn the items of `base` into those of state
+    `new`.
+
+    Only items in `base` are compared; an item absent from the old state is
+    given there as :data:`_MISSING`.
+
+    """
+    records = []
+    for key, old in base.items():
+        value = dict.get(new, key, _MISSING)
+        if value is _MISSING:
+            if old is not _MISSING:
+                records.append(['del', key])
+        elif old is _MISSING:
+            records.append(['put', key, value])
+        elif old != value:
+            records.extend(_diff_value(key, old, value))
+
+    return records
+
+
+def _diff_value(key, old, new):
+    """Get journal records that turn `old` into `new` for a top-level key.
+
+    Dicts are diffed by item, and lists by element when the change amounts
+    to removals, appends, or replacements of unique elements; anything else
+    replaces the value whole.
+
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        records = [['unset', key, k] for k in old if k not in new]
+        records.extend([['set', key, k, v] for k, v in new.items()
+                        if k not in old or old[k] != v])
+        return records
+
+    if isinstance(old, list) and isinstance(new, list):
+        oldkeys = [_key(item) for item in old]
+        newkeys = [_key(item) for item in new]
+        oldset = set(oldkeys)
+        newset = set(newkeys)
+
+        if len(oldset) == len(oldkeys) and len(newset) == len(newkeys):
+            kept = [k for k in oldkeys if k in newset]
+            added = [i for i, k in enumerate(newkeys) if k not in oldset]
+
+            if kept + [newkeys[i] for i in added] == newkeys:
+                records = [['remove', key, item] for item, k
+                           in zip(old, oldkeys) if k not in newset]
+                records.extend([['add', key, new[i]] for i in added])
+                return records
+
+            if len(oldkeys) == len(newkeys):
+                changed = [i for i, (o, n) in enumerate(zip(oldkeys, newkeys))
+                           if o != n]
+                if all(oldkeys[i] not in newset and newkeys[i] not in oldset
+                       for i in changed):
+                    return [['swap', key, old[i], new[i]] for i in changed]
+
+    return [['put', key, new]]
+
+
+def _apply(state, record):
+    """Apply a single journal record to `state` in place.
+
+    """
+    op, key = record[0], record[1]
+
+    if op == 'put':
+        state[key] = record[2]
+    elif op == 'del':
+        state.pop(key, None)
+    elif op == 'set':
+        state.setdefault(key, dict())[record[2]] = record[3]
+    elif op == 'unset':
+        state.get(key, dict()).pop(record[2], None)
+    elif op == 'add':
+        values = state.setdefault(key, list())
+        if record[2] not in values:
+            values.append(record[2])
+    elif op == 'remove':
+        state[key] = [v for v in state.get(key, list()) if v != record[2]]
+    elif op == 'swap':
+        state[key] = [record[3] if v == record[2] else v
+                      for v in state.get(key, list())]
+    else:
+        raise ValueError("Unknown journal record '{}'".format(op))
@@ -0,0 +1,432 @@
+"""Compact member tables for Groups, read in place from memory-mapped files.
+
+"""
+
+import os
+import sys
+import mmap
+import struct
+import binascii
+from uuid import UUID
+from array import array
+from bisect import bisect_left
+
+from .sharded import ShardedFile, _Shard
+
+
+def _uuidbytes(uuid):
+    # much cheaper than going through UUID, for the usual hyphenated form
+    try:
+        key = binascii.unhexlify(uuid.replace('-', ''))
+    except (TypeError, ValueError):
+        key = None
+
+    if key is None or len(key) != 16:
+        return UUID(uuid).bytes
+
+    return key
+
+
+def _lowerbound(n, key, keyat):
+    """Get the first position in ``range(n)`` whose key is not below `key`.
+
+    :Arguments:
+        *n*
+            number of positions, sorted by key
+        *key*
+            key to look for
+        *keyat*
+            function giving the key at a position
+
+    """
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if keyat(mid) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo
+
+
+class MemberTable(object):
+    """Table of a Group's members, read in place from a binary buffer.
+
+    Each member has a fixed-width record holding its uuid as 16 bytes, a code
+    for its treanttype, and the offsets of its paths in a blob at the end of
+    the table. The records are in member order, and are followed by an index
+    of them sorted by uuid, so a member is found by binary search without
+    decoding any other. Over a memory-mapped file, only the pages that are
+    read are loaded.
+
+    Changes are kept apart from the buffer until the table is written out
+    with :meth:`dump`, which copies unchanged records and paths over as
+    they are. Paths of changed and removed members are left in the blob
+    until they make up half of it.
+
+    :Arguments:
+        *buf*
+            buffer holding a table, such as an :class:`mmap.mmap` of a file
+            written with :meth:`dump`; an empty table if ``None``
+
+    """
+    _magic = b'DTRMEMB1'
+
+    # magic, number of records, size of treanttypes, size of path blob,
+    # size of paths in blob no record refers to
+    _header = struct.Struct('<8sIIQQ')
+
+    # uuid, treanttype code, offset and size of abspath, and of relpath
+    _record = struct.Struct('<16sHQIQI')
+
+    _indexentry = struct.Struct('<I')
+
+    def __init__(self, buf=None):
+        self._buf = buf
+        self._n = 0
+        self._types = []
+        self._pathsize = 0
+        self._garbage = 0
+
+        if buf is not None:
+            (magic, self._n, typesize,
+             self._pathsize, self._garbage) = self._header.unpack_from(buf)
+            if magic != self._magic:
+                raise ValueError("Buffer does not hold a member table")
+
+        self._recoff = self._header.size
+        self._idxoff = self._recoff + self._n * self._record.size
+        self._pathoff = self._idxoff + self._n * self._indexentry.size
+
+        if buf is not None:
+            types = buf[self._pathoff:self._pathoff + typesize]
+            self._types = types.decode('utf-8').split('\n') if types else []
+            self._pathoff += typesize
+
+        # changed records by position, positions of removed records, and
+        # records added after those of the buffer
+        self._changed = dict()
+        self._deleted = set()
+        self._appended = list()
+        self._position = dict()
+
+    @classmethod
+    def fromrecords(cls, records):
+        """Make a table of the given member records.
+
+        """
+        table = cls()
+        for record in records:
+            table.put(record)
+
+        return table
+
+    def __len__(self):
+        return self._n - len(self._deleted) + len(self._appended)
+
+    def __iter__(self):
+        if self._n:
+            # decode from one copy of the records and paths, instead of
+            # slicing the buffer for each
+            records = self._buf[self._recoff:self._idxoff]
+            paths = self._buf[self._pathoff:self._pathoff + self._pathsize]
+
+        for i in range(self._n):
+            if i in self._deleted:
+                continue
+            elif i in self._changed:
+                yield dict(self._changed[i])
+            else:
+                yield self._decode(self._record.unpack_from(
+                    records, i * self._record.size), paths)
+
+        for record in self._appended:
+            yield dict(record)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Member table index out of range")
+
+        kept = self._n - len(self._deleted)
+        if i >= kept:
+            return dict(self._appended[i - kept])
+
+        # skip over removed records
+        for j in sorted(self._deleted):
+            if j > i:
+                break
+            i += 1
+
+        return self._member(i)
+
+    def __deepcopy__(self, memo):
+        # copies are plain lists, detached from the buffer
+        return list(self)
+
+    def _uuid(self, i):
+        start = self._recoff + i * self._record.size
+        return bytes(self._buf[start:start + 16])
+
+    def _sorted(self, i):
+        """Get the position of the record at `i` in the uuid index."""
+        return self._indexentry.unpack_from(
+            self._buf, self._idxoff + i * self._indexentry.size)[0]
+
+    def _find(self, uuid):
+        """Get the position of the record with `uuid` in the buffer.
+
+        """
+        if not self._n:
+            return None
+
+        try:
+            key = _uuidbytes(uuid)
+        except ValueError:
+            return None
+
+        i = _lowerbound(self._n, key, lambda j: self._uuid(self._sorted(j)))
+        if i < self._n and self._uuid(self._sorted(i)) == key:
+            return self._sorted(i)
+
+    def _unpack(self, i):
+        return self._record.unpack_from(
+            self._buf, self._recoff + i * self._record.size)
+
+    def _member(self, i):
+        try:
+            return dict(self._changed[i])
+        except KeyError:
+            pass
+
+        return self._decode(self._unpack(i), self._buf, self._pathoff)
+
+    def _decode(self, record, paths, pathoff=0):
+        """Make a member record from an unpacked one and its path blob.
+
+        """
+        uuid, code, aoff, asize, roff, rsize = record
+        uuid = binascii.hexlify(uuid).decode('ascii')
+        aoff += pathoff
+        roff += pathoff
+        return {'uuid': '-'.join((uuid[:8], uuid[8:12], uuid[12:16],
+                                  uuid[16:20], uuid[20:])),
+                'treanttype': self._types[code],
+                'abspath': paths[aoff:aoff + asize].decode('utf-8'),
+                'relpath': paths[roff:roff + rsize].decode('utf-8')}
+
+    def get(self, uuid):
+        """Get the record of the member with `uuid`; ``None`` if absent.
+
+        """
+        i = self._find(uuid)
+        if i is not None and i not in self._deleted:
+            return self._member(i)
+
+        if uuid in self._position:
+            return dict(self._appended[self._position[uuid]])
+
+    def put(self, record):
+        """Add a member record, replacing that of the same uuid if present.
+
+        """
+        uuid = record['uuid']
+        i = self._find(uuid)
+        if i is not None and i not in self._deleted:
+            self._changed[i] = dict(record)
+        elif uuid in self._position:
+            self._appended[self._position[uuid]] = dict(record)
+        else:
+            # check the uuid can be stored before taking the record
+            _uuidbytes(uuid)
+            self._position[uuid] = len(self._appended)
+            self._appended.append(dict(record))
+
+    def remove(self, uuids):
+        """Remove the members with the given uuids, where present.
+
+        """
+        uuids = set(uuids)
+        for uuid in uuids:
+            i = self._find(uuid)
+            if i is not None:
+                self._deleted.add(i)
+                self._changed.pop(i, None)
+
+        if uuids.intersection(self._position):
+            self._appended = [record for record in self._appended
+                              if record['uuid'] not in uuids]
+            self._position = {record['uuid']: i
+                              for i, record in enumerate(self._appended)}
+
+    def clear(self):
+        """Remove all members.
+
+        """
+        self.__init__()
+
+    def dump(self, handle):
+        """Write the table to binary file `handle`.
+
+        """
+        size = self._record.size
+        deleted = sorted(self._deleted)
+
+        garbage = self._garbage
+        for i in deleted + list(self._changed):
+            _, _, _, asize, _, rsize = self._unpack(i)
+            garbage += asize + rsize
+
+        if 2 * garbage > self._pathsize:
+            # rebuilding is cheaper than carrying the garbage along
+            return MemberTable.fromrecords(self).dump(handle)
+
+        types = list(self._types)
+        codes = {treanttype: i for i, treanttype in enumerate(types)}
+        blob = bytearray()
+
+        def pack(record):
+            code = codes.setdefault(record['treanttype'], len(types))
+            if code == len(types):
+                types.append(record['treanttype'])
+
+            abspath = record['abspath'].encode('utf-8')
+            relpath = record['relpath'].encode('utf-8')
+            aoff = self._pathsize + len(blob)
+            roff = aoff + len(abspath)
+            blob.extend(abspath)
+            blob.extend(relpath)
+            return self._record.pack(_uuidbytes(record['uuid']), code,
+                                     aoff, len(abspath), roff, len(relpath))
+
+        records = bytearray()
+        index = array('I')
+        if self._buf is not None:
+            records.extend(self._buf[self._recoff:self._idxoff])
+            index = _loadindex(self._buf[self._idxoff:self._idxoff +
+                                         self._n * self._indexentry.size])
+
+        for i, record in self._changed.items():
+            records[i * size:(i + 1) * size] = pack(record)
+
+        if deleted:
+            kept = bytearray()
+            start = 0
+            for i in deleted:
+                kept.extend(records[start * size:i * size])
+                start = i + 1
+            kept.extend(records[start * size:])
+            records = kept
+
+            # records after removed ones move up
+            index = array('I', (i - bisect_left(deleted, i) for i in index
+                                if i not in self._deleted))
+
+        n = len(index)
+        for record in self._appended:
+            records.extend(pack(record))
+
+        # new records go into the index in one pass, at the positions their
+        # uuids sort to among the old ones
+        def uuidat(j):
+            return bytes(records[j * size:j * size + 16])
+
+        new = sorted(range(n, len(records) // size), key=uuidat)
+        if new:
+            merged = array('I')
+            start = 0
+            for j in new:
+                stop = _lowerbound(n, uuidat(j),
+                                   lambda k: uuidat(index[k]))
+                merged.extend(index[start:stop])
+                merged.append(j)
+                start = stop
+            merged.extend(index[start:])
+            index = merged
+
+        typebytes = '\n'.join(types).encode('utf-8')
+        handle.write(self._header.pack(self._magic, len(index),
+                                       len(typebytes),
+                                       self._pathsize + len(blob), garbage))
+        handle.write(records)
+        handle.write(_dumpindex(index))
+        handle.write(typebytes)
+        if self._buf is not None:
+            handle.write(self._buf[self._pathoff:
+                                   self._pathoff + self._pathsize])
+        handle.write(blob)
+
+
+def _loadindex(data):
+    index = array('I')
+    if hasattr(index, 'frombytes'):
+        index.frombytes(bytes(data))
+    else:
+        index.fromstring(bytes(data))
+
+    if sys.byteorder == 'big':
+        index.byteswap()
+
+    return index
+
+
+def _dumpindex(index):
+    if sys.byteorder == 'big':
+        index = array('I', index)
+        index.byteswap()
+
+    if hasattr(index, 'tobytes'):
+        return index.tobytes()
+    return index.tostring()
+
+
+class _MemberShard(_Shard):
+    """Shard holding a Group's members as a :class:`MemberTable`.
+
+    """
+    _suffix = 'bin'
+    _binary = True
+
+    def _deserialize(self, handle):
+        fd = handle.fileno()
+        if not os.fstat(fd).st_size:
+            return MemberTable()
+
+        return MemberTable(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+
+    def _serialize(self, state, handle):
+        if not isinstance(state, MemberTable):
+            state = MemberTable.fromrecords(state)
+
+        state.dump(handle)
+
+    def _push_state(self):
+        super(_MemberShard, self)._push_state()
+
+        # read the table in place from the file just written on next access,
+        # instead of keeping its changes around
+        self._stamp = None
+
+
+class MemberTableFile(ShardedFile):
+    """File object keeping a Group's members in a compact binary table.
+
+    The state is sharded as for :class:`ShardedFile`, but the members are
+    kept in a :class:`MemberTable` that is memory-mapped instead of parsed.
+    Finding, adding, or changing a single member costs a binary search of
+    the table's uuid index, and writing the table out copies unchanged
+    members over without decoding them; listing all members decodes each
+    once. This pays off for Groups with very many members.
+
+    Member uuids must be valid UUIDs.
+
+    :Arguments:
+        *filename*
+            name of file on disk object corresponds to
+
+    """
+    _ext = 'table'
+
+    _shardclasses = {'members': _MemberShard}
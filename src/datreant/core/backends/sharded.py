@@ -0,0 +1,266 @@
+"""Sharded state files: each top-level item of the state in a file of its own.
+
+"""
+
+import os
+import errno
+import shutil
+from contextlib import contextmanager
+
+from .core import FileSerial, JSONFile, _fsync
+
+
+class _Shard(JSONFile):
+    """File holding one top-level item of a :class:`ShardedFile`'s state.
+
+    The state of a shard is the item itself; ``None`` if there is none, in
+    which case writing it removes the file.
+
+    """
+    # extension of shard files; not ``_ext``, as shards are no state files
+    _suffix = 'json'
+
+    def _init_state(self):
+        self._state = None
+
+    def create(self, state):
+        if state is not None:
+            super(_Shard, self).create(state)
+
+    def _push_state(self):
+        if self._state is not None:
+            super(_Shard, self)._push_state()
+            return
+
+        try:
+            os.remove(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._stamp = None
+
+
+class ShardedFile(FileSerial):
+    """File object keeping each top-level item of the state in its own file.
+
+    Each item, such as a Treant's tags or categories or a Group's members,
+    is kept as JSON in a hidden shard file next to the state file, with a
+    lock of its own. Reads and writes for a single limb lock, read, and
+    write only the shard of that limb's item, so writers of different limbs
+    don't wait on each other, and adding a tag to a Group doesn't rewrite
+    its members. Reads and writes of the whole state lock the state file,
+    then every shard.
+
+    The state file itself is left empty, and marks the treant's directory
+    as such. With 'flock' locking all shards share the directory's lock, so
+    writers of different limbs do wait on each other.
+
+    :Arguments:
+        *filename*
+            name of file on disk object corresponds to
+
+    """
+    _ext = 'shards'
+
+    # shard classes for items not kept as JSON
+    _shardclasses = {}
+
+    def __init__(self, filename, **kwargs):
+        super(ShardedFile, self).__init__(filename, **kwargs)
+
+        # shards are made with the same options as we were
+        self._kwargs = kwargs
+        self._shards = dict()
+        self._state = dict()
+
+    def _shard(self, key):
+        """Get the file for the shard holding item `key`.
+
+        """
+        try:
+            return self._shards[key]
+        except KeyError:
+            shardclass = self._shardclasses.get(key, _Shard)
+            name = ".{}.{}.{}".format(os.path.basename(self.filename), key,
+                                      shardclass._suffix)
+            shard = shardclass(os.path.join(self.get_location(), name),
+                               **self._kwargs)
+
+            # waits on shard locks count as waits on ours
+            shard.lockstats = self.lockstats
+
+            # another thread may have made one first
+            return self._shards.setdefault(key, shard)
+
+    def _keys(self):
+        """Get the keys of all items with a shard on disk, in sorted order.
+
+        """
+        prefix = ".{}.".format(os.path.basename(self.filename))
+        keys = []
+        for name in os.listdir(self.get_location()):
+            if not name.startswith(prefix):
+                continue
+
+            # names of proxy and buffer files have further extensions
+            key, _, suffix = name[len(prefix):].partition(os.extsep)
+            if suffix == self._shardclasses.get(key, _Shard)._suffix:
+                keys.append(key)
+
+        return sorted(keys)
+
+    def _gather(self, key, shard, state):
+        """Put the item of `shard` in `state` under `key`.
+
+        """
+        if shard._state is None:
+            state.pop(key, None)
+        else:
+            state[key] = shard._state
+
+    @contextmanager
+    def _locked(self, keys, mode, timeout=None, state=None):
+        """Lock the shards of `keys` in turn, gathering their items.
+
+        The items are gathered into `state`, or our own state if ``None``.
+        For mode 'write', the items are written back to their shards on
+        exiting the context.
+
+        """
+        if state is None:
+            state = self._state
+
+        if not keys:
+            yield
+            return
+
+        if timeout is None:
+            timeout = self.locktimeout
+
+        key, shard = keys[0], self._shard(keys[0])
+        context = shard.read if mode == 'read' else shard.write
+        with context(timeout):
+            self._gather(key, shard, state)
+            with self._locked(keys[1:], mode, timeout, state):
+                yield
+
+            if mode == 'write':
+                shard._state = state.get(key)
+
+    @contextmanager
+    def read(self, timeout=None, limb=None):
+        # if we already have any lock on the whole state, proceed
+        if self.fdlock:
+            yield self._state
+        elif limb is not None:
+            shard = self._shard(limb)
+            if shard.fdlock is None and not os.path.exists(shard.filename):
+                # no such item
+                self._state.pop(limb, None)
+                yield self._state
+            else:
+                with self._locked([limb], 'read', timeout):
+                    yield self._state
+        else:
+            self._apply_shared_lock(timeout)
+            try:
+                # gathered apart, as other threads may be reading too
+                state = dict()
+                with self._locked(self._keys(), 'read', timeout, state):
+                    self._state = state
+                    yield state
+            finally:
+                self._release_lock()
+
+    @contextmanager
+    def write(self, timeout=None, limb=None):
+        # if we already have an exclusive lock on the whole state, proceed
+        if self.fdlock == 'exclusive':
+            yield self._state
+        elif self.fdlock == 'shared':
+            raise IOError("Cannot write to '{}' while holding a shared "
+                          "lock on it".format(self.filename))
+        elif limb is not None:
+            with self._locked([limb], 'write', timeout):
+                yield self._state
+        else:
+            self._apply_exclusive_lock(timeout)
+            try:
+                if not os.path.exists(self.filename):
+                    open(self.filename, 'a').close()
+
+                self._init_state()
+                if timeout is None:
+                    timeout = self.locktimeout
+
+                keys = self._keys()
+                with self._locked(keys, 'write', timeout):
+                    yield self._state
+
+                    # new items get shards of their own
+                    for key in sorted(set(self._state) - set(keys)):
+                        shard = self._shard(key)
+                        with shard.write(timeout):
+                            shard._state = self._state[key]
+            finally:
+                self._release_lock()
+
+    def create(self, state):
+        """Create the file and its shards, holding `state`.
+
+        Each shard is created with a single write, as for
+        :class:`~datreant.core.backends.core.FileSerial`, and the state file
+        last, so the treant is only found once all of its items are there.
+
+        :Raises:
+            *OSError*
+                with errno ``EEXIST`` if the file already exists
+
+        """
+        self._check_writable()
+        if os.path.exists(self.filename):
+            raise OSError(errno.EEXIST, "File exists: '{}'".format(
+                self.filename))
+
+        for key in sorted(state):
+            self._shard(key).create(state[key])
+
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                     0o666)
+        os.close(fd)
+
+        sync = self._sync()
+        if sync == 'now':
+            _fsync(self.get_location())
+        elif sync == 'later':
+            self._sync_later(self.filename)
+
+        self._state = dict(state)
+
+    def delete(self):
+        """Delete this file, its shards, and their proxy or lease files.
+
+        This file instance will be unusable after this operation.
+
+        """
+        with self.write():
+            # with no items, all shards are removed
+            self._state.clear()
+            os.remove(self.filename)
+
+        if self.locking == 'proxy':
+            os.remove(self.proxy)
+            for shard in self._shards.values():
+                try:
+                    os.remove(shard.proxy)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        elif self.locking == 'lease':
+            for f in [self] + list(self._shards.values()):
+                shutil.rmtree(f.lease + 's', ignore_errors=True)
+
+        if self.fdpool is not None:
+            self.fdpool.discard(self.proxy)
+            for shard in self._shards.values():
+                self.fdpool.discard(shard.proxy)
@@ -0,0 +1,494 @@
+"""State of many treants kept in a single SQLite database at a project root.
+
+"""
+
+import os
+import copy
+import json
+import time
+import errno
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .core import FileSerial, LockTimeoutError, _PerThread
+
+STORENAME = '.datreant.sqlite'
+
+# stores found so far, by database filename
+_STORES = dict()
+
+
+class RootStore(object):
+    """SQLite database holding the state of all treants below a directory.
+
+    Each top-level item of a treant's state (its tags, categories, members,
+    and so on) is kept as a row keyed by the treant's uuid, so the state of
+    any number of treants can be had with a single indexed query. The
+    database uses write-ahead logging, so reads never wait on writes.
+
+    A store is made with :meth:`create`; treants generated anywhere below
+    its directory then keep their state in it.
+
+    :Arguments:
+        *directory*
+            directory containing the store
+
+    """
+    def __init__(self, directory):
+        self.filename = os.path.join(os.path.abspath(directory), STORENAME)
+
+        # connections can't be shared between threads or across a fork
+        self._local = threading.local()
+
+    @classmethod
+    def create(cls, directory):
+        """Create a store in `directory`, if there isn't one already.
+
+        :Arguments:
+            *directory*
+                directory to create store in
+
+        :Returns:
+            *store*
+                the store
+
+        """
+        store = cls(directory)
+        conn = store.connection
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                     "uuid TEXT NOT NULL, key TEXT NOT NULL, "
+                     "value TEXT NOT NULL, PRIMARY KEY (uuid, key)) "
+                     "WITHOUT ROWID")
+
+        _STORES[store.filename] = store
+        return store
+
+    @classmethod
+    def find(cls, path):
+        """Get the store for `path`, from its directory or any above.
+
+        :Arguments:
+            *path*
+                directory to start looking from
+
+        :Returns:
+            *store*
+                the nearest store, or ``None`` if there is none
+
+        """
+        path = os.path.abspath(path)
+        while True:
+            filename = os.path.join(path, STORENAME)
+            if filename in _STORES or os.path.exists(filename):
+                try:
+                    return _STORES[filename]
+                except KeyError:
+                    return _STORES.setdefault(filename, cls(path))
+
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    @property
+    def connection(self):
+        """Connection to the database for this thread and process.
+
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # transactions are begun and ended explicitly
+            local.connection = sqlite3.connect(self.filename,
+                                               isolation_level=None)
+            local.pid = os.getpid()
+            local.mode = None
+            local.stamp = None
+
+        return local.connection
+
+    @property
+    def wal(self):
+        """Path to the store's write-ahead log.
+
+        """
+        return self.filename + '-wal'
+
+    @contextmanager
+    def transaction(self, mode, timeout=None):
+        """Take part in a transaction on the store.
+
+        A transaction is begun if none is open in this thread, and committed
+        on exiting the context, or rolled back if an exception was raised
+        within it; otherwise the open one is joined.
+
+        :Arguments:
+            *mode*
+                'shared' for reading, 'exclusive' for writing
+
+        :Keywords:
+            *timeout*
+                maximum time in seconds to wait for a write transaction;
+                ``None`` waits indefinitely
+
+        :Returns:
+            *outermost*
+                True if the transaction was begun here
+
+        """
+        conn = self.connection
+        local = self._local
+
+        if local.mode is not None:
+            if mode == 'exclusive' and local.mode == 'shared':
+                raise IOError("Cannot write to '{}' within a read of "
+                              "it".format(self.filename))
+            yield False
+            return
+
+        if mode == 'exclusive':
+            # busy timeout is in milliseconds; the largest stands in for
+            # waiting indefinitely
+            wait = 2 ** 31 - 1 if timeout is None else int(timeout * 1000)
+            conn.execute("PRAGMA busy_timeout = {:d}".format(wait))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                raise LockTimeoutError(
+                    "Could not begin writing to '{}' within {} seconds: "
+                    "{}".format(self.filename, timeout, e))
+        else:
+            conn.execute("BEGIN")
+
+        local.mode = mode
+        try:
+            yield True
+        except:
+            local.mode = None
+            local.stamp = None
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            local.mode = None
+            local.stamp = None
+            conn.execute("COMMIT")
+
+    def stamp(self):
+        """Get identity of the store's contents as seen by this thread.
+
+        It changes with any commit to the store, from this connection or
+        any other.
+
+        """
+        # nothing changes for the length of a read transaction
+        local = self._local
+        if local.mode == 'shared' and local.stamp is not None:
+            return local.stamp
+
+        conn = self.connection
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        stamp = (version, conn.total_changes)
+
+        if local.mode == 'shared':
+            local.stamp = stamp
+        return stamp
+
+    def states(self, uuids=None):
+        """Get the states of many treants at once.
+
+        :Keywords:
+            *uuids*
+                uuids of treants to get states for; all in the store if
+                ``None``
+
+        :Returns:
+            *states*
+                dict giving the state of each treant by uuid; treants not
+                in the store are left out
+
+        """
+        conn = self.connection
+        with self.transaction('shared'):
+            if uuids is None:
+                rows = conn.execute("SELECT uuid, key, value FROM state")
+                rows = rows.fetchall()
+            else:
+                uuids = list(uuids)
+                rows = []
+                # stay within SQLite's limit on query parameters
+                for i in range(0, len(uuids), 500):
+                    chunk = uuids[i:i + 500]
+                    rows.extend(conn.execute(
+                        "SELECT uuid, key, value FROM state WHERE uuid IN "
+                        "({})".format(', '.join('?' * len(chunk))), chunk))
+
+        states = dict()
+        for uuid, key, value in rows:
+            states.setdefault(uuid, dict())[key] = json.loads(value)
+
+        return states
+
+    def load(self, files):
+        """Bring the state of many files in this store up to date at once.
+
+        Files whose state is already current are skipped; the rest are
+        loaded with :meth:`states`.
+
+        :Arguments:
+            *files*
+                :class:`SQLiteFile` instances to load
+
+        """
+        with self.transaction('shared'):
+            stamp = self.stamp()
+            stale = [f for f in files if f._stamp != stamp]
+            if not stale:
+                return
+
+            states = self.states(f._uuid for f in stale)
+            for f in stale:
+                if f._uuid in states:
+                    f._state = states[f._uuid]
+                    f._stamp = stamp
+
+
+@contextmanager
+def prefetch(files):
+    """Context in which the state of many files is read ahead in bulk.
+
+    Files kept in a :class:`RootStore` are loaded with a single query to
+    each store, within a read transaction on it lasting for the context;
+    reads of any of them within the context then need no further queries.
+    Other files are left alone.
+
+    :Arguments:
+        *files*
+            File instances to read ahead
+
+    """
+    bystore = dict()
+    for f in files:
+        if isinstance(f, SQLiteFile):
+            bystore.setdefault(f._store, list()).append(f)
+
+    with _prefetch(list(bystore.items())):
+        yield
+
+
+@contextmanager
+def _prefetch(bystore):
+    if not bystore:
+        yield
+        return
+
+    (store, files), rest = bystore[0], bystore[1:]
+    with store.transaction('shared'):
+        store.load(files)
+        with _prefetch(rest):
+            yield
+
+
+class SQLiteFile(FileSerial):
+    """File object for state kept in a :class:`RootStore`.
+
+    The state file itself is left empty, and marks the treant's directory
+    as such; the state is kept in the nearest store at or above it. Locking
+    is done by the store's transactions, so no proxy file is made. A treant
+    can only be moved within the directory of its store.
+
+    With `durability` 'fast', commits are left to the operating system to
+    write out; 'safe' syncs each commit, and 'group' syncs the store's log
+    at the end of a sync group.
+
+    Each thread has a connection to the store of its own; threads of this
+    process also wait on each other's writes to the treant before
+    beginning a transaction.
+
+    :Arguments:
+        *filename*
+            name of file on disk object corresponds to
+
+    """
+    _ext = 'store'
+
+    locking = 'store'
+    _lockings = ('store',)
+
+    # commits to the store are counted by connection, so by thread
+    _stamp = _PerThread('_stamp')
+
+    def __init__(self, filename, **kwargs):
+        super(SQLiteFile, self).__init__(filename, **kwargs)
+
+        self._store = RootStore.find(os.path.dirname(self.filename))
+        if self._store is None:
+            raise IOError(errno.ENOENT, "No root store found for "
+                          "'{}'".format(self.filename))
+
+        self._uuid = os.path.basename(self.filename).split(os.extsep)[1]
+
+        # copy of state as it was pulled for a write; used to find changes
+        self._base = None
+
+    @contextmanager
+    def read(self, timeout=None, limb=None):
+        # if we already have any lock, proceed
+        if self.fdlock:
+            yield self._state
+            return
+
+        self._apply_shared_lock(timeout)
+        try:
+            with self._store.transaction('shared'):
+                with self._pulling:
+                    self._pull_state()
+                yield self._state
+        finally:
+            self._release_lock()
+
+    @contextmanager
+    def write(self, timeout=None, limb=None):
+        # if we already have an exclusive lock, proceed
+        if self.fdlock == 'exclusive':
+            yield self._state
+            return
+        elif self.fdlock == 'shared':
+            raise IOError("Cannot write to '{}' while holding a shared "
+                          "lock on it".format(self.filename))
+
+        if timeout is None:
+            timeout = self.locktimeout
+
+        self._sync_mode()
+
+        start = time.time()
+        self._apply_exclusive_lock(timeout)
+        try:
+            if timeout is not None:
+                timeout = max(0, start + timeout - time.time())
+
+            start = time.time()
+            with self._store.transaction('exclusive', timeout) as outermost:
+                self._record_wait(time.time() - start)
+
+                try:
+                    with self._pulling:
+                        self._pull_state()
+                except IOError:
+                    self._init_state()
+                    self._base = dict()
+
+                self._stamp = None
+                yield self._state
+                self._push_state()
+
+                # taken before commit, so a commit by anyone else after
+                # ours changes it
+                stamp = self._store.stamp()
+        finally:
+            self._release_lock()
+
+        # our own commit leaves the state we have current; a transaction we
+        # only joined may yet be rolled back
+        if outermost:
+            self._stamp = stamp
+
+    def _snapshot(self):
+        # stamps count commits seen by a connection, so mean nothing to
+        # another
+        return None
+
+    def create(self, state):
+        """Create the state file, and `state` in the store, in a single
+        transaction.
+
+        :Raises:
+            *OSError*
+                with errno ``EEXIST`` if the file already exists
+
+        """
+        if os.path.exists(self.filename):
+            raise OSError(errno.EEXIST, "File exists: '{}'".format(
+                self.filename))
+
+        with self.write():
+            self._state.update(state)
+
+    def check_location(self, location):
+        super(SQLiteFile, self).check_location(location)
+
+        if RootStore.find(location) is not self._store:
+            raise ValueError("Cannot move '{}' out of its root store "
+                             "'{}'".format(self.filename,
+                                           self._store.filename))
+
+    def delete(self):
+        """Delete this treant's state from the store, and its state file.
+
+        This file instance will be unusable after this operation.
+
+        """
+        self._check_writable()
+        with self._store.transaction('exclusive', self.locktimeout):
+            self._store.connection.execute(
+                "DELETE FROM state WHERE uuid = ?", (self._uuid,))
+            os.remove(self.filename)
+
+    def _sync_mode(self):
+        """Set how the store's connection syncs commits, from `durability`.
+
+        """
+        sync = self._sync()
+        if sync == 'later':
+            self._sync_later(self._store.wal)
+
+        # can't be changed within a transaction; an open one keeps its own
+        conn = self._store.connection
+        if self._store._local.mode is None:
+            conn.execute("PRAGMA synchronous = {}".format(
+                'FULL' if sync == 'now' else 'NORMAL'))
+
+    def _record_wait(self, waited):
+        # the lock within the process was counted as it was taken
+        self.lockstats['waited'] += waited
+        self.lockstats['maxwait'] = max(self.lockstats['maxwait'], waited)
+
+    def _pull_state(self):
+        # if nothing was committed to the store since we last loaded there's
+        # no need to query it again
+        stamp = self._store.stamp()
+        if stamp != self._stamp:
+            rows = self._store.connection.execute(
+                "SELECT key, value FROM state WHERE uuid = ?",
+                (self._uuid,)).fetchall()
+
+            if not rows:
+                raise IOError(errno.ENOENT, "No state for '{}' in "
+                              "'{}'".format(self.filename,
+                                            self._store.filename))
+
+            self._state = {key: json.loads(value) for key, value in rows}
+            self._stamp = stamp
+
+        if self.fdlock == 'exclusive':
+            self._base = copy.deepcopy(self._state)
+
+    def _push_state(self):
+        conn = self._store.connection
+
+        # only items changed since the state was pulled are written
+        for key in self._base:
+            if key not in self._state:
+                conn.execute("DELETE FROM state WHERE uuid = ? AND key = ?",
+                             (self._uuid, key))
+
+        for key, value in self._state.items():
+            if key not in self._base or self._base[key] != value:
+                conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+                             (self._uuid, key, json.dumps(value)))
+
+        self._base = None
+
+        if not os.path.exists(self.filename):
+            open(self.filename, 'a').close()
@@ -7,12 +7,23 @@ import os
 import warnings
 
 from .core import JSONFile
+from .sqlite import RootStore, SQLiteFile
+from . import daemon
 
 
 def treantfile(filename, **kwargs):
     """Generate or regenerate the appropriate treant file instance from
     filename.
 
+    The format of the state file is given by its extension. A name without
+    one is for a new state file, and gets the extension of the 'store'
+    format if there is a :class:`~datreant.core.backends.sqlite.RootStore`
+    at or above its directory, or 'json' otherwise.
+
+    If :data:`~datreant.core.backends.daemon.socketpath` is set and a
+    daemon listens there, state files of formats it serves are used through
+    it.
+
     :Arguments:
         *filename*
             path to state file (existing or to be created), including the
@@ -23,9 +34,43 @@ def treantfile(filename, **kwargs):
             treantfile instance attached to the given file
 
     """
-    from .. import _TREANTS
+    filename, cls = fileclass(filename)
+    if daemon.socketpath is not None and daemon.serves(cls) and \
+            daemon.reachable():
+        cls = daemon.client(cls)
+
+    return cls(filename, **kwargs)
 
-    treanttype = os.path.basename(filename).split(os.extsep)[0]
+
+def fileclass(filename):
+    """Get the treant file class for a state file, as :func:`treantfile`
+    would, but never that of a client of a daemon.
+
+    :Arguments:
+        *filename*
+            path to state file (existing or to be created), including the
+            filename
+
+    :Returns:
+        *filename*
+            path to state file, with the extension of its format
+        *fileclass*
+            treant file class for the state file
+
+    """
+    from .. import _TREANTS, _FORMATS
+
+    parts = os.path.basename(filename).split(os.extsep, 2)
+    treanttype = parts[0]
+
+    if len(parts) == 2:
+        if RootStore.find(os.path.dirname(os.path.abspath(filename))):
+            ext = SQLiteFile._ext
+        else:
+            ext = JSONFile._ext
+
+        filename = os.extsep.join((filename, ext))
+        parts.append(ext)
 
     try:
         statefileclass = _TREANTS[treanttype]._backendclass
@@ -34,7 +79,79 @@ def treantfile(filename, **kwargs):
                       "defaulting to TreantFile".format(filename))
         statefileclass = _TREANTS['Treant']._backendclass
 
-    return statefileclass(filename, **kwargs)
+    try:
+        formatclass = _FORMATS[parts[2]]
+    except (KeyError, IndexError):
+        raise ValueError("No known state file format for "
+                         "file '{}'".format(filename))
+
+    return filename, _formatted(statefileclass, formatclass)
+
+
+def readstates(filenames):
+    """Read the states of many state files, without writing to any.
+
+    States kept in a :class:`~datreant.core.backends.sqlite.RootStore` are
+    loaded from each store with a single query.
+
+    :Arguments:
+        *filenames*
+            paths to existing state files
+
+    :Returns:
+        *states*
+            dict giving the state of each file by path; files that are gone
+            or can't be read are left out
+
+    """
+    states = dict()
+    stores = dict()
+    for filename in filenames:
+        if filename.endswith(os.extsep + SQLiteFile._ext):
+            store = RootStore.find(os.path.dirname(os.path.abspath(filename)))
+            if store is not None:
+                stores.setdefault(store, list()).append(filename)
+            continue
+
+        try:
+            _, cls = fileclass(filename)
+            statefile = cls(filename, readonly=True)
+            with statefile.read():
+                states[filename] = dict(statefile._state)
+        except (IOError, OSError, ValueError):
+            pass
+
+    for store, storefiles in stores.items():
+        uuids = [filename.split(os.extsep)[-2] for filename in storefiles]
+        found = store.states(uuids)
+        for filename, uuid in zip(storefiles, uuids):
+            if uuid in found:
+                states[filename] = found[uuid]
+
+    return states
+
+
+# classes combining a treant file class with a format; built as needed
+_FORMATTED = dict()
+
+
+def _formatted(statefileclass, formatclass):
+    """Get the class giving *statefileclass* behavior with the format of
+    *formatclass*.
+
+    """
+    if issubclass(statefileclass, formatclass):
+        return statefileclass
+
+    try:
+        cls = _FORMATTED[(statefileclass, formatclass)]
+    except KeyError:
+        name = formatclass.__name__.replace('File', '') + \
+            statefileclass.__name__
+        cls = type(statefileclass)(name, (formatclass, statefileclass), {})
+        _FORMATTED[(statefileclass, formatclass)] = cls
+
+    return cls
 
 
 class TreantFile(JSONFile):
@@ -44,6 +161,9 @@ class TreantFile(JSONFile):
     structure elements common to all Treants. It also implements low-level
     I/O functionality.
 
+    State is stored as JSON by default; :func:`treantfile` gives a variant
+    using the format registered for the file's extension.
+
     :Arguments:
         *filename*
             path to file
@@ -0,0 +1,433 @@
+"""
+Persistent catalog of the treants below a project root, for finding and
+querying them without walking the filesystem.
+
+A catalog is a SQLite database made in the project root with
+:meth:`Catalog.create`. It records the uuid, treanttype, state file path,
+and tags and categories of every treant below the root, along with the
+modification time of every directory it has seen. :meth:`Catalog.refresh`
+brings it up to date by listing only the directories whose modification
+time changed, which is where state files were created, replaced, moved, or
+removed; the rest cost a single stat.
+
+:func:`~datreant.core.discover` and the search for Bundle and Group members
+that have moved use the nearest catalog if there is one.
+
+"""
+import os
+import errno
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import scandir
+
+from . import filesystem
+
+CATALOGNAME = '.datreant.catalog'
+
+# catalogs found so far, by database filename
+_CATALOGS = dict()
+
+
+def _mtime(st):
+    return getattr(st, 'st_mtime_ns', st.st_mtime)
+
+
+def _rel(path, parent):
+    """Join relative paths, where the root is ''."""
+    return os.path.join(parent, path) if parent else path
+
+
+class Catalog(object):
+    """SQLite index of the treants below a project root.
+
+    Paths are recorded relative to the root, so a catalog moves with its
+    project. Directories whose names begin with '.' are not looked in, nor
+    are symbolic links to directories followed.
+
+    Changes to the state of treants are seen by :meth:`refresh` where they
+    replace the state file or one of its shards, which changes the
+    modification time of their directory; this holds for all formats but
+    'journal' and 'store', whose treants are checked on every refresh: the
+    state file and journal are stat'ed for the former, and the states of the
+    latter loaded from each store with a single query.
+
+    :Arguments:
+        *directory*
+            project root containing the catalog
+
+    """
+    def __init__(self, directory):
+        self.root = os.path.abspath(directory)
+        self.filename = os.path.join(self.root, CATALOGNAME)
+
+        # connections can't be shared between threads or across a fork
+        self._local = threading.local()
+
+    @classmethod
+    def create(cls, directory):
+        """Create a catalog in `directory` and build it.
+
+        If there is one already, it is rebuilt.
+
+        :Arguments:
+            *directory*
+                project root to catalog
+
+        :Returns:
+            *catalog*
+                the catalog
+
+        """
+        catalog = cls(directory)
+        conn = catalog.connection
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, mtime INTEGER NOT NULL)
+                WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS treants (
+                path TEXT PRIMARY KEY, dir TEXT NOT NULL,
+                uuid TEXT NOT NULL, treanttype TEXT NOT NULL,
+                mtime INTEGER NOT NULL, size INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS treants_dir ON treants (dir);
+            CREATE INDEX IF NOT EXISTS treants_uuid ON treants (uuid);
+            CREATE TABLE IF NOT EXISTS tags (
+                tag TEXT NOT NULL, path TEXT NOT NULL,
+                PRIMARY KEY (tag, path)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS tags_path ON tags (path);
+            CREATE TABLE IF NOT EXISTS categories (
+                key TEXT NOT NULL, value, path TEXT NOT NULL,
+                PRIMARY KEY (key, path)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS categories_path ON categories (path);
+            """)
+
+        _CATALOGS[catalog.filename] = catalog
+        catalog.build()
+        return catalog
+
+    @classmethod
+    def find(cls, path):
+        """Get the catalog for `path`, from its directory or any above.
+
+        :Arguments:
+            *path*
+                directory to start looking from
+
+        :Returns:
+            *catalog*
+                the nearest catalog, or ``None`` if there is none
+
+        """
+        path = os.path.abspath(path)
+        while True:
+            filename = os.path.join(path, CATALOGNAME)
+            if filename in _CATALOGS or os.path.exists(filename):
+                try:
+                    return _CATALOGS[filename]
+                except KeyError:
+                    return _CATALOGS.setdefault(filename, cls(path))
+
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    @property
+    def connection(self):
+        """Connection to the database for this thread and process.
+
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # transactions are begun and ended explicitly
+            local.connection = sqlite3.connect(self.filename,
+                                               isolation_level=None)
+            local.pid = os.getpid()
+
+        return local.connection
+
+    @contextmanager
+    def _transaction(self):
+        """Write to the catalog, committing on exiting the context.
+
+        """
+        conn = self.connection
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _abspath(self, path):
+        return os.path.join(self.root, path)
+
+    def build(self):
+        """Build the catalog from scratch.
+
+        Every directory below the root is listed, and every state file
+        read.
+
+        """
+        with self._transaction() as conn:
+            for table in ('dirs', 'treants', 'tags', 'categories'):
+                conn.execute("DELETE FROM {}".format(table))
+
+            pending = []
+            self._scan(conn, '', pending, recurse=True)
+            self._index(conn, pending)
+
+    def refresh(self):
+        """Bring the catalog up to date with the filesystem.
+
+        Only directories whose modification time changed since they were
+        last seen are listed, and only state files that changed are read.
+
+        :Returns:
+            *changed*
+                number of directories listed
+
+        """
+        with self._transaction() as conn:
+            known = dict(conn.execute("SELECT path, mtime FROM dirs"))
+            if not known:
+                # never built; everything is new
+                known = {'': None}
+
+            pending = []
+            changed = 0
+            for path in sorted(known):
+                try:
+                    st = os.stat(self._abspath(path))
+                except OSError as e:
+                    if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                        raise
+                    self._forget(conn, path)
+                    continue
+
+                if _mtime(st) != known[path]:
+                    self._scan(conn, path, pending, known=known)
+                    changed += 1
+
+            # journals are appended to, and stores written, in place
+            for path, in conn.execute(
+                    "SELECT path FROM treants WHERE path LIKE '%.journal' "
+                    "OR path LIKE '%.store'").fetchall():
+                if path.endswith('.journal'):
+                    # the journal's own changes count for the state file
+                    self._restat(conn, path, pending)
+                else:
+                    pending.append(path)
+
+            self._index(conn, pending)
+
+        return changed
+
+    def _forget(self, conn, path):
+        """Drop a directory that's gone, and the treants in it.
+
+        """
+        conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+        for statefile, in conn.execute(
+                "SELECT path FROM treants WHERE dir = ?",
+                (path,)).fetchall():
+            self._drop(conn, statefile)
+
+    def _drop(self, conn, path):
+        for table in ('treants', 'tags', 'categories'):
+            conn.execute("DELETE FROM {} WHERE path = ?".format(table),
+                         (path,))
+
+    def _stamp(self, path):
+        """Get (mtime, size) of a state file, and of its journal if any.
+
+        """
+        abspath = self._abspath(path)
+        st = os.stat(abspath)
+        mtime, size = _mtime(st), st.st_size
+
+        if path.endswith('.journal'):
+            journal = os.path.join(os.path.dirname(abspath), ".{}.log".format(
+                os.path.basename(abspath)))
+            try:
+                jst = os.stat(journal)
+            except OSError:
+                pass
+            else:
+                mtime = max(mtime, _mtime(jst))
+                size += jst.st_size
+
+        return mtime, size
+
+    def _restat(self, conn, path, pending):
+        """Queue a known state file for reading if it or its journal changed.
+
+        """
+        try:
+            stamp = self._stamp(path)
+        except OSError:
+            self._drop(conn, path)
+            return
+
+        row = conn.execute("SELECT mtime, size FROM treants WHERE path = ?",
+                           (path,)).fetchone()
+        if row is None or tuple(row) != stamp:
+            conn.execute("UPDATE treants SET mtime = ?, size = ? "
+                         "WHERE path = ?", stamp + (path,))
+            pending.append(path)
+
+    def _scan(self, conn, path, pending, known=None, recurse=False):
+        """List a directory, recording its state files and subdirectories.
+
+        Subdirectories not seen before are scanned in turn.
+
+        """
+        try:
+            st = os.stat(self._abspath(path))
+            entries = list(scandir.scandir(self._abspath(path)))
+        except OSError:
+            self._forget(conn, path)
+            return
+
+        conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)",
+                     (path, _mtime(st)))
+
+        old = set(statefile for statefile, in conn.execute(
+            "SELECT path FROM treants WHERE dir = ?", (path,)))
+
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.'):
+                continue
+
+            relpath = _rel(name, path)
+            if entry.is_dir(follow_symlinks=False):
+                if recurse or known is None or relpath not in known:
+                    self._scan(conn, relpath, pending, known, recurse=True)
+            elif filesystem.is_statefile(name):
+                # the state may be in shards next to the state file, so
+                # every state file in a changed directory is read again
+                try:
+                    stamp = self._stamp(relpath)
+                except OSError:
+                    continue
+
+                old.discard(relpath)
+                treanttype, uuid, _ = name.split(os.extsep, 2)
+                conn.execute("INSERT OR REPLACE INTO treants VALUES "
+                             "(?, ?, ?, ?, ?, ?)",
+                             (relpath, path, uuid, treanttype) + stamp)
+                pending.append(relpath)
+
+        # state files no longer there
+        for statefile in old:
+            self._drop(conn, statefile)
+
+    def _index(self, conn, paths):
+        """Record the tags and categories of state files.
+
+        State kept in a root store is loaded from each store in bulk.
+
+        """
+        from .backends.statefiles import readstates
+
+        # gone or unreadable ones are indexed without tags or categories
+        found = readstates([self._abspath(path) for path in paths])
+        states = dict((path, found.get(self._abspath(path), dict()))
+                      for path in paths)
+
+        for path, state in states.items():
+            conn.execute("DELETE FROM tags WHERE path = ?", (path,))
+            conn.execute("DELETE FROM categories WHERE path = ?", (path,))
+            conn.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)",
+                             [(tag, path) for tag in state.get('tags', [])])
+            conn.executemany(
+                "INSERT OR REPLACE INTO categories VALUES (?, ?, ?)",
+                [(key, value, path) for key, value
+                 in state.get('categories', {}).items()])
+
+    def query(self, tags=None, categories=None, treanttype=None,
+              under=None):
+        """Get the state files of treants matching all of the given criteria,
+        as of the last build or refresh.
+
+        :Keywords:
+            *tags*
+                tags the treants must all have
+            *categories*
+                dict of categories the treants must have, with these values
+            *treanttype*
+                treanttype of the treants
+            *under*
+                directory the treants must be in, or below
+
+        :Returns:
+            *statefiles*
+                list of absolute paths to state files, sorted
+
+        """
+        clauses = []
+        params = []
+
+        for tag in tags or []:
+            clauses.append("path IN (SELECT path FROM tags WHERE tag = ?)")
+            params.append(tag)
+
+        for key, value in (categories or {}).items():
+            clauses.append("path IN (SELECT path FROM categories "
+                           "WHERE key = ? AND value = ?)")
+            params.extend((key, value))
+
+        if treanttype is not None:
+            clauses.append("treanttype = ?")
+            params.append(treanttype)
+
+        if under is not None:
+            under = os.path.relpath(os.path.abspath(under), self.root)
+            if under.startswith(os.pardir):
+                return []
+            elif under != os.curdir:
+                escaped = under.replace('\\', '\\\\').replace(
+                    '%', '\\%').replace('_', '\\_')
+                clauses.append("(dir = ? OR dir LIKE ? ESCAPE '\\')")
+                params.extend((under, escaped + os.sep + '%'))
+
+        sql = "SELECT path FROM treants"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY path"
+
+        return [self._abspath(path)
+                for path, in self.connection.execute(sql, params)]
+
+    def locate(self, uuids):
+        """Get the state files of treants by uuid, as of the last build or
+        refresh.
+
+        :Arguments:
+            *uuids*
+                uuids of the treants to locate
+
+        :Returns:
+            *statefiles*
+                dict giving the absolute path to a state file for each
+                uuid found
+
+        """
+        uuids = list(uuids)
+        found = dict()
+
+        # stay within SQLite's limit on query parameters
+        for i in range(0, len(uuids), 500):
+            chunk = uuids[i:i + 500]
+            for uuid, path in self.connection.execute(
+                    "SELECT uuid, path FROM treants WHERE uuid IN "
+                    "({}) ORDER BY path".format(', '.join('?' * len(chunk))),
+                    chunk):
+                found.setdefault(uuid, self._abspath(path))
+
+        return found
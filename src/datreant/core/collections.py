@@ -37,6 +37,19 @@ class CollectionMixin(object):
     def __iter__(self):
         return self._list().__iter__()
 
+    def aiter(self):
+        """Iterate asynchronously over the members of this collection.
+
+        Members are looked up on :mod:`~datreant.core.aio`'s executor,
+        without blocking the event loop::
+
+            >>> async for member in b.aiter():
+            ...     print(member.name)
+
+        """
+        from . import aio
+        return aio.members(self)
+
     def __eq__(self, other):
         try:
             return set(self) == set(other)
@@ -505,6 +518,10 @@ class Bundle(CollectionMixin):
         Treants will be added to the collection.
     limbs : list or set
         Names of limbs to immediately attach.
+    mode : {'a', 'r'}
+        Mode to open Treants given as paths, and members found on disk, in;
+        with 'r' they are opened read-only. See
+        :class:`~datreant.core.Treant`.
 
     """
     _memberpaths = ['abspath']
@@ -514,11 +531,21 @@ class Bundle(CollectionMixin):
     _classagglimbs = set()
     _agglimbs = set()
 
+    _mode = 'a'
+
+    # whether membership is kept in a state file opened read-only
+    _readonly = False
+
     def __init__(self, *treants, **kwargs):
         self._cache = dict()
         self._state = list()
         self._searchtime = 10
 
+        mode = kwargs.pop('mode', 'a')
+        if mode not in ('a', 'r'):
+            raise ValueError("Mode must be 'a' or 'r'")
+        self._mode = mode
+
         self.add(*treants)
 
         # attach any limbs given
@@ -573,7 +600,7 @@ class Bundle(CollectionMixin):
             # a name always returns a Bundle
             out = Bundle([self.filepaths[i] for i, name
                           in enumerate(self.names) if name == index],
-                         limbs=self.limbs)
+                         limbs=self.limbs, mode=self._mode)
 
             # if no names match, we try uuids
             if not len(out):
@@ -585,7 +612,8 @@ class Bundle(CollectionMixin):
                     out = out[0]
         elif isinstance(index, slice):
             # we also take slices, obviously
-            out = Bundle(*self.filepaths[index], limbs=self.limbs)
+            out = Bundle(*self.filepaths[index], limbs=self.limbs,
+                         mode=self._mode)
             out._cache.update(self._cache)
         else:
             raise IndexError("Cannot index Bundle with given values")
@@ -738,13 +766,14 @@ class Bundle(CollectionMixin):
                 outconts.append(treant)
                 self._cache[treant.uuid] = treant
             elif isinstance(treant, (Leaf, Tree)):
-                tre = filesystem.path2treant(treant.abspath)
+                tre = filesystem.path2treant(treant.abspath, mode=self._mode)
                 outconts.extend(tre)
             elif os.path.exists(treant):
-                tre = filesystem.path2treant(treant)
+                tre = filesystem.path2treant(treant, mode=self._mode)
                 outconts.extend(tre)
             elif isinstance(treant, string_types):
-                tre = filesystem.path2treant(*glob.glob(treant))
+                tre = filesystem.path2treant(*glob.glob(treant),
+                                             mode=self._mode)
                 outconts.extend(tre)
             else:
                 raise TypeError("'{}' not a valid input "
@@ -938,10 +967,11 @@ class Bundle(CollectionMixin):
             # case of an IOError, skip (probably due to permissions, but will
             # need something more robust later
             self._cache.update(foundconts)
-            try:
-                self.add(*foundconts.values())
-            except OSError:
-                pass
+            if not self._readonly:
+                try:
+                    self.add(*foundconts.values())
+                except (OSError, IOError):
+                    pass
 
             # insert found treants into output list
             for uuid in findlist:
@@ -955,7 +985,7 @@ class Bundle(CollectionMixin):
 
         return memberlist
 
-    def map(self, function, processes=1, **kwargs):
+    def map(self, function, processes=1, snapshot=False, **kwargs):
         """Apply a function to each member, perhaps in parallel.
 
         A pool of processes is created for *processes* > 1; for example,
@@ -975,6 +1005,11 @@ class Bundle(CollectionMixin):
             *processes*
                 how many processes to use; if 1, applies function to each
                 member in member order
+            *snapshot*
+                if True, each member is sent to the worker processes with a
+                snapshot of its state, so their first read of it needn't
+                parse its state file; pays off for functions reading the
+                state of members with large state files
 
         :Returns:
             *results*
@@ -983,12 +1018,24 @@ class Bundle(CollectionMixin):
                 member, then only ``None`` is returned instead of a list
             """
         if processes > 1:
+            members = self._list()
+
+            # members are pickled for the workers as they are handed out
+            if snapshot:
+                for member in members:
+                    member._picklestate = True
+
             pool = mp.Pool(processes=processes)
-            results = dict()
-            results = {member.uuid: pool.apply_async(
-                    function, args=(member,), kwds=kwargs) for member in self}
+            try:
+                results = dict()
+                results = {member.uuid: pool.apply_async(
+                        function, args=(member,), kwds=kwargs)
+                    for member in members}
 
-            output = {key: results[key].get() for key in results}
+                output = {key: results[key].get() for key in results}
+            finally:
+                for member in members:
+                    member.__dict__.pop('_picklestate', None)
 
             pool.close()
             pool.join()
@@ -1046,7 +1093,7 @@ class Bundle(CollectionMixin):
 
         guuids = list(exclude)
         memberlist = self._list()
-        flattened = Bundle(limbs=self.limbs)
+        flattened = Bundle(limbs=self.limbs, mode=self._mode)
 
         for member in memberlist:
             if hasattr(member, 'members') and member.uuid not in exclude:
@@ -1077,6 +1124,40 @@ class Bundle(CollectionMixin):
         return Bundle([self[name] for name in
                       fnmatch.filter(self.names, pattern)], limbs=self.limbs)
 
+    def query(self, expression):
+        """Return a Bundle of members whose tags and categories match a
+        query.
+
+        The query is parsed once, and each member's state read once, no
+        matter how many conditions it has; only the limbs it uses are read.
+        See :mod:`~datreant.core.queries` for the form of queries, e.g.::
+
+            b.query("temperature > 300 and 'equilibrated' in tags")
+
+        Parameters
+        ----------
+        expression : str or :class:`~datreant.core.queries.Query`
+            Query to match members against.
+
+        Returns
+        -------
+        bundle : Bundle
+            Members matching the query, in order.
+
+        """
+        from .backends import prefetch
+        from .queries import Query
+
+        if not isinstance(expression, Query):
+            expression = Query(expression)
+
+        members = self._list()
+        with prefetch(member._backend for member in members):
+            matches = [member for member in members
+                       if expression.match(member)]
+
+        return Bundle(matches, limbs=self.limbs, mode=self._mode)
+
     def _add_members(self, uuids, treanttypes, abspaths):
         """Add many members at once.
 
@@ -4,7 +4,6 @@ Functions and classes for finding Treants in the filesystem.
 """
 import os
 import sys
-import glob
 import time
 
 import scandir
@@ -12,11 +11,82 @@ import scandir
 from . import backends
 
 
-def statefilename(treanttype, uuid):
+def statefilename(treanttype, uuid, ext='json'):
     """Return state file name given the type of treant and its uuid.
 
+    :Arguments:
+        *treanttype*
+            type of the treant
+        *uuid*
+            uuid of the treant
+
+    :Keywords:
+        *ext*
+            extension of the state file format; if ``None``, the name has no
+            extension, leaving the format to be chosen on creation
+
+    """
+    if ext is None:
+        return "{}.{}".format(treanttype, uuid)
+    return "{}.{}.{}".format(treanttype, uuid, ext)
+
+
+def is_statefile(filename, treanttypes=None):
+    """Check if a file name is that of a Treant state file.
+
+    The name must be of the form ``<treanttype>.<uuid>.<ext>``, with
+    ``<ext>`` the extension of a known state file format.
+
+    :Arguments:
+        *filename*
+            name of, or path to, the file
+
+    :Keywords:
+        *treanttypes*
+            if given, only names with one of these treanttypes match
+
+    :Returns:
+        *match*
+            True if the file name is that of a state file
+
+    """
+    from . import _FORMATS
+
+    name = os.path.basename(filename)
+    if name.startswith('.'):
+        return False
+
+    parts = name.split(os.extsep, 2)
+    if len(parts) != 3 or parts[2] not in _FORMATS:
+        return False
+
+    return treanttypes is None or parts[0] in treanttypes
+
+
+def glob_statefiles(directory, treanttypes=None):
+    """Get all state files in a directory.
+
+    :Arguments:
+        *directory*
+            directory to look in
+
+    :Keywords:
+        *treanttypes*
+            if given, only state files of these treanttypes are returned
+
+    :Returns:
+        *statefiles*
+            list giving absolute paths of state files found in directory;
+            empty if the directory does not exist
+
     """
-    return "{}.{}.{}".format(treanttype, uuid, 'json')
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    return [os.path.abspath(os.path.join(directory, name)) for name in names
+            if is_statefile(name, treanttypes)]
 
 
 def glob_treant(treant):
@@ -36,18 +106,10 @@ def glob_treant(treant):
     """
     from . import _TREANTS
 
-    fileglob = list()
-    for treanttype in _TREANTS:
-        fileglob.extend(
-            glob.glob(os.path.join(
-                treant,
-                '{}.*.{}'.format(treanttype, 'json'))))
-
-    paths = [os.path.abspath(x) for x in fileglob]
-    return paths
+    return glob_statefiles(treant, _TREANTS)
 
 
-def path2treant(*paths):
+def path2treant(*paths, **kwargs):
     """Return Treants from directories or full paths containing Treant
         state files.
 
@@ -60,6 +122,8 @@ def path2treant(*paths):
         List of directories containing state files or full paths to state files
         to load Treants from; if ``None`` is an element, then ``None`` returned
         in output list.
+    mode : {'a', 'r'}
+        mode to open the Treants in; see :class:`~datreant.core.Treant`
 
     Returns
     -------
@@ -69,6 +133,7 @@ def path2treant(*paths):
 
     """
     from . import _TREANTS
+    mode = kwargs.pop('mode', 'a')
     treants = list()
     for path in paths:
         if path is None:
@@ -78,17 +143,17 @@ def path2treant(*paths):
             for item in files:
                 treanttype = os.path.basename(item).split(os.extsep)[0]
                 try:
-                    treants.append(_TREANTS[treanttype](item))
+                    treants.append(_TREANTS[treanttype](item, mode=mode))
                 except KeyError:
                     # default to base Treant
-                    treants.append(_TREANTS['Treant'](item))
+                    treants.append(_TREANTS['Treant'](item, mode=mode))
         elif os.path.exists(path):
             treanttype = os.path.basename(path).split(os.extsep)[0]
             try:
-                treants.append(_TREANTS[treanttype](path))
+                treants.append(_TREANTS[treanttype](path, mode=mode))
             except KeyError:
                 # default to base Treant
-                treants.append(_TREANTS['Treant'](path))
+                treants.append(_TREANTS['Treant'](path, mode=mode))
 
     return treants
 
@@ -156,7 +221,8 @@ class Foxhound(object):
             results = self._find_Bundle_members()
 
         if as_treants:
-            conts = path2treant(*results.values())
+            # members are opened as the collection's own treants are
+            conts = path2treant(*results.values(), mode=self.caller._mode)
             results = {x: y for x, y in zip(results.keys(), conts)}
 
         return results
@@ -177,8 +243,7 @@ class Foxhound(object):
         if 'abspath' in self.paths:
             for path in self.paths['abspath']:
                 found = []
-                candidates = glob.glob(
-                        os.path.join(path, '*.*.json'))
+                candidates = glob_statefiles(path)
 
                 for candidate in candidates:
                     for uuid in uuids:
@@ -194,8 +259,7 @@ class Foxhound(object):
             # get uuids for which paths haven't been found
             for path in self.paths['relpath']:
                 found = []
-                candidates = glob.glob(
-                        os.path.join(path, '*.*.json'))
+                candidates = glob_statefiles(path)
 
                 for candidate in candidates:
                     for uuid in uuids:
@@ -209,6 +273,35 @@ class Foxhound(object):
 
         return outpaths
 
+    def _check_catalog(self, outpaths, path):
+        """Look up Treants not yet found in the nearest catalog.
+
+        A catalog may be out of date, so only state files still where it
+        has them are taken.
+
+        :Arguments:
+            *outpaths*
+                dictionary giving Treant uuids as keys and absolute paths to
+                their state files as values, with ``None`` for those not yet
+                found; updated in place
+            *path*
+                directory to look for a catalog from, at or above it
+
+        """
+        from .catalog import Catalog
+
+        uuids = [uuid for uuid in outpaths if not outpaths[uuid]]
+        if not uuids:
+            return
+
+        catalog = Catalog.find(path)
+        if catalog is None:
+            return
+
+        for uuid, statefile in catalog.locate(uuids).items():
+            if os.path.exists(statefile):
+                outpaths[uuid] = statefile
+
     def _find_TreantFile(self):
         """Find Treant for a TreantFile.
 
@@ -240,8 +333,9 @@ class Foxhound(object):
                 that no state file could be found.
 
         """
-        # search last-known locations
+        # search last-known locations, then the catalog if there is one
         outpaths = self._check_paths()
+        self._check_catalog(outpaths, self.caller._treant.location)
 
         # get current time
         currtime = time.time()
@@ -279,9 +373,7 @@ class Foxhound(object):
 
                 for uuid in uuids:
                     candidate = [os.path.join(root, x) for x in files
-                                 if ((uuid in x) and
-                                     ('.json' in x) and
-                                     (x[0] != '.'))]
+                                 if ((uuid in x) and is_statefile(x))]
 
                     if candidate:
                         outpaths[uuid] = os.path.abspath(candidate[0])
@@ -315,8 +407,9 @@ class Foxhound(object):
                 that no state file could be found.
 
         """
-        # search last-known locations
+        # search last-known locations, then the catalog if there is one
         outpaths = self._check_paths()
+        self._check_catalog(outpaths, os.path.abspath(os.curdir))
 
         # get current time
         currtime = time.time()
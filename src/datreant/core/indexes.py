@@ -0,0 +1,393 @@
+"""
+Indexes over the metadata of a collection's members, for answering queries
+on them without evaluating each member in turn.
+
+An index is built from the members' state with one read of each. Tag
+indexes reflect it as of when they were built; range indexes follow changes
+made to categories in this process.
+
+"""
+import os
+import weakref
+import binascii
+import itertools
+from bisect import bisect_left, bisect_right, insort
+
+from six import string_types, integer_types
+
+from .backends import prefetch
+from .collections import Bundle
+
+# bits of each byte value, lowest first
+_BITS = [tuple(bool(byte >> i & 1) for i in range(8)) for byte in range(256)]
+
+# range indexes kept up to date with changes to categories
+_RANGEINDEXES = weakref.WeakSet()
+
+
+def _tobitmap(positions, size):
+    """Get the bitmap with the bits at `positions` set.
+
+    """
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+
+    if hasattr(int, 'from_bytes'):
+        return int.from_bytes(bytes(data), 'little')
+
+    data.reverse()
+    return int(binascii.hexlify(data) or b'0', 16)
+
+
+def _frombitmap(bitmap, size):
+    """Get the bytes of a bitmap of `size` bits, lowest first.
+
+    """
+    nbytes = (size + 7) // 8
+    if hasattr(bitmap, 'to_bytes'):
+        return bytearray(bitmap.to_bytes(nbytes, 'little'))
+
+    data = bytearray(binascii.unhexlify(
+        '{:x}'.format(bitmap).zfill(2 * nbytes)))
+    data.reverse()
+    return data
+
+
+def _numeric(value):
+    """Check if a category value is a number that can be ordered.
+
+    """
+    return (isinstance(value, integer_types + (float,)) and
+            not isinstance(value, bool) and value == value)
+
+
+def _categorieschanged(uuid, changes):
+    """Update range indexes for changes to the categories of a treant.
+
+    :Arguments:
+        *uuid*
+            uuid of the treant
+        *changes*
+            dict giving the new value of each changed category, or ``None``
+            for those removed
+
+    """
+    for index in list(_RANGEINDEXES):
+        if index.key in changes:
+            index._update(uuid, changes[index.key])
+
+
+class _Index(object):
+    """Core functionality for indexes over the members of a collection.
+
+    """
+    _collection = None
+
+    def __len__(self):
+        return len(self._members)
+
+    def _bundle(self, positions):
+        """Get a Bundle of the members at `positions`.
+
+        """
+        if self._collection is None:
+            return Bundle([self._members[i] for i in positions])
+
+        return Bundle([self._members[i] for i in positions],
+                      limbs=self._collection.limbs,
+                      mode=self._collection._mode)
+
+
+class TagIndex(_Index):
+    """Inverted index of the tags of a collection's members.
+
+    Each tag maps to a bitmap of the positions of the members having it,
+    kept as an integer, so that tag expressions are evaluated with bitwise
+    operations over all members at once.
+
+    Expressions are those taken by
+    :meth:`~datreant.core.limbs.Tags.__getitem__`: a string for a single
+    tag, a list for members with all of the given items, a tuple for
+    members with any of them, and a set for members without all of them;
+    these may be nested.
+
+    :Arguments:
+        *collection*
+            Bundle to index the members of
+
+    """
+    def __init__(self, collection):
+        self._collection = collection
+        self._members = collection._list()
+        with prefetch(member._backend for member in self._members):
+            tags = [member.tags._list() for member in self._members]
+
+        self._size = len(self._members)
+        self._all = (1 << self._size) - 1
+
+        positions = dict()
+        for i, membertags in enumerate(tags):
+            for tag in membertags:
+                positions.setdefault(tag, []).append(i)
+
+        self._bitmaps = dict((tag, _tobitmap(found, self._size))
+                             for tag, found in positions.items())
+
+    def __contains__(self, tag):
+        return tag in self._bitmaps
+
+    def __iter__(self):
+        return iter(self._bitmaps)
+
+    def bitmap(self, value):
+        """Get the bitmap of the members matching a tag expression.
+
+        :Arguments:
+            *value*
+                tag expression
+
+        :Returns:
+            *bitmap*
+                integer with the bit at each matching member's position set
+
+        """
+        if isinstance(value, string_types):
+            return self._bitmaps.get(value, 0)
+        elif isinstance(value, list):
+            bitmap = self._all
+            for item in value:
+                bitmap &= self.bitmap(item)
+            return bitmap
+        elif isinstance(value, tuple):
+            bitmap = 0
+            for item in value:
+                bitmap |= self.bitmap(item)
+            return bitmap
+        elif isinstance(value, set):
+            return self._all & ~self.bitmap(list(value))
+        else:
+            raise TypeError("Tag expression must be a string, list, tuple, "
+                            "or set")
+
+    def __getitem__(self, value):
+        """Get a boolean mask of the members matching a tag expression.
+
+        :Arguments:
+            *value*
+                tag expression
+
+        :Returns:
+            *mask*
+                list giving for each member whether it matches, in order
+
+        """
+        data = _frombitmap(self.bitmap(value), self._size)
+        return list(itertools.chain.from_iterable(
+            _BITS[byte] for byte in data))[:self._size]
+
+    def positions(self, value):
+        """Get the positions of the members matching a tag expression.
+
+        :Arguments:
+            *value*
+                tag expression
+
+        :Returns:
+            *positions*
+                list of the indices of matching members, in order
+
+        """
+        data = _frombitmap(self.bitmap(value), self._size)
+        return [8 * i + j for i, byte in enumerate(data) if byte
+                for j, bit in enumerate(_BITS[byte]) if bit]
+
+    def filter(self, value):
+        """Get the members matching a tag expression.
+
+        :Arguments:
+            *value*
+                tag expression
+
+        :Returns:
+            *bundle*
+                Bundle of the matching members, in order
+
+        """
+        return self._bundle(self.positions(value))
+
+
+class RangeIndex(_Index):
+    """Sorted index of the values of a numeric category among a collection's
+    members.
+
+    Values are kept sorted along with the positions of their members, so
+    that range, equality, and top-k queries are answered by bisection.
+    Members without a value for the category, or with one that isn't a
+    number, are left out.
+
+    Changes made to the categories of members through
+    :class:`~datreant.core.limbs.Categories` in this process are applied to
+    the index for as long as it exists; changes made by other processes
+    are not.
+
+    :Arguments:
+        *collection*
+            Bundle to index the members of
+        *key*
+            category to index the values of
+
+    """
+    def __init__(self, collection, key):
+        members = collection._list()
+        with prefetch(member._backend for member in members):
+            values = [member.categories._dict().get(key)
+                      for member in members]
+
+        self._build(collection, key, members,
+                    [member.uuid for member in members], values)
+
+    @classmethod
+    def from_catalog(cls, catalog, key, **kwargs):
+        """Build an index from a catalog, without reading any state files.
+
+        :Arguments:
+            *catalog*
+                :class:`~datreant.core.catalog.Catalog` to take the
+                treants and their categories from
+            *key*
+                category to index the values of
+
+        :Keywords:
+            Criteria for the treants to index, as taken by
+            :meth:`~datreant.core.catalog.Catalog.query`; all treants in
+            the catalog by default. Members are their state files, in
+            sorted order.
+
+        :Returns:
+            *index*
+                the index
+
+        """
+        members = catalog.query(**kwargs)
+        found = dict((catalog._abspath(path), value) for path, value
+                     in catalog.connection.execute(
+                         "SELECT path, value FROM categories WHERE key = ?",
+                         (key,)))
+
+        index = cls.__new__(cls)
+        index._build(None, key, members,
+                     [os.path.basename(path).split(os.extsep)[1]
+                      for path in members],
+                     [found.get(path) for path in members])
+        return index
+
+    def _build(self, collection, key, members, uuids, values):
+        self.key = key
+        self._collection = collection
+        self._members = members
+        self._positions = dict((uuid, i) for i, uuid in enumerate(uuids))
+
+        # value of each indexed member, and (value, position) pairs, sorted
+        self._values = dict((i, value) for i, value in enumerate(values)
+                            if _numeric(value))
+        self._entries = sorted((value, i) for i, value
+                               in self._values.items())
+
+        _RANGEINDEXES.add(self)
+
+    def _update(self, uuid, value):
+        """Give the member with `uuid` a new value.
+
+        """
+        position = self._positions.get(uuid)
+        if position is None:
+            return
+
+        old = self._values.pop(position, None)
+        if old is not None:
+            del self._entries[bisect_left(self._entries, (old, position))]
+
+        if _numeric(value):
+            self._values[position] = value
+            insort(self._entries, (value, position))
+
+    def _result(self, positions, bundle):
+        return self._bundle(positions) if bundle else positions
+
+    def between(self, low=None, high=None, bundle=False):
+        """Get the members with values within a range, bounds included.
+
+        :Keywords:
+            *low*
+                lowest value; no bound if ``None``
+            *high*
+                highest value; no bound if ``None``
+            *bundle*
+                ``True`` to get a Bundle of the members instead of their
+                positions
+
+        :Returns:
+            *positions*
+                list of the positions of the members, in order; a Bundle of
+                the members if `bundle` is ``True``
+
+        """
+        entries = self._entries
+        start = 0 if low is None else bisect_left(entries, (low,))
+        stop = (len(entries) if high is None
+                else bisect_right(entries, (high, float('inf'))))
+
+        return self._result(sorted(i for _, i in entries[start:stop]),
+                            bundle)
+
+    def equal(self, value, bundle=False):
+        """Get the members with the given value.
+
+        :Arguments:
+            *value*
+                value of the category
+
+        :Keywords:
+            *bundle*
+                ``True`` to get a Bundle of the members instead of their
+                positions
+
+        :Returns:
+            *positions*
+                list of the positions of the members, in order; a Bundle of
+                the members if `bundle` is ``True``
+
+        """
+        return self.between(value, value, bundle=bundle)
+
+    def top(self, k, largest=True, bundle=False):
+        """Get the `k` members with the largest or smallest values.
+
+        :Arguments:
+            *k*
+                number of members to get
+
+        :Keywords:
+            *largest*
+                ``True`` for the members with the largest values, ``False``
+                for those with the smallest
+            *bundle*
+                ``True`` to get a Bundle of the members instead of their
+                positions
+
+        :Returns:
+            *positions*
+                list of the positions of the members, in order of value,
+                largest or smallest first; a Bundle of the members if
+                `bundle` is ``True``
+
+        """
+        if k <= 0:
+            entries = []
+        elif largest:
+            entries = reversed(self._entries[-k:])
+        else:
+            entries = self._entries[:k]
+
+        return self._result([i for _, i in entries], bundle)
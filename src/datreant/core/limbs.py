@@ -11,6 +11,7 @@ from collections import defaultdict
 from fuzzywuzzy import process
 
 from . import filesystem
+from . import indexes
 from .collections import Bundle
 from . import _TREELIMBS, _LIMBS
 
@@ -61,6 +62,41 @@ class Limb(with_metaclass(_Limbmeta, object)):
     def _logger(self):
         return self._treant._logger
 
+    @property
+    def _readonly(self):
+        return self._treant._backend.readonly
+
+    def _init_item(self, default):
+        """Add this limb's item to the state as `default` if it's missing.
+
+        Checking for the item takes only a read; the state is written only
+        if it must be added. Items missing from a Treant opened read-only
+        read as empty instead.
+
+        """
+        if self._readonly:
+            return
+
+        with self._read:
+            if self._name in self._treant._state:
+                return
+
+        try:
+            with self._write:
+                self._treant._state.setdefault(self._name, default)
+        except (IOError, OSError):
+            raise KeyError(
+                "Missing '{}' data, and cannot write to Treant "
+                "'{}'".format(self._name, self._treant.filepath))
+
+    @property
+    def _read(self):
+        return self._treant._backend.read(limb=self._name)
+
+    @property
+    def _write(self):
+        return self._treant._backend.write(limb=self._name)
+
 
 @functools.total_ordering
 class Tags(Limb):
@@ -72,23 +108,7 @@ class Tags(Limb):
     def __init__(self, treant):
         super(Tags, self).__init__(treant)
 
-        # init state if tags not already there;
-        # if read-only, check that they are there,
-        # and raise exception if they are not
-        try:
-            with self._treant._write:
-                try:
-                    self._treant._state['tags']
-                except KeyError:
-                    self._treant._state['tags'] = list()
-        except (IOError, OSError):
-            with self._treant._read:
-                try:
-                    self._treant._state['tags']
-                except KeyError:
-                    raise KeyError(
-                            ("Missing 'tags' data, and cannot write to "
-                             "Treant '{}'".format(self._treant.filepath)))
+        self._init_item(list())
 
     def __repr__(self):
         return "<Tags({})>".format(self._list())
@@ -121,7 +141,7 @@ class Tags(Limb):
             raise TypeError("Can only set with tags, a list, or set")
 
     def __getitem__(self, value):
-        with self._treant._read:
+        with self._read:
             if isinstance(value, list):
                 # a list of tags gives only members with ALL the tags
                 fits = all([self[item] for item in value])
@@ -236,8 +256,9 @@ class Tags(Limb):
             *tags*
                 list of all tags
         """
-        with self._treant._read:
-            tags = self._treant._state['tags']
+        # copied, so the cached state isn't changed from under the caller
+        with self._read:
+            tags = list(self._treant._state.get('tags', []))
 
         tags.sort()
         return tags
@@ -253,6 +274,14 @@ class Tags(Limb):
         tags : str or list
             Tags to add. Must be strings or lists of strings.
 
+        """
+        with self._write:
+            self._update(self._treant._state, tags)
+
+    @staticmethod
+    def _update(state, tags):
+        """Add tags to the treant state `state`, as :meth:`add` does.
+
         """
         outtags = list()
         for tag in tags:
@@ -261,17 +290,16 @@ class Tags(Limb):
             else:
                 outtags.append(tag)
 
-        with self._treant._write:
-            # ensure tags are unique (we don't care about order)
-            # also they must be strings
-            outtags = set([tag for tag in outtags if
-                           isinstance(tag, string_types)])
+        # ensure tags are unique (we don't care about order)
+        # also they must be strings
+        outtags = set([tag for tag in outtags if
+                       isinstance(tag, string_types)])
 
-            # remove tags already present in metadata from list
-            outtags = outtags.difference(set(self._treant._state['tags']))
+        # remove tags already present in metadata from list
+        outtags = outtags.difference(set(state['tags']))
 
-            # add new tags
-            self._treant._state['tags'].extend(outtags)
+        # add new tags
+        state['tags'].extend(outtags)
 
     def remove(self, *tags):
         """Remove tags from Treant.
@@ -283,7 +311,7 @@ class Tags(Limb):
             *tags*
                 Tags to delete.
         """
-        with self._treant._write:
+        with self._write:
             # remove redundant tags from given list if present
             tags = set([str(tag) for tag in tags])
             for tag in tags:
@@ -297,7 +325,7 @@ class Tags(Limb):
         """Remove all tags from Treant.
 
         """
-        with self._treant._write:
+        with self._write:
             self._treant._state['tags'] = list()
 
     def fuzzy(self, tag, threshold=80):
@@ -339,23 +367,7 @@ class Categories(Limb):
     def __init__(self, treant):
         super(Categories, self).__init__(treant)
 
-        # init state if categories not already there;
-        # if read-only, check that they are there,
-        # and raise exception if they are not
-        try:
-            with self._treant._write:
-                try:
-                    self._treant._state['categories']
-                except KeyError:
-                    self._treant._state['categories'] = dict()
-        except (IOError, OSError):
-            with self._treant._read:
-                try:
-                    self._treant._state['categories']
-                except KeyError:
-                    raise KeyError(
-                            ("Missing 'categories' data, and cannot write to "
-                             "Treant '{}'".format(self._treant.filepath)))
+        self._init_item(dict())
 
     def __repr__(self):
         return "<Categories({})>".format(self._dict())
@@ -459,6 +471,22 @@ class Categories(Limb):
     def __len__(self):
         return len(self._dict())
 
+    def aget(self, keys):
+        """Get values for a given key, list of keys, or set of keys,
+        asynchronously.
+
+        Asynchronous counterpart of getting items, to be awaited; the state
+        is read on :mod:`~datreant.core.aio`'s executor.
+
+        Parameters
+        ----------
+        keys : str, list, set
+            Valid key(s) of categories in this Treant.
+
+        """
+        from . import aio
+        return aio.call(self._treant, self.__getitem__, keys)
+
     def _dict(self):
         """Get all categories for the Treant as a dictionary.
 
@@ -467,8 +495,8 @@ class Categories(Limb):
                 dictionary of all categories
 
         """
-        with self._treant._read:
-            return self._treant._state['categories']
+        with self._read:
+            return dict(self._treant._state.get('categories', {}))
 
     def add(self, categorydict=None, **categories):
         """Add any number of categories to the Treant.
@@ -504,16 +532,29 @@ class Categories(Limb):
 
         outcats.update(categories)
 
-        with self._treant._write:
-            for key, value in outcats.items():
-                if not isinstance(key, string_types):
-                    raise TypeError("Keys must be strings.")
+        with self._write:
+            self._update(self._treant._state, outcats)
 
-                if (isinstance(value, (int, float, string_types, bool))):
-                    self._treant._state['categories'][key] = value
-                elif value is not None:
-                    raise TypeError("Values must be ints, floats,"
-                                    " strings, or bools.")
+        indexes._categorieschanged(
+            self._treant.uuid,
+            dict((key, value) for key, value in outcats.items()
+                 if value is not None))
+
+    @staticmethod
+    def _update(state, categories):
+        """Add a dict of categories to the treant state `state`, as
+        :meth:`add` does.
+
+        """
+        for key, value in categories.items():
+            if not isinstance(key, string_types):
+                raise TypeError("Keys must be strings.")
+
+            if (isinstance(value, (int, float, string_types, bool))):
+                state['categories'][key] = value
+            elif value is not None:
+                raise TypeError("Values must be ints, floats,"
+                                " strings, or bools.")
 
     def remove(self, *categories):
         """Remove categories from Treant.
@@ -527,18 +568,24 @@ class Categories(Limb):
                 Categories to delete.
 
         """
-        with self._treant._write:
+        with self._write:
             for key in categories:
                 # continue even if key not already present
                 self._treant._state['categories'].pop(key, None)
 
+        indexes._categorieschanged(self._treant.uuid,
+                                   dict.fromkeys(categories))
+
     def clear(self):
         """Remove all categories from Treant.
 
         """
-        with self._treant._write:
+        with self._write:
+            removed = dict.fromkeys(self._treant._state.get('categories', {}))
             self._treant._state['categories'] = dict()
 
+        indexes._categorieschanged(self._treant.uuid, removed)
+
     def keys(self):
         """Get category keys.
 
@@ -546,8 +593,7 @@ class Categories(Limb):
             *keys*
                 keys present among categories
         """
-        with self._treant._read:
-            return self._treant._state['categories'].keys()
+        return self._dict().keys()
 
     def values(self):
         """Get category values.
@@ -556,8 +602,46 @@ class Categories(Limb):
             *values*
                 values present among categories
         """
-        with self._treant._read:
-            return self._treant._state['categories'].values()
+        return self._dict().values()
+
+
+class _MemberList(object):
+    """Interface of a :class:`~datreant.core.backends.members.MemberTable`
+    for members kept as a list of records.
+
+    """
+    def __init__(self, members):
+        self._members = members
+
+    def __len__(self):
+        return len(self._members)
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def get(self, uuid):
+        memberinfo = None
+        for member in self._members:
+            if member['uuid'] == uuid:
+                memberinfo = dict(member)
+
+        return memberinfo
+
+    def put(self, record):
+        # check if uuid already present
+        uuids = [member['uuid'] for member in self._members]
+
+        if record['uuid'] in uuids:
+            self._members[uuids.index(record['uuid'])] = record
+        else:
+            self._members.append(record)
+
+    def remove(self, uuids):
+        self._members[:] = [member for member in self._members
+                            if member['uuid'] not in uuids]
+
+    def clear(self):
+        del self._members[:]
 
 
 class MemberBundle(Limb, Bundle):
@@ -574,28 +658,17 @@ class MemberBundle(Limb, Bundle):
     def __init__(self, treant):
         super(MemberBundle, self).__init__(treant)
 
-        # init state if members not already there;
-        # if read-only, check that they are there,
-        # and raise exception if they are not
-        try:
-            with self._treant._write:
-                try:
-                    self._treant._state['members']
-                except KeyError:
-                    self._treant._state['members'] = list()
-        except (IOError, OSError):
-            with self._treant._read:
-                try:
-                    self._treant._state['members']
-                except KeyError:
-                    raise KeyError(
-                            ("Missing 'members' data, and cannot write to "
-                             "Treant '{}'".format(self._treant.filepath)))
+        self._init_item(list())
 
         # member Treant cache
         self._cache = dict()
         self._searchtime = 10
 
+    @property
+    def _mode(self):
+        # members are opened as the Group was
+        return self._treant._mode
+
     def __set__(self, obj, val):
         """Setting with a Bundle will make membership match the Bundle.
 
@@ -641,6 +714,20 @@ class MemberBundle(Limb, Bundle):
         else:
             raise TypeError("Can only set with a list or Bundle")
 
+    def _table(self):
+        """Get the member records of the Group, to use within a read or write.
+
+        Backends may keep members in a
+        :class:`~datreant.core.backends.members.MemberTable`; a plain list of
+        records is given the same interface.
+
+        """
+        members = self._treant._state.get('members', [])
+        if isinstance(members, list):
+            return _MemberList(members)
+
+        return members
+
     def _add_members(self, uuids, treanttypes, abspaths):
         """Add many members at once.
 
@@ -656,7 +743,7 @@ class MemberBundle(Limb, Bundle):
                 list of abspaths
 
         """
-        with self._treant._write:
+        with self._write:
             for uuid, treanttype, abspath in zip(uuids, treanttypes, abspaths):
                 self._add_member(uuid, treanttype, abspath)
 
@@ -681,15 +768,8 @@ class MemberBundle(Limb, Bundle):
                       'relpath': os.path.relpath(
                           basedir, self._treant.location)}
 
-        with self._treant._write:
-            # check if uuid already present
-            uuids = [member['uuid'] for member in
-                     self._treant._state['members']]
-
-            if uuid in uuids:
-                self._treant._state['members'][uuids.index(uuid)] = member_rec
-            else:
-                self._treant._state['members'].append(member_rec)
+        with self._write:
+            self._table().put(member_rec)
 
     def _del_members(self, uuids=None, all=False):
         """Remove members from the Group.
@@ -701,28 +781,12 @@ class MemberBundle(Limb, Bundle):
                 When True, remove all members [``False``]
 
         """
-        with self._treant._write:
+        with self._write:
             if all:
-                self._treant._state['members'] = list()
+                self._table().clear()
             elif uuids:
                 # remove redundant uuids from given list if present
-                uuids = set([str(uuid) for uuid in uuids])
-
-                # get matching rows
-                # TODO: possibly faster to use table.where
-                memberlist = list()
-                for i, member in enumerate(self._treant._state['members']):
-                    for uuid in uuids:
-                        if (member['uuid'] == uuid):
-                            memberlist.append(i)
-
-                memberlist.sort()
-                j = 0
-                # delete matching entries; have to use j to shift the register
-                # as we remove entries
-                for i in memberlist:
-                    self._treant._state['members'].pop(i - j)
-                    j = j + 1
+                self._table().remove(set([str(uuid) for uuid in uuids]))
 
     def _get_member(self, uuid):
         """Get all stored information on the specified member.
@@ -739,13 +803,8 @@ class MemberBundle(Limb, Bundle):
                 a dictionary containing all information stored for the
                 specified member
         """
-        memberinfo = None
-        with self._treant._read:
-            for member in self._treant._state['members']:
-                if member['uuid'] == uuid:
-                    memberinfo = member
-
-        return memberinfo
+        with self._read:
+            return self._table().get(uuid)
 
     def _get_members(self):
         """Get full member table.
@@ -760,8 +819,8 @@ class MemberBundle(Limb, Bundle):
         """
         out = defaultdict(list)
 
-        with self._treant._read:
-            for member in self._treant._state['members']:
+        with self._read:
+            for member in self._table():
                 for key in self._fields:
                     out[key].append(member[key])
 
@@ -774,9 +833,8 @@ class MemberBundle(Limb, Bundle):
             *uuids*
                 list giving treanttype of each member, in order
         """
-        with self._treant._read:
-            return [member['uuid'] for member in
-                    self._treant._state['members']]
+        with self._read:
+            return [member['uuid'] for member in self._table()]
 
     def _get_members_treanttype(self):
         """List treanttype for each member.
@@ -785,9 +843,8 @@ class MemberBundle(Limb, Bundle):
             *treanttypes*
                 list giving treanttype of each member, in order
         """
-        with self._treant._read:
-            return [member['treanttype'] for member in
-                    self._treant._state['members']]
+        with self._read:
+            return [member['treanttype'] for member in self._table()]
 
     def _get_members_basedir(self):
         """List basedir for each member.
@@ -797,6 +854,6 @@ class MemberBundle(Limb, Bundle):
                 list of dicts giving all paths to member basedirs, in member
                 order
         """
-        with self._treant._read:
+        with self._read:
             return [member.fromkeys(_memberpaths)
                     for member in self._treant._state['members']]
@@ -4,13 +4,13 @@ User-level functions for manipulating Treants.
 """
 import os
 import scandir
-import fnmatch
 from six.moves import range
 
 from . import _TREANTS
+from . import filesystem
 
 
-def discover(dirpath='.', depth=None, treantdepth=None):
+def discover(dirpath='.', depth=None, treantdepth=None, catalog=False):
     """Find all Treants within given directory, recursively.
 
     Parameters
@@ -24,6 +24,11 @@ def discover(dirpath='.', depth=None, treantdepth=None):
     treantdepth : int
         Maximum depth of Treants to tolerate while traversing in search
         of Treants. ``None`` indicates no Treant depth limit.
+    catalog : bool or Catalog
+        If True, the Treants are looked up in the nearest
+        :class:`~datreant.core.catalog.Catalog` at or above `dirpath`, as of
+        its last refresh, instead of walking the filesystem; the filesystem
+        is walked if there is none. A Catalog may also be given.
 
     Returns
     -------
@@ -33,6 +38,7 @@ def discover(dirpath='.', depth=None, treantdepth=None):
     """
     from .collections import Bundle
     from .trees import Tree
+    from .catalog import Catalog
 
     if isinstance(dirpath, Tree):
         if not dirpath.exists:
@@ -40,21 +46,26 @@ def discover(dirpath='.', depth=None, treantdepth=None):
 
         dirpath = dirpath.abspath
 
+    if catalog is True:
+        catalog = Catalog.find(dirpath)
+
+    if catalog:
+        return Bundle(_catalogued(catalog, dirpath, depth, treantdepth))
+
     found = list()
 
     startdepth = len(dirpath.split(os.sep))
     treantdirs = set()
 
     for root, dirs, files in scandir.walk(dirpath):
-        for treanttype in _TREANTS:
-            outnames = fnmatch.filter(files,
-                                      "{}.*.json".format(treanttype))
+        outnames = [name for name in files
+                    if filesystem.is_statefile(name, _TREANTS)]
 
-            if treantdepth is not None and outnames:
-                treantdirs.add(root)
+        if treantdepth is not None and outnames:
+            treantdirs.add(root)
 
-            paths = [os.path.join(root, file) for file in outnames]
-            found.extend(paths)
+        paths = [os.path.join(root, file) for file in outnames]
+        found.extend(paths)
 
         # depth check; if too deep, empty dirs to avoid downward traversal
         if depth is not None and len(root.split(os.sep)) - startdepth >= depth:
@@ -78,3 +89,44 @@ def discover(dirpath='.', depth=None, treantdepth=None):
                 continue
 
     return Bundle(found)
+
+
+def _catalogued(catalog, dirpath, depth=None, treantdepth=None):
+    """Get the state files below `dirpath` from a catalog, within the
+    limits on depth :func:`discover` takes.
+
+    """
+    dirpath = os.path.abspath(dirpath)
+    statefiles = catalog.query(under=dirpath)
+    if depth is None and treantdepth is None:
+        return statefiles
+
+    treantdirs = set(os.path.dirname(path) for path in statefiles)
+
+    found = list()
+    for path in statefiles:
+        parts = os.path.relpath(os.path.dirname(path),
+                                dirpath).split(os.sep)
+        if parts == [os.curdir]:
+            parts = []
+
+        # directories we'd have to descend from to get here
+        above = [os.path.join(dirpath, *parts[:i])
+                 for i in range(len(parts))]
+
+        if depth is not None and len(parts) > depth:
+            continue
+
+        if treantdepth is not None:
+            # we'd stop descending below as many Treants as are allowed
+            crossed = 0
+            for directory in above:
+                crossed += directory in treantdirs
+                if crossed > treantdepth:
+                    break
+            else:
+                found.append(path)
+        else:
+            found.append(path)
+
+    return found
@@ -0,0 +1,178 @@
+"""
+Queries on the tags and categories of treants, written as Python
+expressions, for filtering collections with a single read of each member.
+
+A query is parsed once into a tree of predicates; nothing in it is
+evaluated by Python itself. Names stand for the values of categories, and
+``tags`` for the set of a treant's tags::
+
+    temperature > 300 and 'equilibrated' in tags and solvent == 'water'
+
+Categories whose keys aren't valid names are given as
+``categories['favorite ice cream']``. Literals are strings, numbers,
+booleans, ``None``, and lists, tuples, or sets of these. Comparisons may be
+chained, and combined with ``and``, ``or``, and ``not``. A category a
+treant doesn't have has the value ``None``, and comparisons of values that
+can't be ordered are false.
+
+"""
+import ast
+import operator
+
+from six import string_types
+
+_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+
+class Query(object):
+    """Query on the tags and categories of treants.
+
+    :Arguments:
+        *expression*
+            query, as a Python expression
+
+    :Raises:
+        *ValueError*
+            if the expression is not a valid query
+
+    """
+    def __init__(self, expression):
+        if not isinstance(expression, string_types):
+            raise TypeError("Query must be a string")
+
+        self.expression = expression
+
+        # limbs the query needs to read
+        self.limbs = set()
+
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError("Invalid query '{}': {}".format(expression, e))
+
+        self._test = self._predicate(tree.body)
+
+    def __repr__(self):
+        return "<Query({!r})>".format(self.expression)
+
+    def _unsupported(self, node):
+        return ValueError("Unsupported expression in query '{}': {}".format(
+            self.expression, type(node).__name__))
+
+    def _predicate(self, node):
+        """Compile a node into a function of tags and categories giving
+        whether a treant matches.
+
+        """
+        if isinstance(node, ast.BoolOp):
+            tests = [self._predicate(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return lambda tags, cats: all(test(tags, cats)
+                                              for test in tests)
+            return lambda tags, cats: any(test(tags, cats) for test in tests)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            test = self._predicate(node.operand)
+            return lambda tags, cats: not test(tags, cats)
+        elif isinstance(node, ast.Compare):
+            return self._comparison(node)
+
+        # a lone value counts as true or false
+        value = self._operand(node)
+        return lambda tags, cats: bool(value(tags, cats))
+
+    def _comparison(self, node):
+        """Compile a comparison, possibly chained.
+
+        """
+        operands = [self._operand(node.left)]
+        operands.extend(self._operand(item) for item in node.comparators)
+
+        ops = []
+        for op in node.ops:
+            try:
+                ops.append(_COMPARISONS[type(op)])
+            except KeyError:
+                raise self._unsupported(op)
+
+        def compare(tags, cats):
+            left = operands[0](tags, cats)
+            for op, operand in zip(ops, operands[1:]):
+                right = operand(tags, cats)
+                try:
+                    if not op(left, right):
+                        return False
+                except TypeError:
+                    # such as ordering a string against a number, or None
+                    return False
+                left = right
+            return True
+
+        return compare
+
+    def _operand(self, node):
+        """Compile a node into a function of tags and categories giving its
+        value.
+
+        """
+        if isinstance(node, ast.Name) and node.id not in ('True', 'False',
+                                                           'None'):
+            if node.id == 'tags':
+                self.limbs.add('tags')
+                return lambda tags, cats: tags
+
+            self.limbs.add('categories')
+            key = node.id
+            return lambda tags, cats: cats.get(key)
+        elif (isinstance(node, ast.Subscript) and
+                isinstance(node.value, ast.Name) and
+                node.value.id == 'categories'):
+            # the index is wrapped in a node of its own before Python 3.9
+            index = node.slice
+            if type(index).__name__ == 'Index':
+                index = index.value
+
+            key = self._literal(index)
+            if not isinstance(key, string_types):
+                raise ValueError("Category keys in query '{}' must be "
+                                 "strings".format(self.expression))
+
+            self.limbs.add('categories')
+            return lambda tags, cats: cats.get(key)
+
+        value = self._literal(node)
+        return lambda tags, cats: value
+
+    def _literal(self, node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            raise self._unsupported(node)
+
+    def match(self, treant):
+        """Check if a treant matches the query.
+
+        Only the limbs the query needs are read.
+
+        :Arguments:
+            *treant*
+                treant to check
+
+        :Returns:
+            *match*
+                ``True`` if the treant matches
+
+        """
+        tags = set(treant.tags._list()) if 'tags' in self.limbs else None
+        categories = (treant.categories._dict()
+                      if 'categories' in self.limbs else None)
+
+        return self._test(tags, categories)
@@ -9,6 +9,7 @@ datreant.tests --- unit tests for datreant
 
 """
 # Bring some often used objects into the current namespace
+from . import test_backends
 from . import test_collections
 from . import test_filesystem
 from . import test_locks
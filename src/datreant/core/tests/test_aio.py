@@ -0,0 +1,136 @@
+"""Tests for asynchronous access to treants.
+
+"""
+
+import asyncio
+import multiprocessing as mp
+
+import pytest
+
+import datreant.core as dtr
+from datreant.core.tests.test_locks import holdlock
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestTreant:
+    """Test asynchronous operations on Treants"""
+
+    @pytest.fixture
+    def treant(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', tags=['lark'],
+                           categories={'bark': 'smooth', 'height': 23.4})
+        return t
+
+    def test_aread(self, treant):
+        assert run(treant.aread()) == treant.state
+
+    def test_aget(self, treant):
+        assert run(treant.categories.aget('bark')) == 'smooth'
+        assert run(treant.categories.aget(['bark', 'height'])) == \
+            ['smooth', 23.4]
+
+        with pytest.raises(KeyError):
+            run(treant.categories.aget('roots'))
+
+    def test_asession(self, treant, monkeypatch):
+        pushes = []
+        push = treant._backend._push_state
+
+        def counting():
+            pushes.append(None)
+            push()
+
+        monkeypatch.setattr(treant._backend, '_push_state', counting)
+
+        order = []
+
+        async def writer():
+            async with treant.asession('w') as t:
+                assert t is treant
+                for i in range(10):
+                    treant.categories['key_{}'.format(i)] = i
+                assert (await treant.aread())['categories']['key_9'] == 9
+                await asyncio.sleep(0.05)
+                order.append('writer')
+
+        async def reader():
+            await asyncio.sleep(0.01)
+            state = await treant.aread()
+            order.append('reader')
+            return state
+
+        async def both():
+            return await asyncio.gather(writer(), reader())
+
+        _, state = run(both())
+
+        # the reader waited for the session to end
+        assert order == ['writer', 'reader']
+        assert state['categories']['key_9'] == 9
+        assert len(pushes) == 1
+
+    def test_not_blocking(self, treant):
+        held = mp.Event()
+        release = mp.Event()
+        p = mp.Process(target=holdlock, args=(treant.filepath, held, release))
+        p.start()
+        held.wait()
+
+        ticks = []
+
+        async def ticker():
+            for i in range(10):
+                ticks.append(i)
+                await asyncio.sleep(0.01)
+            release.set()
+
+        async def both():
+            return await asyncio.gather(treant.aread(), ticker())
+
+        try:
+            state, _ = run(both())
+        finally:
+            release.set()
+            p.join()
+
+        assert len(ticks) == 10
+        assert state['tags'] == ['lark']
+
+
+class TestBundle:
+    """Test asynchronous operations on Bundles"""
+
+    @pytest.fixture
+    def bundle(self, tmpdir):
+        with tmpdir.as_cwd():
+            b = dtr.Bundle(*[dtr.Treant('sprout{}'.format(i),
+                                        categories={'height': i})
+                             for i in range(20)])
+        b[3].categories['bark'] = 'smooth'
+        return b
+
+    def test_aiter(self, bundle):
+        async def members():
+            return [member async for member in bundle.aiter()]
+
+        assert run(members()) == list(bundle)
+
+    def test_aget(self, bundle):
+        assert run(bundle.categories.aget('height')) == list(range(20))
+        assert run(bundle.categories.aget('bark')) == \
+            [None] * 3 + ['smooth'] + [None] * 16
+        assert run(bundle.categories.aget({'height', 'bark'})) == \
+            bundle.categories[{'height', 'bark'}]
+        assert run(bundle.categories.aget(['bark'])) == \
+            bundle.categories[['bark']]
+
+        with pytest.raises(TypeError):
+            bundle.categories.aget(dict())
@@ -0,0 +1,964 @@
+"""Tests for state file backends.
+
+"""
+
+import os
+import time
+import errno
+import uuid
+import pickle
+import multiprocessing as mp
+import pytest
+
+import datreant.core as dtr
+from datreant.core.backends import LockTimeoutError, daemon
+from datreant.core.backends.statefiles import fileclass
+from datreant.core.tests.test_locks import pokefile, dielocked, trylock
+
+
+class TestTreantFile:
+    """Test low-level state file behavior"""
+
+    @pytest.fixture
+    def treant(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        return t
+
+    @pytest.fixture
+    def loads(self, treant, monkeypatch):
+        """Count the number of times the state file is deserialized."""
+        calls = []
+        deserialize = treant._backend._deserialize
+
+        def counting(handle):
+            calls.append(handle)
+            return deserialize(handle)
+
+        monkeypatch.setattr(treant._backend, '_deserialize', counting)
+        return calls
+
+    def test_unchanged_not_reparsed(self, treant, loads):
+        treant.categories['bark'] = 'smooth'
+        treant.tags.add('lark')
+        del loads[:]
+
+        for i in range(10):
+            assert treant.categories['bark'] == 'smooth'
+            assert 'lark' in treant.tags
+            list(treant.categories.keys())
+
+        assert len(loads) == 0
+
+    def test_external_change_reparsed(self, treant, loads):
+        treant.tags.add('lark')
+        assert 'lark' in treant.tags
+
+        # another instance, as if another process, modifies the file
+        other = dtr.Treant(treant.filepath)
+        other.tags.add('bark')
+
+        del loads[:]
+        assert 'bark' in treant.tags
+        assert len(loads) == 1
+
+    def test_failed_write_discarded(self, treant):
+        treant.tags.add('lark')
+
+        with pytest.raises(ValueError):
+            with treant._write:
+                treant._state['tags'].append('bark')
+                raise ValueError
+
+        assert 'bark' not in treant.tags
+        assert 'lark' in treant.tags
+
+    def test_state_is_copy(self, treant):
+        treant.tags.add('lark')
+        state = treant.state
+        state['tags'].append('bark')
+
+        assert 'bark' not in treant.tags
+
+    def test_unpickle_no_probing(self, treant, monkeypatch):
+        treant.tags.add('lark')
+        data = pickle.dumps(treant)
+
+        def probe(*args):
+            raise AssertionError("filesystem probed")
+
+        monkeypatch.setattr(dtr.treants.filesystem, 'glob_treant', probe)
+        monkeypatch.setattr(dtr.treants.os.path, 'isdir', probe)
+
+        t = pickle.loads(data)
+        assert t.filepath == treant.filepath
+        assert t.uuid == treant.uuid
+        assert 'lark' in t.tags
+
+    def test_unpickle_snapshot(self, treant, monkeypatch):
+        treant.tags.add('lark')
+        treant._picklestate = True
+        data = pickle.dumps(treant)
+
+        loads = []
+        deserialize = dtr.backends.core.JSONFile._deserialize
+
+        def counting(self, handle):
+            loads.append(handle)
+            return deserialize(self, handle)
+
+        monkeypatch.setattr(dtr.backends.core.JSONFile, '_deserialize',
+                            counting)
+
+        t = pickle.loads(data)
+        assert 'lark' in t.tags
+        assert len(loads) == 0
+
+        # a snapshot no longer matching the file is dropped
+        treant.tags.add('bark')
+        t = pickle.loads(data)
+        assert t.tags == {'lark', 'bark'}
+        assert len(loads) == 1
+
+
+class TestFormats:
+    """Test state file formats"""
+
+    @pytest.fixture(params=['json', 'json.gz', 'json.xz', 'marshal',
+                            'msgpack'])
+    def fmt(self, request):
+        if request.param == 'msgpack':
+            pytest.importorskip('msgpack')
+        elif request.param == 'json.xz':
+            pytest.importorskip('lzma')
+        return request.param
+
+    @pytest.fixture
+    def treant(self, tmpdir, fmt):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', fmt=fmt)
+        return t
+
+    def test_roundtrip(self, treant, fmt):
+        assert treant.filepath.endswith('.' + fmt)
+
+        treant.tags.add('lark', 'bark')
+        treant.categories.add(bark='smooth', height=23.4, leaves=True)
+
+        t = dtr.Treant(treant.filepath)
+        assert t.tags == {'lark', 'bark'}
+        assert t.categories == {'bark': 'smooth', 'height': 23.4,
+                                'leaves': True}
+
+    def test_regen_from_dir(self, treant, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+
+        assert t.uuid == treant.uuid
+        assert t.filepath == treant.filepath
+
+    def test_discover(self, treant, tmpdir, fmt):
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest', fmt=fmt)
+            g.members.add(treant)
+
+        b = dtr.discover(tmpdir.strpath)
+        assert len(b) == 2
+        assert treant in b
+        assert g in b
+
+        # members found through the Group's state file
+        g = dtr.Group(g.filepath)
+        assert g.members[0] == treant
+
+    def test_move(self, treant, tmpdir, fmt):
+        treant.tags.add('lark')
+
+        with tmpdir.as_cwd():
+            treant.location = 'elsewhere'
+            treant.name = 'sapling'
+
+        assert treant.filepath.endswith('.' + fmt)
+        assert os.path.exists(treant.filepath)
+        assert 'lark' in treant.tags
+
+    def test_unknown_format(self, tmpdir):
+        with tmpdir.as_cwd():
+            with pytest.raises(ValueError):
+                dtr.Treant('sprout', fmt='bark')
+
+            # nothing left behind
+            assert not os.path.exists('sprout')
+
+
+class TestCreate:
+    """Test creation of new state files in a single write"""
+
+    @pytest.fixture(params=['json', 'json.gz', 'marshal', 'journal',
+                            'shards', 'table', 'store'])
+    def fmt(self, request, tmpdir):
+        if request.param == 'store':
+            dtr.backends.RootStore.create(str(tmpdir))
+        return request.param
+
+    @pytest.fixture
+    def exclusive(self, monkeypatch):
+        """Record every exclusive lock taken"""
+        locks = []
+        apply = dtr.backends.core.File._apply_exclusive_lock
+
+        def recording(self, *args, **kwargs):
+            locks.append(self.filename)
+            return apply(self, *args, **kwargs)
+
+        monkeypatch.setattr(dtr.backends.core.File, '_apply_exclusive_lock',
+                            recording)
+        return locks
+
+    def test_single_write(self, tmpdir, fmt, exclusive):
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest', tags=['lark', 'bark'],
+                          categories={'height': 23.4}, fmt=fmt)
+
+        assert g.tags == {'lark', 'bark'}
+        assert g.categories['height'] == 23.4
+        assert len(g.members) == 0
+
+        # the store is written in a single transaction; files with none
+        if fmt == 'store':
+            assert exclusive == [g.filepath]
+        else:
+            assert exclusive == []
+
+        # no buffers left behind
+        assert not [name for name in os.listdir(g.abspath)
+                    if 'buffer' in name]
+
+        assert dtr.Group(g.filepath).state == g.state
+
+    def test_exists(self, tmpdir, fmt):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', tags=['lark'], fmt=fmt)
+
+        backend = fileclass(t.filepath)[1](t.filepath)
+        with pytest.raises(OSError) as excinfo:
+            backend.create({'tags': ['bark'], 'categories': {}})
+        assert excinfo.value.errno == errno.EEXIST
+
+        assert t.tags == {'lark'}
+
+    def test_invalid(self, tmpdir, fmt):
+        with tmpdir.as_cwd():
+            with pytest.raises(TypeError):
+                dtr.Treant('sprout', categories={'bark': [1]}, fmt=fmt)
+
+            # nothing left behind
+            assert not os.path.exists('sprout')
+
+
+class TestCompressed:
+    """Test compressed state files"""
+
+    @pytest.mark.parametrize('fmt, magic', [('json.gz', b'\x1f\x8b'),
+                                            ('json.xz', b'\xfd7zXZ')])
+    def test_compressed(self, tmpdir, fmt, magic):
+        if fmt == 'json.xz':
+            pytest.importorskip('lzma')
+
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest', fmt=fmt)
+            members = [dtr.Treant('sprout{}'.format(i)) for i in range(100)]
+        g.members.add(*members)
+
+        with open(g.filepath, 'rb') as f:
+            assert f.read(len(magic)) == magic
+
+        assert dtr.Group(g.filepath).members.names == [
+            m.name for m in members]
+
+class TestLockFree:
+    """Test reading state files without locks"""
+
+    @pytest.fixture
+    def treant(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+
+        t._backend.lockfree = True
+        return t
+
+    def test_read_without_lock(self, treant, monkeypatch):
+        treant.tags.add('lark')
+
+        def nolock():
+            raise AssertionError("shared lock taken")
+
+        monkeypatch.setattr(treant._backend, '_apply_shared_lock', nolock)
+
+        assert 'lark' in treant.tags
+
+        # writes are still seen
+        other = dtr.Treant(treant.filepath)
+        other.tags.add('bark')
+
+        assert 'bark' in treant.tags
+        assert treant.tags == {'lark', 'bark'}
+
+    def test_class_default(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(dtr.backends.FileSerial, 'lockfree', True)
+
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+
+        assert t._backend.lockfree
+
+        f = dtr.backends.statefiles.treantfile(t.filepath, lockfree=False)
+        assert not f.lockfree
+
+
+class TestJournal:
+    """Test journaled state files"""
+
+    @pytest.fixture
+    def treant(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', fmt='journal')
+        return t
+
+    @pytest.fixture
+    def group(self, tmpdir):
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest', fmt='journal')
+        return g
+
+    def test_writes_append(self, treant):
+        snapshot = os.stat(treant.filepath)
+        journal = treant._backend._journal
+
+        treant.categories['counter'] = 0
+        for i in range(1, 20):
+            size = os.path.getsize(journal)
+            treant.categories['counter'] = i
+            assert os.path.getsize(journal) > size
+
+        treant.tags.add('lark', 'bark')
+        treant.tags.remove('lark')
+
+        # snapshot is untouched
+        assert os.stat(treant.filepath).st_ino == snapshot.st_ino
+
+        t = dtr.Treant(treant.filepath)
+        assert t.categories['counter'] == 19
+        assert t.tags == {'bark'}
+
+    def test_replay_incremental(self, treant):
+        other = dtr.Treant(treant.filepath)
+        assert len(other.categories) == 0
+
+        treant.categories.add(bark='smooth', counter=1)
+        assert other.categories == {'bark': 'smooth', 'counter': 1}
+
+        treant.categories.remove('bark')
+        treant.categories['counter'] = 2
+        assert other.categories == {'counter': 2}
+
+        other.tags.add('lark')
+        assert 'lark' in treant.tags
+
+    def test_compaction(self, treant, monkeypatch):
+        monkeypatch.setattr(treant._backend, 'journalrecords', 5)
+        journal = treant._backend._journal
+        other = dtr.Treant(treant.filepath)
+        assert len(other.categories) == 0
+
+        for i in range(20):
+            treant.categories['key_{}'.format(i)] = i
+
+        # journal was started over at least once
+        with open(journal) as f:
+            assert len(f.readlines()) <= 6
+
+        assert len(other.categories) == 20
+        assert dtr.Treant(treant.filepath).categories['key_19'] == 19
+
+        treant._backend.compact()
+        assert os.path.getsize(journal) == 0
+        assert len(dtr.Treant(treant.filepath).categories) == 20
+
+    def test_replay_idempotent(self, treant):
+        treant.tags.add('lark')
+        treant.categories['bark'] = 'smooth'
+
+        with open(treant._backend._journal) as f:
+            records = f.read()
+
+        # as if compaction didn't get to start a new journal
+        treant._backend.compact()
+        with open(treant._backend._journal, 'w') as f:
+            f.write(records)
+
+        t = dtr.Treant(treant.filepath)
+        assert t.tags == ['lark']
+        assert t.categories == {'bark': 'smooth'}
+
+    def test_untouched_not_copied(self, group, tmpdir, monkeypatch):
+        with tmpdir.as_cwd():
+            group.members.add(*[dtr.Treant('sprout{}'.format(i))
+                                for i in range(5)])
+
+        copied = []
+        deepcopy = dtr.backends.journal.copy.deepcopy
+
+        def counting(value, *args):
+            copied.append(type(value))
+            return deepcopy(value, *args)
+
+        monkeypatch.setattr(dtr.backends.journal.copy, 'deepcopy', counting)
+        group.tags.add('lark')
+
+        # only tags were copied to find the change, not the whole state
+        assert copied == [list]
+        assert dtr.Group(group.filepath).tags == {'lark'}
+
+    def test_delete(self, treant):
+        treant.tags.add('lark')
+        journal = treant._backend._journal
+        assert os.path.exists(journal)
+
+        treant._backend.delete()
+        assert not os.path.exists(journal)
+        assert not os.path.exists(treant.filepath)
+
+    def test_members(self, group, tmpdir):
+        with tmpdir.as_cwd():
+            t1 = dtr.Treant('lark')
+            t2 = dtr.Treant('bark')
+
+            group.members.add(t1, t2)
+            g = dtr.Group(group.filepath)
+            assert g.members.uuids == [t1.uuid, t2.uuid]
+
+            group.members.remove(t1)
+            assert g.members.uuids == [t2.uuid]
+
+            # moved member's record is updated in place
+            t2.location = 'elsewhere'
+            group.members._cache.clear()
+            assert group.members[0] == t2
+            assert g.members.abspaths == [t2.abspath]
+
+
+class TestDurability:
+    """Test syncing of state writes to disk"""
+
+    @pytest.fixture
+    def fsyncs(self, monkeypatch):
+        synced = []
+
+        def fsync(fd):
+            synced.append(os.readlink('/proc/self/fd/{}'.format(fd)))
+
+        monkeypatch.setattr(os, 'fsync', fsync)
+        return synced
+
+    @pytest.fixture
+    def bundle(self, tmpdir):
+        with tmpdir.as_cwd():
+            b = dtr.Bundle(*[dtr.Treant('sprout{}'.format(i))
+                             for i in range(3)])
+        return b
+
+    def test_fast(self, tmpdir, fsyncs):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        t.tags.add('lark')
+
+        assert fsyncs == []
+
+    @pytest.mark.parametrize('durability', ('safe', 'group'))
+    def test_safe(self, tmpdir, fsyncs, durability):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        t._backend.durability = durability
+        t.tags.add('lark')
+
+        # file synced before it is renamed over the old one, directory after
+        assert len(fsyncs) == 2
+        assert fsyncs[0].endswith('.buffer')
+        assert fsyncs[1] == t.abspath.rstrip(os.sep)
+
+    def test_group(self, bundle, fsyncs, monkeypatch):
+        for member in bundle:
+            member._backend.durability = 'group'
+
+        done = []
+        add = dtr.limbs.Tags.add
+
+        def tagadd(self, *tags):
+            add(self, *tags)
+            done.append(len(fsyncs))
+
+        monkeypatch.setattr(dtr.limbs.Tags, 'add', tagadd)
+
+        bundle.tags.add('lark')
+
+        # each file synced before it replaces the old one, but directories
+        # not until the whole bundle was written; then each once
+        assert done == [1, 2, 3]
+        assert all(path.endswith('.buffer') for path in fsyncs[:3])
+        assert sorted(fsyncs[3:]) == sorted(
+            [m.abspath.rstrip(os.sep) for m in bundle])
+
+    def test_group_nested(self, bundle, fsyncs):
+        for member in bundle:
+            member._backend.durability = 'group'
+
+        with dtr.backends.syncgroup():
+            bundle.tags.add('lark')
+            bundle.categories['bark'] = 1
+            assert len(fsyncs) == 6
+
+        assert len(fsyncs) == 9
+
+    def test_journal(self, tmpdir, fsyncs):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', fmt='journal')
+        t._backend.durability = 'safe'
+        t.tags.add('lark')
+
+        assert fsyncs == [t._backend._journal]
+
+    def test_unknown(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+
+        with pytest.raises(ValueError):
+            dtr.backends.statefiles.treantfile(t.filepath, durability='slow')
+
+
+class TestDescriptorPool:
+    """Test keeping lock descriptors open between operations"""
+
+    @pytest.fixture
+    def pool(self, monkeypatch):
+        pool = dtr.backends.DescriptorPool(2)
+        monkeypatch.setattr(dtr.backends.File, 'fdpool', pool)
+        yield pool
+        pool.clear()
+
+    @pytest.fixture
+    def opens(self, monkeypatch):
+        opened = []
+        osopen = os.open
+
+        def counting(path, *args, **kwargs):
+            opened.append(path)
+            return osopen(path, *args, **kwargs)
+
+        monkeypatch.setattr(os, 'open', counting)
+        return opened
+
+    def test_reuse(self, tmpdir, pool, opens):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        t.tags.add('lark')
+        assert 'lark' in t.tags
+
+        # descriptors for reading and writing are kept from here on
+        del opens[:]
+        for i in range(10):
+            t.tags.add('bark{}'.format(i))
+            assert 'lark' in t.tags
+
+        assert opens.count(t._backend.proxy) == 0
+
+        # one descriptor serves both reads and writes
+        assert len(pool) == 1
+
+    def test_bounded(self, tmpdir, pool):
+        with tmpdir.as_cwd():
+            b = dtr.Bundle(*[dtr.Treant('sprout{}'.format(i))
+                             for i in range(5)])
+
+        b.tags.add('lark')
+        assert 'lark' in b.tags
+        assert len(pool) <= 2
+
+    def test_in_use_kept(self, tmpdir, pool):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+            others = [dtr.Treant('sprout{}'.format(i)) for i in range(5)]
+
+        with t.session('w'):
+            fd = t._backend.fd.fd
+            for other in others:
+                other.tags.add('lark')
+
+            # descriptor holding the lock was not closed under us
+            os.fstat(fd)
+            assert t._backend.fd.fd == fd
+
+    def test_delete(self, tmpdir, pool):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        t.tags.add('lark')
+
+        t._backend.delete()
+        assert len(pool) == 0
+
+
+class TestRootStore:
+    """Test state kept in a root-level SQLite store"""
+
+    @pytest.fixture
+    def store(self, tmpdir):
+        return dtr.backends.RootStore.create(str(tmpdir))
+
+    @pytest.fixture
+    def treant(self, tmpdir, store):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        return t
+
+    def test_chosen(self, treant, tmpdir):
+        assert treant.filepath.endswith('.store')
+        assert os.path.getsize(treant.filepath) == 0
+        assert not os.path.exists(treant._backend.proxy)
+
+        # no store, no change
+        with tmpdir.dirpath().mkdir('elsewhere').as_cwd():
+            t = dtr.Treant('sprout')
+        assert t.filepath.endswith('.json')
+
+    def test_roundtrip(self, treant, tmpdir):
+        treant.tags.add('lark', 'bark')
+        treant.categories.add(bark='smooth', height=23.4)
+
+        t = dtr.Treant(treant.abspath)
+        assert t.tags == {'lark', 'bark'}
+        assert t.categories == {'bark': 'smooth', 'height': 23.4}
+
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest')
+        g.members.add(treant)
+
+        assert dtr.Group(g.filepath).members[0] == treant
+        assert set(dtr.discover(str(tmpdir))) == {treant, g}
+
+    def test_states(self, tmpdir, store):
+        with tmpdir.as_cwd():
+            b = dtr.Bundle(*[dtr.Treant('sprout{}'.format(i),
+                                        tags=['lark{}'.format(i)])
+                             for i in range(3)])
+
+        states = store.states()
+        assert set(states) == set(b.uuids)
+        for member in b:
+            assert states[member.uuid]['tags'] == list(member.tags)
+
+        assert list(store.states(b.uuids[:1])) == b.uuids[:1]
+
+    def test_bundle_one_query(self, tmpdir, store):
+        with tmpdir.as_cwd():
+            b = dtr.Bundle(*[dtr.Treant('sprout{}'.format(i),
+                                        tags=['lark'],
+                                        categories={'height': i})
+                             for i in range(5)])
+
+        queries = []
+        store.connection.set_trace_callback(queries.append)
+
+        # fresh instances, with nothing cached
+        b = dtr.Bundle(*[m.abspath for m in b])
+        del queries[:]
+        assert b.tags.all == {'lark'}
+        assert b.categories['height'] == list(range(5))
+
+        # one query for all members; the second read finds them current
+        selects = [q for q in queries if q.startswith('SELECT')]
+        assert len(selects) == 1
+
+    def test_move(self, treant, tmpdir):
+        treant.tags.add('lark')
+
+        with pytest.raises(ValueError):
+            treant.location = tmpdir.dirpath().join('elsewhere').strpath
+        assert os.path.exists(treant.filepath)
+
+        treant.location = tmpdir.join('forest').strpath
+        assert dtr.Treant(treant.abspath).tags == {'lark'}
+
+    def test_failed_write(self, treant):
+        treant.tags.add('lark')
+
+        with pytest.raises(ValueError):
+            with treant.session('w'):
+                treant.tags.add('bark')
+                raise ValueError
+
+        assert dtr.Treant(treant.abspath).tags == {'lark'}
+        assert treant.tags == {'lark'}
+
+    def test_nested(self, treant, tmpdir):
+        with tmpdir.as_cwd():
+            other = dtr.Treant('sapling')
+
+        # both share the store's transaction
+        with treant.session('w'):
+            treant.tags.add('lark')
+            other.tags.add('bark')
+            assert other.tags == {'bark'}
+
+        with treant.session('r'):
+            with pytest.raises(IOError):
+                other.tags.add('lark')
+
+        assert treant.tags == {'lark'}
+        assert other.tags == {'bark'}
+
+    def test_delete(self, treant, store):
+        treant.tags.add('lark')
+        treant._backend.delete()
+
+        assert not os.path.exists(treant.filepath)
+        assert store.states() == {}
+
+
+class TestSharded:
+    """Test state files sharded by limb"""
+
+    @pytest.fixture
+    def group(self, tmpdir):
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest', fmt='shards')
+        return g
+
+    def shard(self, treant, key):
+        return treant._backend._shard(key).filename
+
+    def test_roundtrip(self, group, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout')
+        group.members.add(t)
+        group.tags.add('lark', 'bark')
+        group.categories.add(bark='smooth', height=23.4)
+
+        assert os.path.getsize(group.filepath) == 0
+
+        g = dtr.Group(group.filepath)
+        assert g.members[0] == t
+        assert g.tags == {'lark', 'bark'}
+        assert g.categories == {'bark': 'smooth', 'height': 23.4}
+        assert set(g.state) == {'members', 'tags', 'categories'}
+
+    def test_limb_writes(self, group, tmpdir):
+        with tmpdir.as_cwd():
+            group.members.add(dtr.Treant('sprout'))
+        members = os.stat(self.shard(group, 'members'))
+
+        # only the tags shard is rewritten
+        tags = os.stat(self.shard(group, 'tags'))
+        group.tags.add('lark')
+        assert os.stat(self.shard(group, 'tags')).st_ino != tags.st_ino
+        assert os.stat(self.shard(group, 'members')).st_ino == \
+            members.st_ino
+
+        # and only it is read
+        g = dtr.Group(group.filepath)
+        assert 'lark' in g.tags
+        assert list(g._backend._shards) == ['tags']
+
+    def test_session(self, group):
+        with group.session('w'):
+            group.tags.add('lark')
+            group.categories['bark'] = 'smooth'
+            assert group.tags == {'lark'}
+
+        g = dtr.Group(group.filepath)
+        assert g.tags == {'lark'}
+        assert g.categories == {'bark': 'smooth'}
+
+    def test_delete(self, group):
+        group.tags.add('lark')
+        location = group.abspath
+        group._backend.delete()
+
+        assert os.listdir(location) == []
+
+
+class TestMemberTable:
+    """Test compact member tables for Groups"""
+
+    def record(self, i):
+        return {'uuid': str(uuid.UUID(int=i * 7919 % 1000)),
+                'treanttype': 'Group' if i % 3 else 'Treant',
+                'abspath': '/forest/sprout{}'.format(i),
+                'relpath': 'sprout{}'.format(i)}
+
+    def dumped(self, table, tmpdir):
+        path = tmpdir.join('table').strpath
+        with open(path, 'wb') as f:
+            table.dump(f)
+        with open(path, 'rb') as f:
+            return dtr.backends.MemberTable(f.read())
+
+    def test_roundtrip(self, tmpdir):
+        records = [self.record(i) for i in range(50)]
+        table = self.dumped(
+            dtr.backends.MemberTable.fromrecords(records), tmpdir)
+
+        assert len(table) == 50
+        assert list(table) == records
+        assert table[-1] == records[-1]
+        for record in records:
+            assert table.get(record['uuid']) == record
+        assert table.get(str(uuid.UUID(int=1001))) is None
+
+    def test_changes(self, tmpdir):
+        records = [self.record(i) for i in range(50)]
+        table = self.dumped(
+            dtr.backends.MemberTable.fromrecords(records), tmpdir)
+
+        moved = dict(records[10], abspath='/elsewhere/sprout10')
+        table.put(moved)
+        table.remove([records[i]['uuid'] for i in (0, 20, 21)])
+        table.put(self.record(60))
+        table.put(self.record(61))
+        table.remove([self.record(61)['uuid']])
+
+        expected = [moved if i == 10 else self.record(i)
+                    for i in list(range(1, 20)) + list(range(22, 50)) + [60]]
+        assert list(table) == expected
+        assert [table[i] for i in range(len(table))] == expected
+
+        table = self.dumped(table, tmpdir)
+        assert list(table) == expected
+        for record in expected:
+            assert table.get(record['uuid']) == record
+        assert table.get(records[20]['uuid']) is None
+
+        # paths of replaced members are eventually dropped
+        for i in range(5):
+            for record in expected:
+                table.put(dict(record, abspath=record['abspath'] + 'x'))
+            table = self.dumped(table, tmpdir)
+        assert table._garbage <= table._pathsize // 2
+
+    @pytest.fixture
+    def group(self, tmpdir):
+        with tmpdir.as_cwd():
+            g = dtr.Group('forest', fmt='table')
+        return g
+
+    def test_group(self, group, tmpdir):
+        with tmpdir.as_cwd():
+            b = dtr.Bundle(*[dtr.Treant('sprout{}'.format(i))
+                             for i in range(10)])
+        group.members.add(b)
+        group.members.remove(3, b[7])
+
+        assert list(dtr.Group(group.filepath).members) == \
+            [m for i, m in enumerate(b) if i not in (3, 7)]
+
+        members = group._backend._shard('members')
+        assert isinstance(members._state, dtr.backends.MemberTable)
+
+        group.members.clear()
+        assert len(dtr.Group(group.filepath).members) == 0
+
+
+class TestDaemon:
+    """Test serving state files through a local daemon"""
+
+    @pytest.fixture
+    def socketpath(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join('datreant.sock'))
+        p = mp.Process(target=daemon.serve, args=(path,),
+                       kwargs={'flushdelay': 0.5})
+        p.start()
+        while not daemon.reachable(path):
+            time.sleep(0.01)
+
+        monkeypatch.setattr(daemon, 'socketpath', path)
+        yield path
+
+        p.terminate()
+        p.join()
+
+    @pytest.fixture
+    def treant(self, tmpdir, socketpath):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', tags=['lark'])
+        return t
+
+    def direct(self, treant):
+        filename, cls = fileclass(treant.filepath)
+        return cls(filename)
+
+    def test_served(self, treant):
+        assert isinstance(treant._backend, daemon._Client)
+
+        # new treants are found right away
+        assert os.path.exists(treant.filepath)
+
+        treant.tags.add('bark')
+        treant.categories['height'] = 23.4
+        assert treant.tags == {'lark', 'bark'}
+        assert dtr.Treant(treant.abspath).categories['height'] == 23.4
+
+    def test_flushed_later(self, treant):
+        treant.tags.add('bark')
+
+        # the daemon holds the file until it has written it out
+        f = self.direct(treant)
+        with pytest.raises(LockTimeoutError):
+            with f.read(timeout=0):
+                pass
+
+        with f.read(timeout=5):
+            assert set(f._state['tags']) == {'lark', 'bark'}
+
+    def test_external_writes(self, treant):
+        time.sleep(0.6)
+        f = self.direct(treant)
+        with f.write():
+            f._state['tags'].append('bark')
+
+        assert treant.tags == {'lark', 'bark'}
+
+    def test_many_processes(self, treant):
+        pool = mp.Pool(processes=4)
+        for i in range(10):
+            pool.apply_async(pokefile, args=(treant.filepath,
+                                             "run_{}".format(i)))
+        pool.close()
+        pool.join()
+
+        assert len(treant.tags) == 1001
+
+    def test_dead_client(self, treant):
+        p = mp.Process(target=dielocked, args=(treant.filepath,))
+        p.start()
+        p.join()
+
+        assert trylock(treant.filepath)
+
+    def test_move(self, treant, tmpdir):
+        treant.tags.add('bark')
+        treant.location = str(tmpdir.join('elsewhere'))
+        treant.name = 'tree'
+
+        assert treant.tags == {'lark', 'bark'}
+        assert dtr.Treant(treant.abspath).tags == {'lark', 'bark'}
+
+    def test_delete(self, treant):
+        treant._backend.delete()
+        assert not os.path.exists(treant.filepath)
+
+    def test_absent(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(daemon, 'socketpath', str(tmpdir.join('none')))
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', tags=['lark'])
+
+        assert not isinstance(t._backend, daemon._Client)
+        assert t.tags == {'lark'}
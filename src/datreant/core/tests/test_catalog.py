@@ -0,0 +1,164 @@
+"""Tests for the catalog of treants below a project root.
+
+"""
+
+import os
+
+import pytest
+
+import datreant.core as dtr
+from datreant.core.catalog import Catalog
+from datreant.core.indexes import RangeIndex
+
+
+class TestCatalog:
+    """Test building, refreshing, and querying a catalog"""
+
+    @pytest.fixture
+    def treants(self, tmpdir):
+        with tmpdir.as_cwd():
+            treants = [dtr.Treant('sprouts/sprout{}'.format(i),
+                                  tags=['lark'] if i % 2 else ['bark'],
+                                  categories={'height': i})
+                       for i in range(6)]
+            treants.append(dtr.Group('grove', tags=['lark'],
+                                     categories={'height': 23.4,
+                                                 'bark': 'smooth'}))
+        return treants
+
+    @pytest.fixture
+    def catalog(self, tmpdir, treants):
+        return Catalog.create(str(tmpdir))
+
+    def test_query(self, catalog, treants):
+        assert catalog.query() == sorted(t.filepath for t in treants)
+
+        assert catalog.query(tags=['lark']) == sorted(
+            t.filepath for t in treants if 'lark' in t.tags)
+        assert catalog.query(tags=['lark', 'bark']) == []
+        assert catalog.query(categories={'height': 4}) == [treants[4].filepath]
+        assert catalog.query(categories={'bark': 'smooth'},
+                             tags=['lark']) == [treants[6].filepath]
+        assert catalog.query(treanttype='Group') == [treants[6].filepath]
+        assert catalog.query(under=treants[0].location) == sorted(
+            t.filepath for t in treants[:6])
+
+    def test_locate(self, catalog, treants):
+        assert catalog.locate([t.uuid for t in treants[:2]]) == {
+            t.uuid: t.filepath for t in treants[:2]}
+        assert catalog.locate(['nonexistent']) == {}
+
+    def test_find(self, catalog, treants, tmpdir):
+        assert Catalog.find(treants[0].abspath) is catalog
+        assert Catalog.find(str(tmpdir.dirpath())) is None
+
+    def test_refresh(self, catalog, treants, tmpdir):
+        # nothing changed, nothing listed
+        assert catalog.refresh() == 0
+
+        treants[0].tags.add('lark')
+        treants[1].location = str(tmpdir.join('elsewhere'))
+        treants[2].categories['height'] = 42
+        with tmpdir.as_cwd():
+            new = dtr.Treant('sprouts/deep/sapling', tags=['lark'])
+        os.remove(treants[3].filepath)
+
+        # only the directories of the changed treants, and those new or
+        # moved ones were made in or taken from, are listed
+        assert catalog.refresh() == 5
+
+        assert catalog.query(tags=['lark']) == sorted(
+            [treants[0].filepath, treants[1].filepath, treants[5].filepath,
+             treants[6].filepath, new.filepath])
+        assert catalog.query(categories={'height': 42}) == [
+            treants[2].filepath]
+        assert catalog.locate([treants[1].uuid]) == {
+            treants[1].uuid: treants[1].filepath}
+        assert catalog.locate([treants[3].uuid]) == {}
+
+    def test_refresh_unbuilt(self, tmpdir, treants):
+        catalog = Catalog.create(str(tmpdir))
+        for table in ('dirs', 'treants', 'tags', 'categories'):
+            catalog.connection.execute("DELETE FROM {}".format(table))
+
+        catalog.refresh()
+        assert catalog.query() == sorted(t.filepath for t in treants)
+
+    def test_formats(self, tmpdir):
+        dtr.backends.RootStore.create(str(tmpdir.mkdir('store')))
+        with tmpdir.as_cwd():
+            j = dtr.Treant('journal', fmt='journal')
+            s = dtr.Treant('store/sprout')
+            g = dtr.Group('shards', fmt='shards')
+
+        catalog = Catalog.create(str(tmpdir))
+
+        # journal appends and store writes don't change any directory
+        for t in (j, s, g):
+            t.tags.add('lark')
+        catalog.refresh()
+
+        assert catalog.query(tags=['lark']) == sorted(
+            [j.filepath, s.filepath, g.filepath])
+
+    def test_discover(self, catalog, treants, tmpdir, monkeypatch):
+        def walk(*args):
+            raise AssertionError("filesystem walked")
+
+        monkeypatch.setattr(dtr.manipulators.scandir, 'walk', walk)
+
+        b = dtr.discover(str(tmpdir), catalog=True)
+        assert set(b) == set(treants)
+
+        b = dtr.discover(treants[0].location, catalog=catalog)
+        assert set(b) == set(treants[:6])
+
+    def test_discover_depth(self, tmpdir):
+        with tmpdir.as_cwd():
+            dtr.Treant('a')
+            dtr.Treant('a/b')
+            dtr.Treant('a/b/c')
+            dtr.Treant('d/e/f')
+
+        catalog = Catalog.create(str(tmpdir))
+        for depth in (None, 0, 1, 2, 3):
+            for treantdepth in (None, 0, 1, 2):
+                walked = dtr.discover(str(tmpdir), depth=depth,
+                                      treantdepth=treantdepth)
+                catalogued = dtr.discover(str(tmpdir), depth=depth,
+                                          treantdepth=treantdepth,
+                                          catalog=catalog)
+                assert set(catalogued) == set(walked)
+
+    def test_members_located(self, tmpdir):
+        with tmpdir.as_cwd():
+            g = dtr.Group('grove')
+            t = dtr.Treant('sprout')
+            g.members.add(t)
+            os.makedirs('far/away')
+            os.rename('sprout', 'far/away/sprout')
+
+            catalog = Catalog.create(str(tmpdir))
+
+            g = dtr.Group('grove')
+            g.members._searchtime = 0
+            assert g.members[0].abspath == os.path.join(
+                catalog.root, 'far', 'away', 'sprout') + os.sep
+
+    def test_range_index(self, catalog, treants):
+        index = RangeIndex.from_catalog(catalog, 'height')
+        assert len(index) == 7
+
+        # members are in order of state file, so the Group comes first
+        assert index.between(1.5, 4) == [3, 4, 5]
+        assert index.top(1, bundle=True)[0] == treants[6]
+
+        index = RangeIndex.from_catalog(catalog, 'height',
+                                        under=treants[0].location)
+        assert index.top(2) == [5, 4]
+        assert index.equal(3, bundle=True).names == ['sprout3']
+
+        # changes made in this process apply to the index, and not the
+        # catalog
+        treants[3].categories['height'] = 10
+        assert index.top(2) == [3, 5]
@@ -243,6 +243,7 @@ class TestBundle:
         comp = [cont.name + cont.uuid for cont in collection]
         assert collection.map(do_stuff) == comp
         assert collection.map(do_stuff, processes=2) == comp
+        assert collection.map(do_stuff, processes=2, snapshot=True) == comp
 
         assert collection.map(return_nothing) is None
         assert collection.map(return_nothing, processes=2) is None
@@ -288,6 +289,67 @@ class TestBundle:
             assert len(collection.flatten([g.uuid])) == 1
             assert 'mark' in collection.flatten([g.uuid]).names
 
+    def test_query(self, collection, tmpdir):
+        with tmpdir.as_cwd():
+            for i, (temperature, solvent) in enumerate(
+                    [(310, 'water'), (290, 'water'), (350, 'ethanol'),
+                     (330, 'water'), (None, 'water')]):
+                t = dtr.Treant('run{}'.format(i),
+                               tags=['equilibrated'] if i % 2 else [],
+                               categories={'solvent': solvent,
+                                           'run id': i})
+                t.categories['temperature'] = temperature
+                collection.add(t)
+
+        def names(expression):
+            return collection.query(expression).names
+
+        assert names("temperature > 300 and 'equilibrated' in tags "
+                     "and solvent == 'water'") == ['run3']
+        assert names("temperature > 300") == ['run0', 'run2', 'run3']
+        assert names("300 < temperature < 340") == ['run0', 'run3']
+        assert names("temperature == None or solvent in ('ethanol',)") == [
+            'run2', 'run4']
+        assert names("not 'equilibrated' in tags and "
+                     "categories['run id'] >= 2") == ['run2', 'run4']
+        assert names("'equilibrated' not in tags and "
+                     "temperature <= -1") == []
+        assert names("temperature") == ['run0', 'run1', 'run2', 'run3']
+        assert names("solvent == 'water' and 'dry' in tags") == []
+
+        from datreant.core.queries import Query
+        query = Query("solvent != 'water'")
+        assert query.limbs == {'categories'}
+        assert collection.query(query).names == ['run2']
+
+        for invalid in ("temperature >", "temperature is None",
+                        "len(tags) > 1", "temperature + 1 > 300",
+                        "categories[0] == 1"):
+            with pytest.raises(ValueError):
+                collection.query(invalid)
+
+    def test_query_reads_once(self, collection, tmpdir, monkeypatch):
+        with tmpdir.as_cwd():
+            for i in range(3):
+                collection.add(dtr.Treant('run{}'.format(i), tags=['a'],
+                                          categories={'b': i}))
+
+        reads = []
+        deserialize = dtr.backends.JSONFile._deserialize
+
+        def counted(self, handle):
+            reads.append(self.filename)
+            return deserialize(self, handle)
+
+        monkeypatch.setattr(dtr.backends.JSONFile, '_deserialize', counted)
+        for member in collection:
+            member._backend._stamp = None
+
+        assert collection.query(
+            "'a' in tags and b >= 1 and b < 2 and 'c' not in tags").names == [
+                'run1']
+        assert len(reads) == 3
+
     class TestAggTags:
         """Test behavior of manipulating tags collectively.
 
@@ -320,8 +382,52 @@ class TestBundle:
                                    tmpdir):
             pass
 
-        def test_tags_getitem(self, collection, testtreant, testgroup, tmpdir):
-            pass
+        @pytest.fixture
+        def tagged(self, collection, tmpdir):
+            # enough members to span several bytes of a bitmap
+            with tmpdir.as_cwd():
+                for i in range(19):
+                    tags = [tag for j, tag in enumerate(('two', 'three',
+                                                         'five'))
+                            if not i % (2, 3, 5)[j]]
+                    collection.add(dtr.Treant('sprout{}'.format(i),
+                                              tags=tags))
+            return collection
+
+        def test_tags_getitem(self, tagged):
+            for value in ('two', 'seven', ['two', 'three'], ('three', 'five'),
+                          {'two', 'five'}, [('two', 'five'), {'three'}],
+                          ('five', ['two', 'three']), [], (), set()):
+                assert tagged.tags[value] == [member.tags[value]
+                                              for member in tagged]
+
+            with pytest.raises(TypeError):
+                tagged.tags[5]
+
+        def test_tags_index(self, tagged):
+            index = tagged.tags.index()
+            assert len(index) == 19
+            assert set(index) == {'two', 'three', 'five'}
+
+            # evaluated without reading the members again
+            for member in tagged:
+                member.tags.add('seven')
+            assert 'seven' not in index
+
+            assert index.positions(['two', 'three']) == [0, 6, 12, 18]
+            assert index.positions(('seven', [])) == list(range(19))
+            assert index.bitmap(['three', 'five']) == 1 | 1 << 15
+
+            filtered = index.filter(('three', 'five'))
+            assert isinstance(filtered, dtr.Bundle)
+            assert filtered.names == ['sprout{}'.format(i) for i in
+                                      (0, 3, 5, 6, 9, 10, 12, 15, 18)]
+            assert len(index.filter('nope')) == 0
+
+        def test_tags_index_empty(self, collection):
+            index = collection.tags.index()
+            assert index['two'] == []
+            assert len(index.filter(['two'])) == 0
 
         def test_tags_fuzzy(self, collection, testtreant, testgroup, tmpdir):
             pass
@@ -742,3 +848,49 @@ class TestBundle:
                 assert len(health_nick) == 0
                 for bundle in health_nick.values():
                     assert {t1, t2, t3, t4}.isdisjoint(set(bundle))
+
+        @pytest.fixture
+        def swept(self, collection, tmpdir):
+            with tmpdir.as_cwd():
+                temperatures = [310, 290.5, 350, None, 'hot', 330, True, 350]
+                for i, temperature in enumerate(temperatures):
+                    t = dtr.Treant('run{}'.format(i))
+                    t.categories['temperature'] = temperature
+                    collection.add(t)
+            return collection
+
+        def test_categories_index(self, swept):
+            index = swept.categories.index('temperature')
+
+            # missing, string, and boolean values are left out
+            assert index.between() == [0, 1, 2, 5, 7]
+            assert index.between(300, 350) == [0, 2, 5, 7]
+            assert index.between(low=311) == [2, 5, 7]
+            assert index.between(high=310) == [0, 1]
+            assert index.between(400, 500) == []
+            assert index.equal(350) == [2, 7]
+            assert index.equal(290.5) == [1]
+            assert index.top(3) == [7, 2, 5]
+            assert index.top(2, largest=False) == [1, 0]
+            assert index.top(0) == []
+
+            bundle = index.between(300, 340, bundle=True)
+            assert isinstance(bundle, dtr.Bundle)
+            assert bundle.names == ['run0', 'run5']
+
+        def test_categories_index_maintained(self, swept):
+            index = swept.categories.index('temperature')
+
+            swept[0].categories['temperature'] = 400
+            swept[3].categories.add(temperature=295)
+            swept[2].categories.remove('temperature')
+            swept[5].categories['temperature'] = 'cold'
+            swept[7].categories.clear()
+            swept[1].categories.add(pressure=2)
+
+            assert index.between() == [0, 1, 3]
+            assert index.top(1) == [0]
+            assert index.between(290, 300) == [1, 3]
+
+            swept.categories['temperature'] = 300
+            assert index.equal(300) == list(range(8))
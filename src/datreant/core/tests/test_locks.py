@@ -2,12 +2,17 @@
 
 """
 
+import os
+import json
 import string
 import multiprocessing as mp
 import time
+import threading
 import pytest
 
 from datreant.core import Treant
+from datreant.core.backends import (File, LockTimeoutError, DescriptorPool,
+                                   RootStore)
 
 
 def pokefile(treantfilepath, string):
@@ -16,6 +21,31 @@ def pokefile(treantfilepath, string):
     treant.tags.add(*["{}_{}".format(string, i) for i in range(100)])
 
 
+def holdlock(treantfilepath, held, release):
+    """Hold an exclusive lock on a Treant until told to let go."""
+    treant = Treant(treantfilepath)
+    with treant.session('w'):
+        held.set()
+        release.wait()
+
+
+def trylock(treantfilepath):
+    """Try once to get an exclusive lock on a Treant."""
+    treant = Treant(treantfilepath)
+    try:
+        with treant.session('w', timeout=0):
+            return True
+    except LockTimeoutError:
+        return False
+
+
+def dielocked(treantfilepath):
+    """Exit while holding an exclusive lock on a Treant."""
+    treant = Treant(treantfilepath)
+    with treant.session('w'):
+        os._exit(0)
+
+
 def init_treant(tmpdir, tags):
     with tmpdir.as_cwd():
         tf = Treant('sprout', tags=tags)
@@ -40,6 +70,49 @@ class TestTreantFile:
 
         assert len(treant.tags) == 1000
 
+    def test_death_by_1000_threads(self, treant):
+        threads = [threading.Thread(target=pokefile,
+                                    args=(treant.filepath,
+                                          "run_{}".format(i)))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(treant.tags) == 1000
+
+    def test_shared_object(self, treant):
+        def poke(string):
+            for i in range(100):
+                treant.tags.add("{}_{}".format(string, i))
+
+        threads = [threading.Thread(target=poke, args=("run_{}".format(i),))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(treant.tags) == 1000
+
+    def test_lock_per_thread(self, treant):
+        results = []
+
+        with treant.session('w'):
+            assert treant._backend.fdlock == 'exclusive'
+
+            def check():
+                results.append(treant._backend.fdlock)
+                results.append(trylock(treant.filepath))
+
+            thread = threading.Thread(target=check)
+            thread.start()
+            thread.join()
+
+        assert results == [None, False]
+        assert trylock(treant.filepath)
+
     def test_init_treant(self, tmpdir):
         pool = mp.Pool(processes=4)
         num = 73
@@ -57,3 +130,238 @@ class TestTreantFile:
             tf = Treant('sprout')
 
         assert len(tf.tags) == num + 1
+
+
+class TestTreantFileFlock(TestTreantFile):
+    """Stress tests for locks applied with flock to Treant directories."""
+
+    @pytest.fixture(autouse=True)
+    def flock(self, monkeypatch):
+        monkeypatch.setattr(File, 'locking', 'flock')
+
+    def test_no_proxy(self, treant):
+        assert treant._backend.locking == 'flock'
+        assert not os.path.exists(treant._backend.proxy)
+
+        treant.tags.add('bark')
+        assert 'bark' in treant.tags
+        assert os.listdir(treant.abspath) == [
+            os.path.basename(treant.filepath)]
+
+    def test_same_process(self, treant):
+        other = Treant(treant.abspath)
+
+        # the directory lock is the process's, so other Treants for the same
+        # directory don't wait on it
+        treant.tags.add('bark')
+        with treant.session('w'):
+            assert 'bark' in other.tags
+
+        with treant.session('r'):
+            with pytest.raises(IOError):
+                other.tags.add('lark')
+
+    def test_threads(self, treant):
+        other = Treant(treant.abspath)
+
+        with treant.session('w'):
+            thread = threading.Thread(target=other.tags.add, args=('lark',))
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+
+            treant.tags.add('bark')
+
+        thread.join()
+        assert treant.tags == {'bark', 'lark'}
+
+
+class TestTreantFileLease(TestTreantFile):
+    """Stress tests for locks applied with lease files."""
+
+    @pytest.fixture(autouse=True)
+    def lease(self, monkeypatch):
+        monkeypatch.setattr(File, 'locking', 'lease')
+
+    def fakelease(self, treant, age):
+        """Make an exclusive lease held by another host `age` seconds ago."""
+        lease = treant._backend.lease
+        os.mkdir(lease)
+        with open(os.path.join(lease, 'owner'), 'w') as f:
+            json.dump({'host': 'elsewhere', 'pid': 1, 'token': 'abc'}, f)
+
+        renewed = time.time() - age
+        os.utime(os.path.join(lease, 'owner'), (renewed, renewed))
+
+    def test_no_proxy(self, treant):
+        assert not os.path.exists(treant._backend.proxy)
+
+        with treant.session('w'):
+            assert os.path.isdir(treant._backend.lease)
+        assert not os.path.exists(treant._backend.lease)
+
+        with treant.session('r'):
+            assert len(os.listdir(treant._backend.lease + 's')) == 1
+        assert not os.listdir(treant._backend.lease + 's')
+
+    def test_dead_owner(self, treant):
+        p = mp.Process(target=dielocked, args=(treant.filepath,))
+        p.start()
+        p.join()
+
+        assert os.path.exists(treant._backend.lease)
+        assert trylock(treant.filepath)
+        assert not os.path.exists(treant._backend.lease)
+
+    def test_live_lease(self, treant):
+        self.fakelease(treant, 0)
+        assert not trylock(treant.filepath)
+
+        with pytest.raises(LockTimeoutError):
+            with treant.session('r', timeout=0):
+                pass
+
+    def test_stale_lease(self, treant):
+        self.fakelease(treant, File.leasetime + 1)
+        assert trylock(treant.filepath)
+
+        treant.tags.add('bark')
+        assert 'bark' in treant.tags
+
+    def test_heartbeat(self, treant, monkeypatch):
+        monkeypatch.setattr(File, 'leasetime', 0.3)
+
+        held = mp.Event()
+        release = mp.Event()
+        p = mp.Process(target=holdlock,
+                       args=(treant.filepath, held, release))
+        p.start()
+        held.wait()
+
+        try:
+            # renewed while held, so never stale
+            time.sleep(1)
+            assert not trylock(treant.filepath)
+        finally:
+            release.set()
+            p.join()
+
+        assert trylock(treant.filepath)
+
+
+class TestTreantFilePooled(TestTreantFile):
+    """Stress tests for locks applied to descriptors kept in a pool."""
+
+    @pytest.fixture(autouse=True, params=['proxy', 'flock'])
+    def pooled(self, monkeypatch, request):
+        monkeypatch.setattr(File, 'locking', request.param)
+        monkeypatch.setattr(File, 'fdpool', DescriptorPool(4))
+
+    def test_held_through_eviction(self, treant, tmpdir):
+        with tmpdir.as_cwd():
+            others = [Treant('sapling{}'.format(i)) for i in range(6)]
+
+        list(treant.tags)
+        with treant.session('w'):
+            # other descriptors are pushed out of the pool around ours
+            for other in others:
+                list(other.tags)
+
+            pool = mp.Pool(processes=1)
+            assert not pool.apply(trylock, args=(treant.filepath,))
+            pool.close()
+            pool.join()
+
+
+class TestTreantFileStore(TestTreantFile):
+    """Stress tests for transactions on a root store."""
+
+    @pytest.fixture(autouse=True)
+    def store(self, tmpdir):
+        RootStore.create(str(tmpdir))
+
+    def test_in_store(self, treant):
+        assert treant.filepath.endswith('.store')
+
+
+class TestTreantFileSharded(TestTreantFile):
+    """Stress tests for locks on state files sharded by limb."""
+
+    @pytest.fixture
+    def treant(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = Treant('sprout', fmt='shards')
+        return t
+
+
+class TestLockTimeout:
+    """Tests for giving up on locks held elsewhere."""
+
+    @pytest.fixture(params=['proxy', 'flock', 'lease'])
+    def treant(self, tmpdir, request, monkeypatch):
+        monkeypatch.setattr(File, 'locking', request.param)
+        with tmpdir.as_cwd():
+            t = Treant('sprout')
+        return t
+
+    @pytest.fixture
+    def locked(self, treant, request):
+        """Exclusive lock held on the treant by another process."""
+        held = mp.Event()
+        release = mp.Event()
+        p = mp.Process(target=holdlock,
+                       args=(treant.filepath, held, release))
+        p.start()
+        held.wait()
+
+        def fin():
+            release.set()
+            p.join()
+
+        request.addfinalizer(fin)
+        return release
+
+    def test_trylock(self, treant, locked):
+        with pytest.raises(LockTimeoutError):
+            with treant.session('r', timeout=0):
+                pass
+
+        assert treant._backend.lockstats['timeouts'] == 1
+        assert treant._backend.fdlock is None
+
+    def test_timeout(self, treant, locked):
+        start = time.time()
+        with pytest.raises(LockTimeoutError):
+            with treant.session('w', timeout=0.2):
+                pass
+
+        assert time.time() - start >= 0.2
+
+        # default timeout applies to everything else
+        treant._backend.locktimeout = 0.05
+        with pytest.raises(LockTimeoutError):
+            treant.tags.add('bark')
+
+        assert treant._backend.lockstats['timeouts'] == 2
+
+    def test_wait(self, treant, locked):
+        treant._backend.locktimeout = 5
+        locks = treant._backend.lockstats['locks']
+
+        locked.set()
+        treant.tags.add('bark')
+
+        assert 'bark' in treant.tags
+        assert treant._backend.lockstats['locks'] > locks
+        assert treant._backend.lockstats['waited'] > 0
+
+
+class TestLockTimeoutSharded(TestLockTimeout):
+    """Test bounded waits on locks of state files sharded by limb."""
+
+    @pytest.fixture(params=['proxy', 'flock', 'lease'])
+    def treant(self, tmpdir, request, monkeypatch):
+        monkeypatch.setattr(File, 'locking', request.param)
+        with tmpdir.as_cwd():
+            t = Treant('sprout', fmt='shards')
+        return t
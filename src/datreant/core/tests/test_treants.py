@@ -6,6 +6,7 @@ import datreant.core as dtr
 import pytest
 import os
 import py
+import pickle
 
 from . import test_collections
 from .test_trees import TestTree
@@ -163,6 +164,57 @@ class TestTreant(TestTree):
         assert c1 <= c2 < c3
         assert c3 >= c2 > c1
 
+    def test_session_write(self, treant, monkeypatch):
+        """Test that a write session writes the state file only once."""
+        pushes = []
+        push = treant._backend._push_state
+
+        def counting():
+            pushes.append(None)
+            push()
+
+        monkeypatch.setattr(treant._backend, '_push_state', counting)
+
+        with treant.session('w') as t:
+            assert t is treant
+            for i in range(30):
+                treant.categories['key_{}'.format(i)] = i
+            treant.tags.add('lark')
+            treant.tags.add('bark')
+            treant.categories.remove('key_0')
+
+        assert len(pushes) == 1
+
+        t = treant.__class__(treant.filepath)
+        assert len(t.categories) == 29
+        assert t.categories['key_29'] == 29
+        assert t.tags == {'lark', 'bark'}
+
+    def test_session_read(self, treant):
+        treant.tags.add('lark')
+
+        with treant.session('r'):
+            assert 'lark' in treant.tags
+            assert len(treant.categories) == 0
+
+            with pytest.raises(IOError):
+                treant.tags.add('bark')
+
+        assert 'bark' not in treant.tags
+
+        with pytest.raises(ValueError):
+            with treant.session('x'):
+                pass
+
+    def test_session_error(self, treant):
+        """Test that changes aren't written if a session fails."""
+        with pytest.raises(KeyError):
+            with treant.session('w'):
+                treant.tags.add('lark')
+                treant.categories['bark']
+
+        assert 'lark' not in treant.tags
+
     class TestTags:
         """Test treant tags"""
 
@@ -199,6 +251,14 @@ class TestTreant(TestTree):
             treant.tags.clear()
             assert len(treant.tags) == 0
 
+        def test_remove_while_iterating(self, treant):
+            treant.tags.add('a', 'b', 'c', 'd')
+
+            for tag in treant.tags:
+                treant.tags.remove(tag)
+
+            assert len(treant.tags) == 0
+
         def test_tags_set_behavior(self, tmpdir, treantclass):
             with tmpdir.as_cwd():
                 # 1
@@ -286,6 +346,14 @@ class TestTreant(TestTree):
             treant.categories.clear()
             assert len(treant.categories) == 0
 
+        def test_remove_while_iterating(self, treant):
+            treant.categories.add(a=1, b=2, c=3)
+
+            for key in treant.categories:
+                del treant.categories[key]
+
+            assert len(treant.categories) == 0
+
         def test_add_wrong(self, treant):
             with pytest.raises(TypeError):
                 treant.categories.add('temperature', 300)
@@ -452,3 +520,119 @@ class TestReadOnly:
             t.location = 'somewhere/else'
 
         assert len(group.members) == 2
+
+
+class TestReadMode:
+    """Test Treants and Bundles opened with mode 'r'"""
+
+    @pytest.fixture
+    def treant(self, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprout', tags=['lark'],
+                           categories={'bark': 'smooth'})
+        return t
+
+    @pytest.fixture
+    def group(self, tmpdir):
+        with tmpdir.as_cwd():
+            g = dtr.Group('grove')
+            g.members.add(dtr.Treant('lark'), dtr.Group('bark'))
+        return g
+
+    @pytest.fixture
+    def exclusive(self, monkeypatch):
+        """Record every exclusive lock taken"""
+        locks = []
+        apply = dtr.backends.core.File._apply_exclusive_lock
+
+        def recording(self, *args, **kwargs):
+            locks.append(self.filename)
+            return apply(self, *args, **kwargs)
+
+        monkeypatch.setattr(dtr.backends.core.File, '_apply_exclusive_lock',
+                            recording)
+        return locks
+
+    def test_no_writes(self, treant, exclusive):
+        with open(treant.filepath, 'rb') as f:
+            contents = f.read()
+
+        t = dtr.Treant(treant.abspath, mode='r')
+        assert t.tags == {'lark'}
+        assert t.categories['bark'] == 'smooth'
+        assert t.state == treant.state
+
+        assert exclusive == []
+        with open(treant.filepath, 'rb') as f:
+            assert f.read() == contents
+
+    def test_writes_raise(self, treant, tmpdir):
+        t = dtr.Treant(treant.filepath, mode='r')
+
+        with pytest.raises(IOError):
+            t.tags.add('bark')
+        with pytest.raises(IOError):
+            t.categories['bark'] = 'rough'
+        with pytest.raises(IOError):
+            with t.session('w'):
+                pass
+        with pytest.raises(IOError):
+            t.name = 'tree'
+        with pytest.raises(IOError):
+            t.location = str(tmpdir.join('elsewhere'))
+
+        assert treant.tags == {'lark'}
+        assert treant.categories['bark'] == 'smooth'
+        assert os.path.exists(treant.filepath)
+
+    def test_missing_keys(self, group):
+        # a state file holding none of the limbs' items
+        with open(group.filepath, 'w') as f:
+            f.write('{}')
+
+        g = dtr.Group(group.abspath, mode='r')
+        assert len(g.tags) == 0
+        assert len(g.categories) == 0
+        assert len(g.members) == 0
+
+        with open(group.filepath) as f:
+            assert f.read() == '{}'
+
+    def test_no_generation(self, tmpdir):
+        with tmpdir.as_cwd():
+            with pytest.raises(dtr.treants.NoTreantsError):
+                dtr.Treant('sprout', mode='r')
+            assert not os.path.exists('sprout')
+
+            dtr.Treant('sprout')
+            with pytest.raises(ValueError):
+                dtr.Treant('sprout', new=True, mode='r')
+            with pytest.raises(ValueError):
+                dtr.Treant('sprout', tags=['lark'], mode='r')
+
+    def test_members(self, group, exclusive):
+        g = dtr.Group(group.abspath, mode='r')
+
+        assert len(g.members) == 2
+        for member in g.members:
+            assert member._backend.readonly
+        for member in g.members.flatten():
+            assert member._backend.readonly
+
+        assert exclusive == []
+
+    def test_bundle(self, group, exclusive):
+        b = dtr.Bundle(group.abspath, group.members.abspaths, mode='r')
+
+        assert len(b) == 3
+        for member in b:
+            assert member._backend.readonly
+        for member in b[1:]:
+            assert member._backend.readonly
+
+        assert exclusive == []
+
+    def test_pickle(self, treant):
+        t = pickle.loads(pickle.dumps(dtr.Treant(treant.abspath, mode='r')))
+        assert t._backend.readonly
+        assert not pickle.loads(pickle.dumps(treant))._backend.readonly
@@ -0,0 +1,125 @@
+"""Tests for watching a project root for changes to treants.
+
+"""
+
+import os
+import shutil
+
+import pytest
+
+import datreant.core as dtr
+from datreant.core.watch import Watcher, Update, _libc
+
+
+class TestWatcher:
+    """Test the updates published for changes to treants"""
+
+    @pytest.fixture(params=[True, False], ids=['polling', 'inotify'])
+    def polling(self, request):
+        if not request.param and _libc() is None:
+            pytest.skip("inotify not available")
+        return request.param
+
+    @pytest.fixture
+    def treants(self, tmpdir):
+        with tmpdir.as_cwd():
+            treants = [dtr.Treant('sprouts/sprout{}'.format(i),
+                                  tags=['lark'], categories={'height': i})
+                       for i in range(3)]
+            treants.append(dtr.Group('grove'))
+        return treants
+
+    @pytest.fixture
+    def watcher(self, tmpdir, treants, polling):
+        watcher = Watcher(str(tmpdir), interval=0.01, polling=polling)
+        assert watcher.polling == polling
+        yield watcher
+        watcher.close()
+
+    def test_nothing_changed(self, watcher, treants):
+        for treant in treants:
+            treant.tags
+        assert watcher.poll() == []
+
+    def test_changed(self, watcher, treants):
+        treants[0].tags.add('bark')
+        treants[1].categories['height'] = 42
+        treants[3].members.add(treants[2])
+
+        assert watcher.poll(1) == [
+            Update(treants[3].uuid, treants[3].filepath,
+                   treants[3].filepath, frozenset(['members'])),
+            Update(treants[0].uuid, treants[0].filepath,
+                   treants[0].filepath, frozenset(['tags'])),
+            Update(treants[1].uuid, treants[1].filepath,
+                   treants[1].filepath, frozenset(['categories']))]
+        assert watcher.poll() == []
+
+    def test_created(self, watcher, tmpdir):
+        with tmpdir.as_cwd():
+            t = dtr.Treant('sprouts/deep/sapling')
+
+        assert watcher.poll(1) == [
+            Update(t.uuid, t.filepath, None,
+                   frozenset(['tags', 'categories']))]
+
+    def test_moved(self, watcher, treants, tmpdir):
+        oldpath = treants[0].filepath
+        treants[0].location = str(tmpdir.mkdir('elsewhere'))
+
+        assert watcher.poll(1) == [
+            Update(treants[0].uuid, treants[0].filepath, oldpath,
+                   frozenset())]
+
+    def test_removed(self, watcher, treants):
+        shutil.rmtree(treants[0].abspath)
+        os.remove(treants[1].filepath)
+
+        assert watcher.poll(1) == sorted(
+            [Update(t.uuid, None, t.filepath,
+                    frozenset(['tags', 'categories']))
+             for t in treants[:2]],
+            key=lambda u: u.oldpath)
+
+    def test_formats(self, tmpdir, polling):
+        dtr.backends.RootStore.create(str(tmpdir.mkdir('store')))
+        with tmpdir.as_cwd():
+            treants = [dtr.Treant('journal', fmt='journal'),
+                       dtr.Treant('store/sprout'),
+                       dtr.Group('shards', fmt='shards')]
+
+        with Watcher(str(tmpdir), interval=0.01,
+                     polling=polling) as watcher:
+            for t in treants:
+                t.tags.add('lark')
+
+            updates = watcher.poll(1)
+            while len(updates) < len(treants):
+                more = watcher.poll(1)
+                assert more
+                updates.extend(more)
+
+        assert sorted(updates) == sorted(
+            Update(t.uuid, t.filepath, t.filepath, frozenset(['tags']))
+            for t in treants)
+
+    def test_subscribe(self, watcher, treants):
+        updates = []
+        watcher.subscribe(updates.append)
+        watcher.start()
+        try:
+            treants[0].tags.add('bark')
+            for _ in range(100):
+                if updates:
+                    break
+                watcher._stopping.wait(0.01)
+        finally:
+            watcher.stop()
+
+        assert updates == [Update(treants[0].uuid, treants[0].filepath,
+                                  treants[0].filepath, frozenset(['tags']))]
+
+        watcher.unsubscribe(updates.append)
+        treants[0].tags.add('cork')
+        assert len(watcher.poll(1)) == 1
+        assert len(updates) == 1
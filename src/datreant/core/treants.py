@@ -3,8 +3,10 @@ Treants: the organizational units for :mod:`datreant`.
 
 """
 import os
+import copy
 import functools
 import six
+from contextlib import contextmanager
 from uuid import uuid4
 from pathlib import Path
 
@@ -15,7 +17,7 @@ from .trees import Tree
 from .util import makedirs
 
 from .backends.statefiles import treantfile, TreantFile
-from . import _TREANTS, _TREELIMBS, _LIMBS
+from . import _TREANTS, _TREELIMBS, _LIMBS, _FORMATS
 
 
 class MultipleTreantsError(Exception):
@@ -53,6 +55,13 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
     Use the `new` keyword to force generation of a new Treant at the given
     path.
 
+    Use ``mode='r'`` to open an existing Treant read-only: its state file is
+    then never locked exclusively or written, so many processes can read it
+    without contending with each other or with writers for more than a
+    shared lock. Tags, categories, and members missing from its state read
+    as empty, instead of being initialized, and any attempt to change or
+    move the Treant raises an :exc:`IOError`.
+
     Parameters
     ----------
     treant : str or Tree
@@ -68,23 +77,49 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
     tags : list
         list with user-defined values; like categories, but useful for
         adding many distinguishing descriptors
+    fmt : str
+        format of the state file when generating a new Treant, given by its
+        extension, e.g. 'json', 'json.gz', 'msgpack', or 'marshal'; if not
+        given, 'store' if there is a root store at or above the Treant, else
+        'json'; an existing Treant is always regenerated from its state file
+        as it is
+    mode : {'a', 'r'}
+        'a' regenerates an existing Treant, or generates a new one if none
+        is found; 'r' opens an existing Treant read-only, and raises
+        :exc:`NoTreantsError` if none is found
     """
     # required components
     _treanttype = 'Treant'
     _backendclass = TreantFile
 
-    def __init__(self, treant, new=False, categories=None, tags=None):
+    _mode = 'a'
+
+    # if True, pickles carry a snapshot of the state; see Bundle.map
+    _picklestate = False
+
+    def __init__(self, treant, new=False, categories=None, tags=None,
+                 fmt=None, mode='a'):
         # if given a Tree, get path out of it
         if isinstance(treant, Tree):
             treant = treant.abspath
 
-        if new:
-            self._generate(treant, categories=categories, tags=tags)
+        if mode not in ('a', 'r'):
+            raise ValueError("Mode must be 'a' or 'r'")
+        self._mode = mode
+
+        if mode == 'r':
+            if new or categories or tags:
+                raise ValueError("Cannot generate or change a Treant "
+                                 "opened read-only")
+            self._regenerate(treant)
+        elif new:
+            self._generate(treant, categories=categories, tags=tags, fmt=fmt)
         else:
             try:
                 self._regenerate(treant, categories=categories, tags=tags)
             except NoTreantsError:
-                self._generate(treant, categories=categories, tags=tags)
+                self._generate(treant, categories=categories, tags=tags,
+                               fmt=fmt)
 
     def attach(self, *limbname):
         """Attach limbs by name to this Treant.
@@ -105,6 +140,96 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
     def _state(self):
         return self._backend._state
 
+    @contextmanager
+    def session(self, mode='r', timeout=None):
+        """Context manager for doing many operations on this Treant at once.
+
+        The state file is locked and read once on entering the context, and
+        all operations within it act on the state in memory. For mode 'w',
+        the state is written back once on exiting; any number of changes to
+        tags, categories, members, etc. then cost a single write.
+
+        Other processes must wait to write to the Treant for the duration of
+        a session, and to read it for a session with mode 'w'.
+
+        Parameters
+        ----------
+        mode : {'r', 'w'}
+            'r' holds a shared lock, and allows only reading; 'w' holds an
+            exclusive lock, and allows reading and writing
+        timeout : float
+            maximum time in seconds to wait for the lock before raising
+            :exc:`~datreant.core.backends.LockTimeoutError`; 0 makes a
+            single attempt; ``None`` uses the backend's default
+
+        Examples
+        --------
+        Set many categories with only one write to the state file::
+
+            >>> with t.session('w'):
+            ...     for key, value in values.items():
+            ...         t.categories[key] = value
+
+        """
+        if mode == 'r':
+            context = self._backend.read(timeout=timeout)
+        elif mode == 'w':
+            context = self._backend.write(timeout=timeout)
+        else:
+            raise ValueError("Mode must be 'r' or 'w'")
+
+        with context:
+            yield self
+
+    def asession(self, mode='r', timeout=None):
+        """Asynchronous context manager counterpart of :meth:`session`.
+
+        The lock is polled for without blocking the event loop, and is held
+        by the loop's thread; blocking operations on this Treant from the
+        task that opened the session are done under it. Other tasks'
+        asynchronous operations on this Treant wait for the session to end.
+
+        Parameters
+        ----------
+        mode : {'r', 'w'}
+            'r' holds a shared lock, and allows only reading; 'w' holds an
+            exclusive lock, and allows reading and writing
+        timeout : float
+            maximum time in seconds to wait for the lock before raising
+            :exc:`~datreant.core.backends.LockTimeoutError`
+
+        Examples
+        --------
+        Set many categories from a coroutine with only one write::
+
+            >>> async with t.asession('w'):
+            ...     for key, value in values.items():
+            ...         t.categories[key] = value
+
+        """
+        from . import aio
+        return aio.Session(self, mode, timeout)
+
+    def aread(self, timeout=None):
+        """Get a copy of the Treant's full state asynchronously.
+
+        Asynchronous counterpart of :attr:`state`, to be awaited.
+
+        Parameters
+        ----------
+        timeout : float
+            maximum time in seconds to wait for the lock before raising
+            :exc:`~datreant.core.backends.LockTimeoutError`
+
+        """
+        from . import aio
+
+        def read():
+            with self.session('r', timeout):
+                return self.state
+
+        return aio.call(self, read)
+
     @property
     def _read(self):
         return self._backend.read()
@@ -117,10 +242,28 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
         return "<{}: '{}'>".format(self._treanttype, self.name)
 
     def __getstate__(self):
-        return self.filepath
+        # the state file's name gives the uuid and treanttype, and the
+        # format, so the backend can be rebuilt from it without looking
+        # at the filesystem
+        state = {'filepath': self.filepath, 'mode': self._mode}
+
+        if self._picklestate:
+            with self._read:
+                state['snapshot'] = self._backend._snapshot()
+
+        return state
 
     def __setstate__(self, state):
-        self.__init__(state)
+        if not isinstance(state, dict):
+            # pickled by earlier versions, as the path to the state file
+            self.__init__(state)
+            return
+
+        self._mode = state['mode']
+        self._backend = self._treantfile(state['filepath'])
+
+        if state.get('snapshot') is not None:
+            self._backend._restore(state['snapshot'])
 
     def __hash__(self):
         return hash(self.uuid)
@@ -147,10 +290,17 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
         else:
             raise TypeError("Operands must be Treants or Bundles.")
 
-    def _generate(self, treant, categories=None, tags=None):
+    def _generate(self, treant, categories=None, tags=None, fmt=None):
         """Generate new Treant object.
 
         """
+        # check format before leaving anything on disk
+        if fmt is not None and fmt not in _FORMATS:
+            raise ValueError("No known state file format '{}'".format(fmt))
+
+        # build the whole initial state first, so it's written out at once
+        state = self._init_state(categories=categories, tags=tags)
+
         # build basedir; stop if we hit a permissions error
         try:
             makedirs(treant)
@@ -161,23 +311,34 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
             else:
                 raise
 
-        filename = filesystem.statefilename(self._treanttype, str(uuid4()))
+        filename = filesystem.statefilename(self._treanttype, str(uuid4()),
+                                            ext=fmt)
 
         statefile = os.path.join(treant, filename)
 
         # generate state file
         self._backend = treantfile(statefile)
+        self._backend.create(state)
+
+    def _init_state(self, categories=None, tags=None):
+        """Get the state of a new Treant, with the given categories and
+        tags.
 
-        # add categories, tags in one go; doubles as file init so there's
-        # something there
-        if not tags:
-            tags = []
-        if not categories:
-            categories = {}
+        """
+        state = {'tags': [], 'categories': {}}
 
-        with self._write:
-            self.categories.add(categories)
-            self.tags.add(tags)
+        limbs.Categories._update(state, categories or {})
+        limbs.Tags._update(state, [tags or []])
+
+        return state
+
+    def _treantfile(self, statefile):
+        """Get the backend for an existing state file, as our mode needs.
+
+        """
+        if self._mode == 'r':
+            return treantfile(statefile, readonly=True)
+        return treantfile(statefile)
 
     def _regenerate(self, treant, categories=None, tags=None):
         """Re-generate existing Treant object.
@@ -190,7 +351,7 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
 
             # if only one state file, load it; otherwise, complain loudly
             if len(statefile) == 1:
-                self._backend = treantfile(statefile[0])
+                self._backend = self._treantfile(statefile[0])
                 # try to add categories, tags in one go
                 if categories or tags:
                     try:
@@ -211,7 +372,7 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
 
         # if a state file is given, try loading it
         elif os.path.exists(treant):
-            self._backend = treantfile(treant)
+            self._backend = self._treantfile(treant)
             # try to add categories, tags
             if categories or tags:
                 # try to add categories, tags in one go
@@ -248,9 +409,11 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
         """
         olddir = os.path.dirname(self._backend.filename)
         newdir = os.path.join(os.path.dirname(olddir), name)
+
+        # renaming leaves the Treant where it is
+        self._backend.check_location(os.path.dirname(olddir))
         statefile = os.path.join(newdir,
-                                 filesystem.statefilename(
-                                     self._treanttype, self.uuid))
+                                 os.path.basename(self._backend.filename))
 
         os.rename(olddir, newdir)
         self._regenerate(statefile)
@@ -305,12 +468,13 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
         directory.
 
         """
+        self._backend.check_location(value)
+
         makedirs(value)
         oldpath = self._backend.get_location()
         newpath = os.path.join(value, self.name)
         statefile = os.path.join(newpath,
-                                 filesystem.statefilename(
-                                     self._treanttype, self.uuid))
+                                 os.path.basename(self._backend.filename))
         os.rename(oldpath, newpath)
         self._regenerate(statefile)
 
@@ -337,8 +501,11 @@ class Treant(six.with_metaclass(_Treantmeta, Tree)):
 
     @property
     def state(self):
+        """A copy of the Treant's full state.
+
+        """
         with self._read:
-            state = self._state
+            state = copy.deepcopy(self._state)
         return state
 
 
@@ -375,10 +542,22 @@ class Group(Treant):
     tags : list
         list with user-defined values; like categories, but useful for
         adding many distinguishing descriptors
+    fmt : str
+        format of the state file when generating a new Group, given by its
+        extension, e.g. 'json', 'json.gz', 'msgpack', or 'marshal'; if not
+        given, 'store' if there is a root store at or above the Group, else
+        'json'; an existing Group is always regenerated from its state file
+        as it is
     """
     # required components
     _treanttype = 'Group'
 
+    def _init_state(self, categories=None, tags=None):
+        state = super(Group, self)._init_state(categories=categories,
+                                               tags=tags)
+        state['members'] = []
+        return state
+
     def __repr__(self):
         out = "<Group: '{}'".format(self.name)
         with self._read:
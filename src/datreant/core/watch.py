@@ -0,0 +1,666 @@
+"""
+Watching a project root for changes to the treants below it, so that
+long-running services can keep views of treant metadata current without
+rescanning.
+
+A :class:`Watcher` observes the directories below a root for state files
+being created, replaced, moved, or removed, using Linux inotify where it is
+available and polling the modification times of directories otherwise.
+Changed state files are read again, and an :class:`Update` is published to
+subscribers for each treant whose state or location changed.
+
+"""
+import os
+import sys
+import json
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import hashlib
+import threading
+from collections import namedtuple
+
+import scandir
+
+from . import filesystem
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+         IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+# struct inotify_event, without its name
+_EVENT = struct.Struct('iIII')
+
+# extensions of hidden files next to state files that hold no state
+_LOCKFILES = ('proxy', 'lease', 'leases', 'buffer')
+
+
+class Update(namedtuple('Update', ['uuid', 'path', 'oldpath', 'limbs'])):
+    """Change to a treant seen by a :class:`Watcher`.
+
+    *path* is the treant's state file, or ``None`` if it was removed;
+    *oldpath* is where its state file was before, or ``None`` if it is new.
+    *limbs* is a frozenset of the items of the treant's state that changed,
+    such as 'tags', 'categories', or 'members'; all of them for new and
+    removed treants, and none for treants that only moved.
+
+    """
+    __slots__ = ()
+
+
+def _libc():
+    """Get the C library, if it has inotify."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def _encode(path):
+    if isinstance(path, bytes):
+        return path
+    elif hasattr(os, 'fsencode'):
+        return os.fsencode(path)
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _decode(name):
+    if isinstance(name, str):
+        return name
+    return os.fsdecode(name)
+
+
+def _relevant(name):
+    """Check if a change to a file of this name can change a treant's state.
+
+    These are state files, and the hidden shards and journals next to them;
+    not proxy, lease, or buffer files.
+
+    """
+    if not name.startswith('.'):
+        return filesystem.is_statefile(name)
+
+    return not set(name.split(os.extsep)).intersection(_LOCKFILES)
+
+
+def _subdirs(path):
+    """Walk the directories at and below `path`, leaving out hidden ones.
+
+    """
+    for dirpath, dirnames, filenames in scandir.walk(path):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        yield dirpath, filenames
+
+
+def _digests(state):
+    """Get a digest of each item of a state, for telling which changed.
+
+    """
+    digests = dict()
+    for key, value in state.items():
+        dump = json.dumps(value, sort_keys=True, default=list)
+        digests[key] = hashlib.sha1(dump.encode('utf-8')).digest()
+
+    return digests
+
+
+class _Inotify(object):
+    """Source of changes from Linux inotify.
+
+    Every directory below the root but hidden ones is watched; new ones are
+    watched as they appear.
+
+    """
+    def __init__(self, root, libc):
+        self.root = root
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+        self._wds = dict()
+        self._paths = dict()
+        try:
+            self._add(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, path):
+        """Watch `path` and the directories below it.
+
+        """
+        for dirpath, _ in _subdirs(path):
+            wd = self._libc.inotify_add_watch(self._fd, _encode(dirpath),
+                                              _MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e in (errno.ENOENT, errno.ENOTDIR):
+                    # gone before we got to it
+                    continue
+                raise OSError(e, "Cannot watch '{}': {}".format(
+                    dirpath, os.strerror(e)))
+
+            self._wds[wd] = dirpath
+            self._paths[dirpath] = wd
+
+    def _remove(self, path):
+        """Stop watching `path` and the directories below it.
+
+        """
+        prefix = path + os.sep
+        for dirpath in list(self._paths):
+            if dirpath == path or dirpath.startswith(prefix):
+                wd = self._paths.pop(dirpath)
+                del self._wds[wd]
+                # fails harmlessly for directories that are gone
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def wait(self, timeout):
+        select.select([self._fd], [], [], timeout)
+
+    def changes(self):
+        """Get the files and directories changed since last called.
+
+        :Returns:
+            *paths*
+                set of files that changed
+            *dirs*
+                set of directories that appeared, moved, or went away,
+                along with everything below them
+
+        """
+        paths = set()
+        dirs = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = _decode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost; everything may have changed
+                    self._remove(self.root)
+                    self._add(self.root)
+                    dirs.add(self.root)
+                    continue
+
+                directory = self._wds.get(wd)
+                if directory is None or not name:
+                    continue
+
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if name.startswith('.'):
+                        continue
+                    if mask & (IN_MOVED_FROM | IN_DELETE):
+                        self._remove(path)
+                    if mask & (IN_MOVED_TO | IN_CREATE):
+                        self._add(path)
+                    dirs.add(path)
+                elif _relevant(name):
+                    paths.add(path)
+
+        return paths, dirs
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class _Poller(object):
+    """Source of changes from polling the modification times of directories.
+
+    Journals are appended to in place, so those of known journal state
+    files are stat'ed as well.
+
+    """
+    def __init__(self, root):
+        self.root = root
+
+        # mtime, subdirectories, and state files of each directory
+        self._dirs = dict()
+        # (mtime, size) of each journal
+        self._journals = dict()
+        self._scan(root, set())
+
+    def _scan(self, path, dirs):
+        """List a directory, and any of its subdirectories not seen before.
+
+        """
+        try:
+            st = os.stat(path)
+            entries = list(scandir.scandir(path))
+        except OSError:
+            self._forget(path, dirs)
+            return set()
+
+        subdirs = set()
+        statefiles = set()
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            elif entry.is_dir(follow_symlinks=False):
+                subdirs.add(entry.path)
+                if entry.path not in self._dirs:
+                    dirs.add(entry.path)
+                    self._scan(entry.path, dirs)
+            elif filesystem.is_statefile(entry.name):
+                statefiles.add(entry.path)
+                if entry.name.endswith('.journal'):
+                    self._journals.setdefault(entry.path, self._stat(
+                        self._journal(entry.path)))
+
+        old = self._dirs.get(path)
+        if old is not None:
+            for subdir in old[1] - subdirs:
+                self._forget(subdir, dirs)
+            for statefile in old[2] - statefiles:
+                self._journals.pop(statefile, None)
+
+        self._dirs[path] = (getattr(st, 'st_mtime_ns', st.st_mtime),
+                            subdirs, statefiles)
+        return statefiles | (old[2] if old else set())
+
+    def _forget(self, path, dirs):
+        entry = self._dirs.pop(path, None)
+        if entry is None:
+            return
+
+        dirs.add(path)
+        for statefile in entry[2]:
+            self._journals.pop(statefile, None)
+        for subdir in entry[1]:
+            self._forget(subdir, dirs)
+
+    @staticmethod
+    def _journal(path):
+        return os.path.join(os.path.dirname(path),
+                            ".{}.log".format(os.path.basename(path)))
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+    def changes(self):
+        """Get the files and directories changed since last called.
+
+        :Returns:
+            *paths*
+                set of state files that may have changed
+            *dirs*
+                set of directories that appeared or went away, along with
+                everything below them
+
+        """
+        paths = set()
+        dirs = set()
+        for path in sorted(self._dirs):
+            entry = self._dirs.get(path)
+            if entry is None:
+                # forgotten along with a directory above
+                continue
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._forget(path, dirs)
+                continue
+
+            if getattr(st, 'st_mtime_ns', st.st_mtime) != entry[0]:
+                # state may be in shards next to the state file, so every
+                # state file in a changed directory is read again
+                paths.update(self._scan(path, dirs))
+
+        for journal, stamp in list(self._journals.items()):
+            current = self._stat(self._journal(journal))
+            if current != stamp:
+                self._journals[journal] = current
+                paths.add(journal)
+
+        return paths, dirs
+
+    def close(self):
+        pass
+
+
+class Watcher(object):
+    """Watcher publishing changes to the treants below a project root.
+
+    On creation, the states of all treants below the root are read, so
+    that changes to them can be told apart. Changes are then seen with each
+    call to :meth:`poll`, or in a thread of their own after :meth:`start`,
+    and an :class:`Update` published to each subscriber for every treant
+    whose state or location changed. A treant moved within the root is
+    published once, as a move; one moved into or out of it, as created or
+    removed.
+
+    Directories whose names begin with '.' are not watched, nor are
+    symbolic links to directories followed. Changes to treants kept in a
+    :class:`~datreant.core.backends.sqlite.RootStore` are seen by checking
+    the store for commits on every poll.
+
+    :Arguments:
+        *root*
+            directory to watch the treants below
+
+    :Keywords:
+        *interval*
+            seconds between checks when polling, and between checks of
+            stores when using inotify
+        *polling*
+            ``True`` to poll the filesystem for changes, ``False`` to use
+            inotify, or ``None`` to use inotify where it is available and
+            poll otherwise
+
+    """
+    def __init__(self, root, interval=1.0, polling=None):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+        self._source = None
+        if not polling:
+            libc = _libc()
+            if libc is None:
+                if polling is False:
+                    raise OSError(errno.ENOSYS, "inotify is not available")
+            else:
+                try:
+                    self._source = _Inotify(self.root, libc)
+                except OSError:
+                    # such as when out of watches
+                    if polling is False:
+                        raise
+
+        if self._source is None:
+            self._source = _Poller(self.root)
+
+        # uuid and item digests of each state file, by state file and by
+        # directory
+        self._known = dict()
+        self._bydir = dict()
+        self._storestamps = dict()
+        self._compare(self._find(self.root))
+        self._stores()
+
+    @property
+    def polling(self):
+        """``True`` if changes are seen by polling, not inotify.
+
+        """
+        return isinstance(self._source, _Poller)
+
+    def subscribe(self, callback):
+        """Call `callback` with every :class:`Update` published from now on.
+
+        Callbacks are called in the thread polling for changes; exceptions
+        they raise are not caught.
+
+        :Arguments:
+            *callback*
+                function taking an :class:`Update`
+
+        :Returns:
+            *callback*
+                the callback, so this can be used as a decorator
+
+        """
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """Stop calling `callback` with updates.
+
+        """
+        self._subscribers.remove(callback)
+
+    def poll(self, timeout=0):
+        """Publish updates for the changes made since the last poll.
+
+        :Keywords:
+            *timeout*
+                seconds to wait for a change if there was none
+
+        :Returns:
+            *updates*
+                list of the updates published
+
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                paths, dirs = self._source.changes()
+                updates = self._check(paths, dirs)
+                remaining = deadline - time.time()
+                if updates or remaining <= 0:
+                    break
+                self._source.wait(min(remaining, self.interval))
+
+        for update in updates:
+            for callback in list(self._subscribers):
+                callback(update)
+
+        return updates
+
+    def start(self):
+        """Publish updates from a thread polling for changes, until
+        :meth:`stop` is called.
+
+        """
+        if self._thread is not None:
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='datreant-watch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.poll(self.interval)
+
+    def stop(self):
+        """Stop the thread started by :meth:`start`, if any.
+
+        """
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """Stop watching; the watcher can't be used after this.
+
+        """
+        self.stop()
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _find(self, path):
+        """Get the state files at and below a directory.
+
+        """
+        found = set()
+        if os.path.isdir(path):
+            for dirpath, filenames in _subdirs(path):
+                found.update(os.path.join(dirpath, name)
+                             for name in filenames
+                             if filesystem.is_statefile(name))
+        return found
+
+    def _under(self, path):
+        """Get the known state files at and below a directory.
+
+        """
+        prefix = path + os.sep
+        found = set()
+        for dirpath, statefiles in self._bydir.items():
+            if dirpath == path or dirpath.startswith(prefix):
+                found.update(statefiles)
+        return found
+
+    def _owner(self, path):
+        """Get the known state file a hidden shard or journal belongs to.
+
+        """
+        directory, name = os.path.split(path)
+        for statefile in self._bydir.get(directory, ()):
+            if name.startswith(".{}.".format(os.path.basename(statefile))):
+                return statefile
+
+    def _stores(self):
+        """Get the known state files kept in stores that changed.
+
+        """
+        from .backends.sqlite import RootStore
+
+        stores = dict()
+        for path in self._known:
+            if path.endswith('.store'):
+                store = RootStore.find(os.path.dirname(path))
+                if store is not None:
+                    stores.setdefault(store, set()).add(path)
+
+        changed = set()
+        for store, paths in stores.items():
+            stamp = store.stamp()
+            if self._storestamps.get(store.filename) != stamp:
+                self._storestamps[store.filename] = stamp
+                changed.update(paths)
+
+        return changed
+
+    def _check(self, paths, dirs):
+        """Get updates for changes to the given files and directories.
+
+        """
+        touched = set()
+        for path in paths:
+            if filesystem.is_statefile(os.path.basename(path)):
+                touched.add(path)
+            else:
+                owner = self._owner(path)
+                if owner is not None:
+                    touched.add(owner)
+
+        for path in dirs:
+            touched.update(self._under(path))
+            touched.update(self._find(path))
+
+        touched.update(self._stores())
+        return self._compare(touched)
+
+    def _compare(self, paths):
+        """Read state files again, and get updates for those that changed.
+
+        """
+        from .backends.statefiles import readstates
+
+        existing = [path for path in paths if os.path.exists(path)]
+        states = readstates(existing)
+
+        updates = []
+        created = dict()
+        removed = dict()
+        for path in sorted(paths):
+            old = self._known.get(path)
+            if path in states:
+                new = _digests(states[path])
+            elif path in existing:
+                # can't be read right now; we'll see it when it's replaced
+                continue
+            else:
+                new = None
+
+            if old is None and new is None:
+                continue
+
+            uuid = os.path.basename(path).split(os.extsep)[1]
+            directory = os.path.dirname(path)
+            if new is None:
+                del self._known[path]
+                self._bydir[directory].discard(path)
+                if not self._bydir[directory]:
+                    del self._bydir[directory]
+                removed[uuid] = (path, old[1])
+                continue
+
+            self._known[path] = (uuid, new)
+            self._bydir.setdefault(directory, set()).add(path)
+            if old is None:
+                created[uuid] = (path, new)
+            else:
+                limbs = self._changed(old[1], new)
+                if limbs:
+                    updates.append(Update(uuid, path, path, limbs))
+
+        for uuid, (path, new) in created.items():
+            if uuid in removed:
+                oldpath, old = removed.pop(uuid)
+                updates.append(Update(uuid, path, oldpath,
+                                      self._changed(old, new)))
+            else:
+                updates.append(Update(uuid, path, None, frozenset(new)))
+
+        for uuid, (oldpath, old) in removed.items():
+            updates.append(Update(uuid, None, oldpath, frozenset(old)))
+
+        updates.sort(key=lambda u: (u.path or u.oldpath, u.uuid))
+        return updates
+
+    @staticmethod
+    def _changed(old, new):
+        return frozenset(key for key in set(old) | set(new)
+                         if old.get(key) != new.get(key))